@@ -1,52 +1,463 @@
 # Copyright 2023 Canonical
 # See LICENSE file for licensing details.
+"""Build the json schemas in docs/json_schemas from the pydantic schemas."""
+
+import argparse
+import hashlib
+import importlib.metadata
+import inspect
+import itertools
+import json
 import logging
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import Type
+from typing import (
+    TYPE_CHECKING,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Type,
+)
 
-import pydantic
-from interface_tester.collector import get_schemas
+if TYPE_CHECKING:
+    import pydantic
 
 logger = logging.getLogger(__file__)
 logging.basicConfig(level=logging.INFO)
 
 ROOT = Path(__file__).parent.parent
+# the schemas are loaded with utils.schema_registry, in this process and in the pool
+# workers, whether or not the root is on the PYTHONPATH
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
 JSON_SCHEMAS_ROOT = ROOT / "docs" / "json_schemas"
+MANIFEST_PATH = ROOT / "docs" / ".build-manifest.json"
+BUNDLE_PATH = JSON_SCHEMAS_ROOT / "bundle.json"
+
+# where the definitions of a jsonschema live, in pydantic v2 and v1 respectively
+_DEFS_KEYS = ("$defs", "definitions")
+# keys of a jsonschema whose values are data, not schemas
+_DATA_KEYS = ("const", "default", "enum", "examples")
+
+
+def _hash(data: str) -> str:
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def _get_toolchain() -> Dict[str, str]:
+    """Versions of the packages, and of this script, the output of the build depends on."""
+    toolchain = {
+        package: importlib.metadata.version(package)
+        for package in ("pydantic", "pytest-interface-tester")
+    }
+    # how the schemas are serialized is defined here
+    toolchain["build.py"] = _hash(Path(__file__).read_text())
+    return toolchain
+
+
+class BuildManifest:
+    """Hashes of the sources and outputs of the last build.
+
+    Used to skip the schemas whose source and outputs did not change since.
+    """
+
+    def __init__(self, path: Path = MANIFEST_PATH):
+        self.path = path
+        self._toolchain = _get_toolchain()
+        self._entries: Dict[str, dict] = {}
+        if path.exists():
+            try:
+                manifest = json.loads(path.read_text())
+            except json.JSONDecodeError:
+                logger.warning(f"ignoring corrupt build manifest {path}")
+            else:
+                # a different pydantic, or a different version of this script, may
+                # well serialize the same source differently
+                if manifest.get("toolchain") == self._toolchain:
+                    self._entries = manifest["sources"]
+
+    @staticmethod
+    def _get_key(path: Path) -> str:
+        return os.path.relpath(path, ROOT)
+
+    def is_up_to_date(self, schema_path: Path, source: str) -> bool:
+        """Whether the outputs of this source were built from it and left untouched."""
+        entry = self._entries.get(self._get_key(schema_path))
+        if not entry or entry["source"] != _hash(source):
+            return False
+        for output, output_hash in entry["outputs"].items():
+            output_path = ROOT / output
+            if (
+                not output_path.exists()
+                or _hash(output_path.read_text()) != output_hash
+            ):
+                return False
+        return True
+
+    def record(self, schema_path: Path, source: str, outputs: Dict[Path, str]):
+        """Record the outputs built from a source."""
+        self._entries[self._get_key(schema_path)] = {
+            "source": _hash(source),
+            "outputs": {
+                self._get_key(path): _hash(content) for path, content in outputs.items()
+            },
+        }
+
+    def save(self):
+        manifest = {"toolchain": self._toolchain, "sources": self._entries}
+        self.path.write_text(json.dumps(manifest, indent=2, sort_keys=True))
+
+
+def _normalize_descriptions(obj):
+    """Clean up all descriptions in a jsonschema like docstrings, leaving data alone."""
+    if isinstance(obj, dict):
+        return {
+            key: (
+                inspect.cleandoc(value)
+                if key == "description" and isinstance(value, str)
+                else value if key in _DATA_KEYS else _normalize_descriptions(value)
+            )
+            for key, value in obj.items()
+        }
+    if isinstance(obj, list):
+        return [_normalize_descriptions(item) for item in obj]
+    return obj
+
+
+def canonical_json_schema(json_schema: dict) -> str:
+    """Serialize a jsonschema so that the same schema always gives the same bytes.
 
+    Keys are sorted, the definitions are in "$defs" whatever the pydantic version, and
+    descriptions are cleaned up like docstrings.
+    """
+    if "definitions" in json_schema:
+        # pydantic v1
+        json_schema = dict(json_schema)
+        definitions = json_schema.pop("definitions")
+        names = {name: name for name in definitions}
+        json_schema = _rename_refs(json_schema, names)
+        json_schema["$defs"] = {
+            **json_schema.get("$defs", {}),
+            **_rename_refs(definitions, names),
+        }
+    return (
+        json.dumps(_normalize_descriptions(json_schema), indent=2, sort_keys=True)
+        + "\n"
+    )
 
-def dump_json_schema(schema_cls: Type[pydantic.BaseModel], output_location: Path):
-    """Serialize pydantic schema to jsonschema and output it to file"""
+
+def dump_json_schema(
+    schema_cls: Type["pydantic.BaseModel"], output_location: Path, write: bool = True
+) -> str:
+    """Serialize pydantic schema to jsonschema and output it to file.
+
+    The file is left untouched if its contents would not change, or if not `write`.
+    Returns the jsonschema.
+    """
     json_schema_file_name = output_location.with_suffix(".json")
+    # pydantic v2, or v1
+    get_json_schema = (
+        getattr(schema_cls, "model_json_schema", None) or schema_cls.schema
+    )
+    json_schema = canonical_json_schema(get_json_schema())
+    if not write:
+        return json_schema
     if json_schema_file_name.exists():
+        if json_schema_file_name.read_text() == json_schema:
+            logger.debug(f"file {json_schema_file_name} is up to date")
+            return json_schema
         logger.info(f"file {json_schema_file_name} exists; overwriting...")
     else:
         json_schema_file_name.parent.mkdir(exist_ok=True, parents=True)
 
     logger.info(f"dumping jsonschema for {schema_cls} to {json_schema_file_name}")
-    json_schema = schema_cls.schema_json(indent=2)
     json_schema_file_name.write_text(json_schema)
+    return json_schema
 
 
-def build_schemas_from_source(
-    schema_path: Path,
-    output_location: Path = JSON_SCHEMAS_ROOT,
-):
-    """Load the schemas from schema.py, dump them to docs/json_schemas/<role>.json."""
-    for role, schema_cls in get_schemas(schema_path).items():
+def _compile_schemas(
+    schema_path: Path, output_location: Path, write: bool = True
+) -> Dict[Path, str]:
+    """Dump the schemas defined in schema.py; return the contents of each output."""
+    # imported here, as it is slow to import and not needed if nothing changed
+    from utils.schema_registry import registry
+
+    outputs = {}
+    for role, schema_cls in registry.load(schema_path).items():
         # if the schema is at /path/to/interfaces/foo/v3/schema.py,
         # we take [foo, v3]
         # the output path becomes /path/to/output_location/foo/v3/{role}.json`
         output_path = output_location.joinpath(*schema_path.parts[-3:-1], role)
-        dump_json_schema(schema_cls, output_location=output_path)
+        json_schema = dump_json_schema(schema_cls, output_path, write)
+        outputs[output_path.with_suffix(".json")] = json_schema
+    return outputs
+
+
+def build_schemas_from_source(
+    schema_path: Path,
+    output_location: Path = JSON_SCHEMAS_ROOT,
+    manifest: Optional[BuildManifest] = None,
+):
+    """Load the schemas from schema.py, dump them to docs/json_schemas/<role>.json.
+
+    If a manifest is given, sources it records as already built are skipped.
+    """
+    source = schema_path.read_text()
+    if manifest and manifest.is_up_to_date(schema_path, source):
+        logger.debug(f"{schema_path} is unchanged; skipping")
+        return
+
+    outputs = _compile_schemas(schema_path, output_location)
+    if manifest:
+        manifest.record(schema_path, source, outputs)
+
+
+class _ErrorCollector(logging.Handler):
+    """Collects the errors logged by a pool worker, to report them at the end of the build."""
+
+    def __init__(self):
+        super().__init__(logging.ERROR)
+        self.errors: List[str] = []
+
+    def emit(self, record: logging.LogRecord):
+        self.errors.append(record.getMessage())
+
+
+_error_collector = _ErrorCollector()
+
+
+def _init_worker():
+    root = logging.getLogger()
+    for handler in root.handlers:
+        handler.addFilter(lambda record: record.levelno < logging.ERROR)
+    root.addHandler(_error_collector)
+
+
+def _build_in_worker(
+    schema_path: Path, output_location: Path, write: bool = True
+) -> Tuple[Dict[Path, str], List[str]]:
+    """Compile the schemas of a source; return the outputs and the errors logged."""
+    _error_collector.errors = []
+    try:
+        outputs = _compile_schemas(schema_path, output_location, write)
+    except Exception as e:
+        logger.error(f"Failed to build {schema_path}: {e!r}")
+        outputs = {}
+    return outputs, _error_collector.errors
+
+
+def build_schemas(
+    schema_paths: Iterable[Path],
+    output_location: Path = JSON_SCHEMAS_ROOT,
+    manifest: Optional[BuildManifest] = None,
+    jobs: Optional[int] = None,
+    would_change: Optional[List[Path]] = None,
+) -> List[str]:
+    """Build the schemas of many sources on a pool of `jobs` processes.
+
+    The sources are built in a deterministic order regardless of the pool. Returns the
+    errors encountered, instead of logging them as they occur.
+    If a `would_change` list is given, nothing is written: the outputs that differ
+    from the files are added to it instead.
+    """
+    sources = {}
+    for schema_path in sorted(schema_paths):
+        source = schema_path.read_text()
+        if manifest and manifest.is_up_to_date(schema_path, source):
+            logger.debug(f"{schema_path} is unchanged; skipping")
+            continue
+        logger.info(f"Found schema: building {schema_path}")
+        sources[schema_path] = source
+    if not sources:
+        return []
+
+    errors = []
+    with ProcessPoolExecutor(jobs, initializer=_init_worker) as pool:
+        results = pool.map(
+            _build_in_worker,
+            sources,
+            itertools.repeat(output_location),
+            itertools.repeat(would_change is None),
+        )
+        for (schema_path, source), (outputs, source_errors) in zip(
+            sources.items(), results
+        ):
+            errors.extend(source_errors)
+            if would_change is not None:
+                would_change.extend(
+                    path
+                    for path, content in outputs.items()
+                    if not path.exists() or path.read_text() != content
+                )
+            # not recorded if it failed, so that the next build retries it
+            if manifest and not source_errors:
+                manifest.record(schema_path, source, outputs)
+    return errors
+
+
+def _get_refs(obj) -> Iterator[str]:
+    """Get the names of the definitions referenced anywhere in a jsonschema."""
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            if key == "$ref" and isinstance(value, str):
+                prefix, _, name = value.rpartition("/")
+                if prefix in (f"#/{defs_key}" for defs_key in _DEFS_KEYS):
+                    yield name
+            else:
+                yield from _get_refs(value)
+    elif isinstance(obj, list):
+        for item in obj:
+            yield from _get_refs(item)
+
+
+def _rename_refs(obj, names: Dict[str, str]):
+    """Point the references of a jsonschema to the renamed root-level definitions."""
+    if isinstance(obj, dict):
+        return {
+            key: (
+                f"#/$defs/{names[value.rpartition('/')[2]]}"
+                if key == "$ref" and value.rpartition("/")[2] in names
+                else _rename_refs(value, names)
+            )
+            for key, value in obj.items()
+        }
+    if isinstance(obj, list):
+        return [_rename_refs(item, names) for item in obj]
+    return obj
+
+
+def _bundle_schema(schema: dict, bundle_defs: Dict[str, dict]) -> dict:
+    """Move the definitions of a jsonschema to the bundle's; return what is left of it.
+
+    Definitions are shared with the other schemas of the bundle if they are identical,
+    including all the definitions they reference; otherwise they are renamed.
+    """
+    schema = dict(schema)
+    local_defs = {}
+    for defs_key in _DEFS_KEYS:
+        local_defs.update(schema.pop(defs_key, {}))
+
+    names = {}
+    for name in sorted(local_defs):
+        # the definition, along with everything it references, directly or not
+        closure, queue = {}, [name]
+        while queue:
+            dependency = queue.pop()
+            if dependency not in closure and dependency in local_defs:
+                closure[dependency] = local_defs[dependency]
+                queue.extend(_get_refs(local_defs[dependency]))
+        fingerprint = _hash(json.dumps(closure, sort_keys=True))[:8]
+        names[name] = name
+        if name in bundle_defs and bundle_defs[name][0] != fingerprint:
+            names[name] = f"{name}_{fingerprint}"
+        bundle_defs.setdefault(names[name], (fingerprint, None))
+
+    for name, definition in local_defs.items():
+        fingerprint, _ = bundle_defs[names[name]]
+        bundle_defs[names[name]] = (fingerprint, _rename_refs(definition, names))
+    return _rename_refs(schema, names)
+
+
+def build_bundle(
+    schemas_root: Path = JSON_SCHEMAS_ROOT, bundle_path: Path = BUNDLE_PATH
+) -> dict:
+    """Bundle all the json schemas built in schemas_root into a single compact file.
+
+    The schemas are keyed by "<interface>/v<version>/<role>", and their definitions
+    deduplicated into the root-level "$defs" of the bundle. The "sha256" is that of the
+    bundle without it, serialized as in the file.
+    """
+    bundle, serialized = _get_bundle(schemas_root)
+    if not bundle_path.exists() or bundle_path.read_text() != serialized:
+        logger.info(f"dumping {len(bundle['schemas'])} json schemas to {bundle_path}")
+        bundle_path.write_text(serialized)
+    return bundle
+
+
+def _get_bundle(schemas_root: Path) -> Tuple[dict, str]:
+    bundle_defs: Dict[str, Tuple[str, dict]] = {}
+    schemas = {}
+    for path in sorted(schemas_root.glob("*/v*/*.json")):
+        # only <interface>/v<version>/<role>.json: leave out whatever else lies around
+        if not path.parent.name[1:].isdigit():
+            continue
+        key = "/".join(path.relative_to(schemas_root).with_suffix("").parts)
+        schemas[key] = _bundle_schema(json.loads(path.read_text()), bundle_defs)
+
+    bundle = {
+        "$defs": {name: definition for name, (_, definition) in bundle_defs.items()},
+        "schemas": schemas,
+    }
+    serialized = json.dumps(bundle, separators=(",", ":"), sort_keys=True)
+    bundle = {"sha256": _hash(serialized), **bundle}
+    return bundle, json.dumps(bundle, separators=(",", ":"), sort_keys=True)
+
+
+def _get_schema_paths() -> Iterator[Path]:
+    return (
+        path
+        for path in (ROOT / "interfaces").rglob("schema.py")
+        if "__template__" not in path.__str__()
+    )
+
+
+def _log_errors(errors: List[str]):
+    if errors:
+        logger.error(f"{len(errors)} errors building the json schemas:")
+        for error in errors:
+            logger.error(error)
+
+
+def check(jobs: Optional[int] = None) -> Tuple[List[Path], List[str]]:
+    """Get the json schemas, and the bundle, that a full build would change.
+
+    Also returns the errors building the schemas: their files can't be checked.
+    """
+    would_change = []
+    errors = build_schemas(_get_schema_paths(), jobs=jobs, would_change=would_change)
+    _log_errors(errors)
+    if (
+        not BUNDLE_PATH.exists()
+        or BUNDLE_PATH.read_text() != _get_bundle(JSON_SCHEMAS_ROOT)[1]
+    ):
+        would_change.append(BUNDLE_PATH)
+    for path in would_change:
+        logger.error(f"{path} is out of date")
+    return would_change, errors
 
 
-def run():
-    """Build all json schemas."""
-    for path in (ROOT / "interfaces").rglob("schema.py"):
-        if "__template__" not in path.__str__():
-            logger.info(f"Found schema: building {path}")
-            build_schemas_from_source(path)
+def run(jobs: Optional[int] = None) -> List[str]:
+    """Build all json schemas whose source changed since the last build."""
+    manifest = BuildManifest()
+    errors = build_schemas(_get_schema_paths(), manifest=manifest, jobs=jobs)
+    manifest.save()
+    # from the files, as only the changed schemas were built
+    build_bundle()
+    _log_errors(errors)
+    return errors
 
 
 if __name__ == "__main__":
-    run()
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=None,
+        help="Number of processes to build the schemas with. Default: one per CPU.",
+    )
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="Do not write anything; exit with an error if the build would change files "
+        "or fails.",
+    )
+    args = parser.parse_args()
+    if args.check:
+        would_change, errors = check(args.jobs)
+        sys.exit(1 if would_change or errors else 0)
+    sys.exit(1 if run(args.jobs) else 0)
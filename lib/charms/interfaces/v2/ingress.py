@@ -50,13 +50,26 @@ class SomeCharm(CharmBase):
     def _on_ingress_revoked(self, event: IngressPerAppRevokedEvent):
         logger.info("This app no longer has ingress")
 """
+import functools
 import ipaddress
 import json
 import logging
 import socket
+import time
 import typing
 from dataclasses import dataclass
-from typing import Any, Callable, Dict, List, MutableMapping, Optional, Sequence, Tuple, Union
+from typing import (
+    Any,
+    Callable,
+    ClassVar,
+    Dict,
+    List,
+    MutableMapping,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
 
 import pydantic
 from ops.charm import CharmBase, RelationBrokenEvent, RelationEvent
@@ -71,7 +84,7 @@ LIBAPI = 2
 
 # Increment this PATCH version before using `charmcraft publish-lib` or reset
 # to 0 if you are raising the major API version
-LIBPATCH = 0
+LIBPATCH = 6
 
 PYDEPS = ["pydantic"]
 
@@ -81,6 +94,25 @@ RELATION_INTERFACE = "ingress"
 log = logging.getLogger(__name__)
 BUILTIN_JUJU_KEYS = {"ingress-address", "private-address", "egress-subnets"}
 
+
+def _write_databag(databag: MutableMapping, contents: Dict[str, str], clear: bool) -> int:
+    """Write to a databag only the keys whose value changes.
+
+    Every write to a relation databag is a call to Juju, and may wake up the remote
+    units with a relation-changed event: the keys that already hold the value are left
+    alone, and so are the keys Juju sets itself.
+
+    Returns the number of writes that were skipped as they would change nothing.
+    """
+    if clear:
+        for key in [k for k in databag if k not in contents and k not in BUILTIN_JUJU_KEYS]:
+            del databag[key]
+    changed = {k: v for k, v in contents.items() if databag.get(k) != v}
+    if changed:
+        databag.update(changed)
+    return len(contents) - len(changed)
+
+
 PYDANTIC_IS_V1 = int(pydantic.version.VERSION.split(".")[0]) < 2
 if PYDANTIC_IS_V1:
 
@@ -95,18 +127,28 @@ if PYDANTIC_IS_V1:
 
         _NEST_UNDER = None
 
+        suppressed_writes: ClassVar[int] = 0
+        """How many writes dump skipped, across all models, as they would change nothing."""
+
+        @classmethod
+        @functools.lru_cache(maxsize=None)
+        def _aliases(cls) -> typing.FrozenSet[str]:
+            """The databag keys of this model's fields."""
+            return frozenset(f.alias for f in cls.__fields__.values())  # type: ignore
+
         @classmethod
         def load(cls, databag: MutableMapping):
             """Load this model from a Juju databag."""
             if cls._NEST_UNDER:
                 return cls.parse_obj(json.loads(databag[cls._NEST_UNDER]))
 
+            aliases = cls._aliases()
             try:
                 data = {
                     k: json.loads(v)
                     for k, v in databag.items()
                     # Don't attempt to parse model-external values
-                    if k in {f.alias for f in cls.__fields__.values()}  # type: ignore
+                    if k in aliases
                 }
             except json.JSONDecodeError as e:
                 msg = f"invalid databag contents: expecting json. {databag}"
@@ -114,7 +156,7 @@ if PYDANTIC_IS_V1:
                 raise DataValidationError(msg) from e
 
             try:
-                return cls.parse_raw(json.dumps(data))  # type: ignore
+                return cls.parse_obj(data)  # type: ignore
             except pydantic.ValidationError as e:
                 msg = f"failed to validate databag: {databag}"
                 log.debug(msg, exc_info=True)
@@ -123,22 +165,21 @@ if PYDANTIC_IS_V1:
         def dump(self, databag: Optional[MutableMapping] = None, clear: bool = True):
             """Write the contents of this model to Juju databag.
 
+            Only the keys whose value changes are written.
+
             :param databag: the databag to write the data to.
-            :param clear: ensure the databag is cleared before writing it.
+            :param clear: ensure the databag holds no other keys than this model's.
             """
-            if clear and databag:
-                databag.clear()
-
             if databag is None:
                 databag = {}
 
             if self._NEST_UNDER:
-                databag[self._NEST_UNDER] = self.json(by_alias=True, exclude_defaults=True)
-                return databag
-
-            for key, value in self.dict(by_alias=True, exclude_defaults=True).items():  # type: ignore
-                databag[key] = json.dumps(value)
+                contents = {self._NEST_UNDER: self.json(by_alias=True, exclude_defaults=True)}
+            else:
+                dct = self.dict(by_alias=True, exclude_defaults=True)  # type: ignore
+                contents = {key: json.dumps(value) for key, value in dct.items()}
 
+            DatabagModel.suppressed_writes += _write_databag(databag, contents, clear)
             return databag
 
 else:
@@ -158,6 +199,15 @@ else:
         )  # type: ignore
         """Pydantic config."""
 
+        suppressed_writes: ClassVar[int] = 0
+        """How many writes dump skipped, across all models, as they would change nothing."""
+
+        @classmethod
+        @functools.lru_cache(maxsize=None)
+        def _aliases(cls) -> typing.FrozenSet[str]:
+            """The databag keys of this model's fields."""
+            return frozenset((f.alias or n) for n, f in cls.model_fields.items())
+
         @classmethod
         def load(cls, databag: MutableMapping):
             """Load this model from a Juju databag."""
@@ -165,12 +215,13 @@ else:
             if nest_under:
                 return cls.model_validate(json.loads(databag[nest_under]))  # type: ignore
 
+            aliases = cls._aliases()
             try:
                 data = {
                     k: json.loads(v)
                     for k, v in databag.items()
                     # Don't attempt to parse model-external values
-                    if k in {(f.alias or n) for n, f in cls.__fields__.items()}  # type: ignore
+                    if k in aliases
                 }
             except json.JSONDecodeError as e:
                 msg = f"invalid databag contents: expecting json. {databag}"
@@ -178,7 +229,9 @@ else:
                 raise DataValidationError(msg) from e
 
             try:
-                return cls.model_validate_json(json.dumps(data))  # type: ignore
+                # the values are decoded already: validate them as they are, rather
+                # than serializing them back to json for model_validate_json
+                return cls.model_validate(data)  # type: ignore
             except pydantic.ValidationError as e:
                 msg = f"failed to validate databag: {databag}"
                 log.debug(msg, exc_info=True)
@@ -187,25 +240,29 @@ else:
         def dump(self, databag: Optional[MutableMapping] = None, clear: bool = True):
             """Write the contents of this model to Juju databag.
 
+            Only the keys whose value changes are written.
+
             :param databag: the databag to write the data to.
-            :param clear: ensure the databag is cleared before writing it.
+            :param clear: ensure the databag holds no other keys than this model's.
             """
-            if clear and databag:
-                databag.clear()
-
             if databag is None:
                 databag = {}
             nest_under = self.model_config.get("_NEST_UNDER")
             if nest_under:
-                databag[nest_under] = self.model_dump_json(  # type: ignore
-                    by_alias=True,
-                    # skip keys whose values are default
-                    exclude_defaults=True,
+                contents = {
+                    nest_under: self.model_dump_json(  # type: ignore
+                        by_alias=True,
+                        # skip keys whose values are default
+                        exclude_defaults=True,
+                    )
+                }
+            else:
+                dct = self.model_dump(  # type: ignore
+                    mode="json", by_alias=True, exclude_defaults=True
                 )
-                return databag
+                contents = {k: json.dumps(v) for k, v in dct.items()}
 
-            dct = self.model_dump(mode="json", by_alias=True, exclude_defaults=True)  # type: ignore
-            databag.update({k: json.dumps(v) for k, v in dct.items()})
+            DatabagModel.suppressed_writes += _write_databag(databag, contents, clear)
             return databag
 
 
@@ -451,6 +508,11 @@ class IngressPerAppProvider(_IngressPerAppBase):
                 (defaults to "ingress").
         """
         super().__init__(charm, relation_name)
+        # The data validated during this dispatch, by relation id, along with a snapshot
+        # of the databags it was validated from. As the charm is instantiated anew for
+        # every event, these only live as long as the dispatch.
+        self._requirer_data: Dict[int, Tuple[Any, IngressRequirerData]] = {}
+        self._provider_app_data: Dict[int, Tuple[Any, "IngressProviderAppData"]] = {}
 
     def _handle_relation(self, event):
         # created, joined or changed: if remote side has sent the required data:
@@ -508,14 +570,39 @@ class IngressPerAppProvider(_IngressPerAppBase):
         databag = relation.data[app]
         return IngressRequirerAppData.load(databag)
 
+    @staticmethod
+    def _snapshot_databag(databag: MutableMapping) -> Tuple[Tuple[str, str], ...]:
+        return tuple(sorted(databag.items()))
+
+    def _snapshot_requirer_data(self, relation: Relation):
+        """Snapshot the databags the requirer data is validated from."""
+        app_databag = relation.data[relation.app] if relation.app else {}
+        return (
+            self._snapshot_databag(app_databag),
+            tuple(
+                (unit.name, self._snapshot_databag(relation.data[unit]))
+                for unit in relation.units
+            ),
+        )
+
     def get_data(self, relation: Relation) -> IngressRequirerData:
-        """Fetch the remote (requirer) app and units' databags."""
+        """Fetch the remote (requirer) app and units' databags.
+
+        The data is validated once per dispatch, and again only if the databags change.
+        """
+        snapshot = self._snapshot_requirer_data(relation)
+        cached = self._requirer_data.get(relation.id)
+        if cached and cached[0] == snapshot:
+            return cached[1]
+
         try:
-            return IngressRequirerData(
+            data = IngressRequirerData(
                 self._get_requirer_app_data(relation), self._get_requirer_units_data(relation)
             )
         except (pydantic.ValidationError, DataValidationError) as e:
             raise DataValidationError("failed to validate ingress requirer data") from e
+        self._requirer_data[relation.id] = (snapshot, data)
+        return data
 
     def is_ready(self, relation: Optional[Relation] = None):
         """The Provider is ready if the requirer has sent valid data."""
@@ -543,13 +630,48 @@ class IngressPerAppProvider(_IngressPerAppBase):
         if not databag.get("ingress"):
             raise NotReadyError("This application did not `publish_url` yet.")
 
-        return IngressProviderAppData.load(databag)
+        snapshot = self._snapshot_databag(databag)
+        cached = self._provider_app_data.get(relation.id)
+        if cached and cached[0] == snapshot:
+            return cached[1]
+
+        data = IngressProviderAppData.load(databag)
+        self._provider_app_data[relation.id] = (snapshot, data)
+        return data
 
     def publish_url(self, relation: Relation, url: str):
         """Publish to the app databag the ingress url."""
         ingress_url = {"url": url}
         IngressProviderAppData(ingress=ingress_url).dump(relation.data[self.app])  # type: ignore
 
+    def publish_urls(self, urls: Dict[Relation, str]) -> Dict[Relation, Exception]:
+        """Publish to the app databags the ingress url of each relation.
+
+        Each distinct url is validated once, and only the databags whose url changes are
+        written. A relation whose url is invalid, or whose databag can't be written, does
+        not stop the others from being published: it is returned along with the error.
+        """
+        validated: Dict[str, Union["IngressProviderAppData", DataValidationError]] = {}
+        errors: Dict[Relation, Exception] = {}
+        for relation, url in urls.items():
+            if url not in validated:
+                try:
+                    validated[url] = IngressProviderAppData(ingress={"url": url})  # type: ignore
+                except pydantic.ValidationError as e:
+                    log.debug(f"invalid ingress url {url!r}", exc_info=True)
+                    validated[url] = DataValidationError(f"invalid ingress url {url!r}: {e}")
+            data = validated[url]
+            if isinstance(data, DataValidationError):
+                errors[relation] = data
+                continue
+
+            try:
+                data.dump(relation.data[self.app])
+            except ModelError as e:
+                log.warning(f"error {e} publishing the ingress url to {relation}")
+                errors[relation] = e
+        return errors
+
     @property
     def proxied_endpoints(self) -> Dict[str, Dict[str, str]]:
         """Returns the ingress settings provided to applications by this IngressPerAppProvider.
@@ -589,7 +711,7 @@ class IngressPerAppProvider(_IngressPerAppBase):
             if PYDANTIC_IS_V1:
                 results[ingress_relation.app.name] = ingress_data.ingress.dict()
             else:
-                results[ingress_relation.app.name] = ingress_data.ingress.model_dump(mode=json)  # type: ignore
+                results[ingress_relation.app.name] = ingress_data.ingress.model_dump(mode="json")  # type: ignore
         return results
 
 
@@ -634,6 +756,7 @@ class IngressPerAppRequirer(_IngressPerAppBase):
         # fixme: this is horrible UX.
         #  shall we switch to manually calling provide_ingress_requirements with all args when ready?
         scheme: Union[Callable[[], str], str] = lambda: "http",
+        resolution_ttl: Optional[float] = None,
     ):
         """Constructor for IngressRequirer.
 
@@ -654,6 +777,10 @@ class IngressPerAppRequirer(_IngressPerAppBase):
             redirect_https: redirect incoming requests to HTTPS.
             scheme: callable returning the scheme to use when constructing the ingress url.
                 Or a string, if the scheme is known and stable at charm-init-time.
+            resolution_ttl: how long, in seconds, the FQDN of the unit remains valid once
+                resolved. It is resolved once per dispatch; if set, it is also stored, and
+                reused by the following dispatches. The bind addresses are resolved once
+                per dispatch regardless, as they change when the pod restarts.
 
         Request Args:
             port: the port of the service
@@ -665,7 +792,15 @@ class IngressPerAppRequirer(_IngressPerAppBase):
         self._redirect_https = redirect_https
         self._get_scheme = scheme if callable(scheme) else lambda: scheme
 
-        self._stored.set_default(current_url=None)  # type: ignore
+        self._stored.set_default(current_url=None, resolved=None)  # type: ignore
+
+        # the FQDN and the bind addresses by relation id, resolved once per dispatch:
+        # the first is a DNS lookup, the others a call to Juju
+        self._resolution_ttl = resolution_ttl
+        self._fqdn: Optional[str] = None
+        self._bind_addresses: Dict[int, Optional[str]] = {}
+        self._resolved_at = time.time()
+        self._load_resolved()
 
         # if instantiated with a port, and we are related, then
         # we immediately publish our ingress data  to speed up the process.
@@ -743,6 +878,41 @@ class IngressPerAppRequirer(_IngressPerAppBase):
 
         self._publish_unit_data(host, ip, relation)
 
+    def _load_resolved(self):
+        """Reuse what a previous dispatch resolved, unless it expired."""
+        resolved = self._stored.resolved  # type: ignore
+        if not (self._resolution_ttl and resolved):
+            return
+        if time.time() - resolved["at"] > self._resolution_ttl:
+            return
+        self._resolved_at = resolved["at"]
+        self._fqdn = resolved["fqdn"]
+
+    def _save_resolved(self):
+        if not self._resolution_ttl:
+            return
+        self._stored.resolved = {"at": self._resolved_at, "fqdn": self._fqdn}  # type: ignore
+
+    def _get_fqdn(self) -> str:
+        if self._fqdn is None:
+            self._fqdn = socket.getfqdn()
+            self._save_resolved()
+        return self._fqdn
+
+    def _get_bind_address(self, relation: Relation) -> Optional[str]:
+        if relation.id not in self._bind_addresses:
+            address = None
+            network_binding = self.charm.model.get_binding(relation)
+            if (
+                network_binding is not None
+                and (bind_address := network_binding.network.bind_address) is not None
+            ):
+                address = str(bind_address)
+            else:
+                log.error("failed to retrieve ip information from juju")
+            self._bind_addresses[relation.id] = address
+        return self._bind_addresses[relation.id]
+
     def _publish_unit_data(
         self,
         host: Optional[str],
@@ -750,17 +920,10 @@ class IngressPerAppRequirer(_IngressPerAppBase):
         relation: Relation,
     ):
         if not host:
-            host = socket.getfqdn()
+            host = self._get_fqdn()
 
         if ip is None:
-            network_binding = self.charm.model.get_binding(relation)
-            if (
-                network_binding is not None
-                and (bind_address := network_binding.network.bind_address) is not None
-            ):
-                ip = str(bind_address)
-            else:
-                log.error("failed to retrieve ip information from juju")
+            ip = self._get_bind_address(relation)
 
         unit_databag = relation.data[self.unit]
         try:
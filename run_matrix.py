@@ -3,18 +3,43 @@
 # Copyright 2023 Canonical Ltd.
 # See LICENSE file for licensing details.
 
+import asyncio
+import contextlib
+import contextvars
+import dataclasses
+import functools
+import hashlib
+import importlib.metadata
 import json
 import logging
 import os
+import shlex
 import shutil
+import signal
 import subprocess
+import threading
+import time
+import xml.etree.ElementTree as ET
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import TYPE_CHECKING, Dict, Iterable, List, Literal, Tuple
+from typing import (
+    TYPE_CHECKING,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Literal,
+    Optional,
+    Set,
+    Tuple,
+)
 
 from github import Github
 from interface_tester.collector import collect_tests
 
+from utils import interface_yaml, schema_registry
+
 if TYPE_CHECKING:
     from interface_tester.collector import _CharmTestConfig, _RoleTestSpec
 
@@ -31,12 +56,70 @@ if TYPE_CHECKING:
 
 # it is "python -m venv" on some platforms/python versions
 MKVENV_CMD = os.getenv("MKVENV_CMD", "python -m virtualenv")
+# venvs are shared by all charms with the same dependencies; kept across runs with --keep-cache.
+VENV_CACHE_PATH = Path(
+    os.getenv("VENV_CACHE_PATH", "/tmp/charm-relation-interfaces-venvs/")
+)
+# version of pytest-interface-tester to install in the venvs; defaults to the one we run with.
+INTERFACE_TESTER_VERSION = os.getenv(
+    "INTERFACE_TESTER_VERSION"
+) or importlib.metadata.version("pytest-interface-tester")
+# marks a cached venv whose setup completed successfully
+_VENV_READY_MARKER = ".ready"
+# installed in every venv, on top of the charm's requirements
+_VENV_BASE_PACKAGES = (
+    f"setuptools pytest pytest-interface-tester=={INTERFACE_TESTER_VERSION}"
+)
+# verdicts of previous runs, reused by --incremental runs
+RESULTS_CACHE_PATH = Path(
+    os.getenv("RESULTS_CACHE_PATH", "/tmp/charm-relation-interfaces-results.json")
+)
+# durations and outcomes of previous runs, used to schedule the charms
+HISTORY_PATH = Path(
+    os.getenv("HISTORY_PATH", "/tmp/charm-relation-interfaces-history.json")
+)
+
+# where the charm repositories are checked out
+TESTS_ROOT = Path("/tmp/charm-relation-interfaces-tests/")
 
 FIXTURE_PATH = "tests/interface/conftest.py"
 FIXTURE_IDENTIFIER = "interface_tester"
 logging.getLogger().setLevel(logging.INFO)
 
 FixtureSpec = namedtuple("FixtureSpec", "path id")
+# a single charm to be tested against a single interface version, in a given role
+CharmTestSpec = namedtuple("CharmTestSpec", "interface version role charm_config")
+
+# name of the charm being set up or tested in the current worker;
+# with --jobs > 1 the logs of several charms are interleaved, so we tag each record with it.
+_current_charm: contextvars.ContextVar[str] = contextvars.ContextVar(
+    "current_charm", default=""
+)
+
+
+class _CharmLogFilter(logging.Filter):
+    """Prefix log records with the name of the charm they refer to, if any."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        charm = _current_charm.get()
+        if charm:
+            record.msg = f"[{charm}] {record.msg}"
+        return True
+
+
+logging.getLogger().addFilter(_CharmLogFilter())
+
+
+# outcomes of testing a charm against an interface
+PASSED = "PASSED"
+FAILED = "FAILED"
+# the charm could not be set up; the tests did not run at all.
+SETUP_FAILED = "SETUP_FAILED"
+# a phase exceeded its time or memory limit and was killed.
+KILLED = "KILLED"
+
+# phases of setting up and testing a charm
+PHASES = ("clone", "pre_run", "venv", "pytest")
 
 
 class SetupError(Exception):
@@ -47,10 +130,351 @@ class InterfaceTestError(Exception):
     pass
 
 
-def _clone_charm_repo(charm_config: "_CharmTestConfig", charm_path: Path):
+class ResourceLimitError(Exception):
+    """Raised when a phase is killed for exceeding its time or memory limit."""
+
+
+@dataclasses.dataclass(frozen=True)
+class PhaseLimits:
+    """Resource limits for the processes of a phase."""
+
+    # wall-clock limit, in seconds
+    timeout: Optional[float] = None
+    # limit on the resident memory of all processes together, in MiB
+    memory: Optional[int] = None
+
+
+# the types the limits of a charm's test_setup are converted to, by field
+_PHASE_LIMIT_TYPES = {"timeout": float, "memory": int}
+
+# applied unless overridden from the command line or by a charm's test_setup
+DEFAULT_PHASE_LIMITS = {"pre_run": PhaseLimits(timeout=60)}
+
+
+@dataclasses.dataclass
+class CharmTestResult:
+    """Outcome of testing a charm against an interface version, in a given role."""
+
+    status: str
+    # why the test failed or could not run
+    reason: Optional[str] = None
+    # seconds spent in the test function, as reported by pytest
+    duration: Optional[float] = None
+    # whether the status was reused from a previous run
+    cached: bool = False
+
+
+@dataclasses.dataclass
+class CharmReport:
+    """Outcome and timings of setting up and testing a single charm."""
+
+    name: str
+    # seconds spent in each phase: clone, pre_run, venv, pytest
+    durations: Dict[str, float] = dataclasses.field(default_factory=dict)
+    # exit code of the pytest session, if it ran
+    exit_code: Optional[int] = None
+    # the commit the charm was tested at, if it got checked out
+    commit: Optional[str] = None
+    setup_error: Optional[str] = None
+    results: Dict[CharmTestSpec, CharmTestResult] = dataclasses.field(
+        default_factory=dict
+    )
+
+
+@dataclasses.dataclass(frozen=True)
+class ConcurrencyLimits:
+    """How many phases using each class of resources may run at the same time."""
+
+    # git clones and pre_run scripts
+    network: int = 1
+    # venv creation and dependency installation
+    pip: int = 1
+    # pytest sessions
+    pytest: int = 1
+
+
+def _get_phase_limits(
+    charm_config: "_CharmTestConfig", defaults: Dict[str, PhaseLimits]
+) -> Dict[str, PhaseLimits]:
+    """Get the limits for each phase of a charm; its test_setup overrides the defaults."""
+    overrides = (charm_config.test_setup or {}).get("limits") or {}
+    try:
+        limits = {
+            phase: dataclasses.replace(
+                defaults.get(phase, PhaseLimits()),
+                **{
+                    field: _PHASE_LIMIT_TYPES[field](value)
+                    for field, value in (overrides.get(phase) or {}).items()
+                },
+            )
+            for phase in PHASES
+        }
+    except (AttributeError, KeyError, TypeError, ValueError) as e:
+        raise SetupError(f"invalid limits in test_setup: {overrides!r}") from e
+    for phase_limits in limits.values():
+        if any(
+            limit is not None and limit <= 0
+            for limit in dataclasses.astuple(phase_limits)
+        ):
+            raise SetupError(f"invalid limits in test_setup: {overrides!r}")
+    return limits
+
+
+def _parse_phase_limits(
+    timeouts: Iterable[str], memory_limits: Iterable[str]
+) -> Dict[str, PhaseLimits]:
+    """Parse the <phase>=<value> limits given on the command line."""
+    phase_limits: Dict[str, PhaseLimits] = {}
+    for values, field, convert in (
+        (timeouts, "timeout", float),
+        (memory_limits, "memory", int),
+    ):
+        for value in values:
+            phase, _, limit = value.partition("=")
+            try:
+                if phase not in PHASES or convert(limit) <= 0:
+                    raise ValueError(phase)
+            except ValueError:
+                raise ValueError(
+                    f"invalid limit {value!r}: expected <phase>=<value>"
+                ) from None
+            phase_limits[phase] = dataclasses.replace(
+                phase_limits.get(phase, DEFAULT_PHASE_LIMITS.get(phase, PhaseLimits())),
+                **{field: convert(limit)},
+            )
+    return phase_limits
+
+
+# how often the memory usage of limited processes is sampled, in seconds
+_MEMORY_POLL_INTERVAL = 0.5
+
+
+def _get_session_rss(session_id: int) -> int:
+    """Get the resident memory of all processes in a session, in bytes."""
+    rss = 0
+    for stat_path in Path("/proc").glob("[0-9]*/stat"):
+        try:
+            stat = stat_path.read_text()
+        except OSError:  # the process exited in the meantime
+            continue
+        # the fields following the command name, which may contain spaces
+        fields = stat[stat.rindex(")") + 2 :].split()
+        if int(fields[3]) == session_id:
+            rss += int(fields[21])
+    return rss * os.sysconf("SC_PAGE_SIZE")
+
+
+def _run_limited(
+    cmd: str, limits: PhaseLimits, check: bool = False, **kwargs
+) -> subprocess.CompletedProcess:
+    """Run a shell command within the limits of its phase.
+
+    The command and all of its children are killed as soon as they exceed the limits,
+    in which case ResourceLimitError is raised.
+    """
+    poll_interval = _MEMORY_POLL_INTERVAL if limits.memory else None
+    deadline = time.monotonic() + limits.timeout if limits.timeout else None
+    # in a new session, so that we can account for and kill the whole process tree
+    with subprocess.Popen(cmd, shell=True, start_new_session=True, **kwargs) as proc:
+        while True:
+            timeout = poll_interval
+            if deadline:
+                remaining = max(deadline - time.monotonic(), 0)
+                timeout = min(timeout, remaining) if timeout else remaining
+            try:
+                stdout, stderr = proc.communicate(timeout=timeout)
+                break
+            except subprocess.TimeoutExpired:
+                pass
+            if deadline and time.monotonic() >= deadline:
+                error = f"timed out after {limits.timeout}s"
+            elif _get_session_rss(proc.pid) > limits.memory * 2**20:
+                error = f"exceeded the memory limit of {limits.memory}MiB"
+            else:
+                continue
+            os.killpg(proc.pid, signal.SIGKILL)
+            proc.communicate()
+            raise ResourceLimitError(f"{error}; the command was:\n\t{cmd!r}")
+    if check and proc.returncode:
+        raise subprocess.CalledProcessError(proc.returncode, cmd, stdout, stderr)
+    return subprocess.CompletedProcess(cmd, proc.returncode, stdout, stderr)
+
+
+async def _to_thread(func, *args):
+    """Run a blocking function in a worker thread, in the context of the caller.
+
+    Like asyncio.to_thread, which requires python 3.9: the context carries the name
+    of the charm the logs are tagged with.
+    """
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(
+        None, functools.partial(context.run, func, *args)
+    )
+
+
+@contextlib.contextmanager
+def _timed(report: Optional[CharmReport], phase: str) -> Iterator[None]:
+    """Record in the report how long the wrapped phase took."""
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        if report:
+            elapsed = time.monotonic() - start
+            report.durations[phase] = report.durations.get(phase, 0) + elapsed
+
+
+class ResultStore:
+    """Persistent store of the verdicts of previous charm test runs.
+
+    A verdict is keyed by everything that can affect it: the charm commit, the
+    contents of the interface version directory, the tester version, and where
+    the tests are fetched from, at which revision. If none of those changed, the
+    verdict can be reused.
+    """
+
+    def __init__(self, path: Path, interfaces_root: Path, repo: str, branch: str):
+        self._path = path
+        self._interfaces_root = interfaces_root
+        self._repo = repo
+        self._branch = branch
+        # the tests run are those of the remote repo, not those of the local tree
+        self._tests_commit = _ls_remote(repo, branch)
+        self._verdicts: Dict[str, str] = {}
+        if path.is_file():
+            try:
+                self._verdicts = json.loads(path.read_text())
+            except json.JSONDecodeError:
+                logging.warning(f"Ignoring corrupt results cache at {path}")
+
+    @functools.lru_cache(maxsize=None)
+    def _hash_interface_version(self, interface: str, version: str) -> str:
+        """Hash the contents of an interface version directory."""
+        # the collector strips dashes from the interface directory names
+        interface_dir = self._interfaces_root / interface
+        if not interface_dir.is_dir():
+            interface_dir = self._interfaces_root / interface.replace("_", "-")
+        digest = hashlib.sha256()
+        for file in sorted((interface_dir / version).rglob("*")):
+            if file.is_file() and "__pycache__" not in file.parts:
+                digest.update(str(file.relative_to(interface_dir)).encode() + b"\0")
+                digest.update(file.read_bytes())
+        return digest.hexdigest()
+
+    def get_key(self, spec: CharmTestSpec, charm_commit: str) -> Optional[str]:
+        """Compute the key identifying the verdict for this spec.
+
+        None if the revision the tests are fetched at can't be resolved.
+        """
+        if not self._tests_commit:
+            return None
+        charm_config = spec.charm_config
+        key = [
+            charm_config.name,
+            charm_config.url,
+            charm_config.branch,
+            charm_config.test_setup,
+            charm_commit,
+            spec.interface,
+            spec.version,
+            spec.role,
+            self._hash_interface_version(spec.interface, spec.version),
+            INTERFACE_TESTER_VERSION,
+            self._repo,
+            self._branch,
+            self._tests_commit,
+        ]
+        return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """Get the verdict stored for this key, if any."""
+        return self._verdicts.get(key)
+
+    def put(self, key: str, verdict: str):
+        """Store a verdict."""
+        self._verdicts[key] = verdict
+
+    def save(self):
+        """Write the store to disk."""
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self._path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(self._verdicts, indent=2))
+        tmp_path.replace(self._path)
+
+
+class RunHistory:
+    """Persistent record of how long each charm took to test, and which of its tests failed.
+
+    Used to schedule the charms that failed last time first, so that failures are reported
+    early, then the slowest ones, so that they don't end up as the tail of a parallel run.
+    """
+
+    # weight of the latest duration in the moving average
+    _ALPHA = 0.5
+
+    def __init__(self, path: Path):
+        self._path = path
+        # charm name -> {"duration": seconds, "failed": ["<interface>/<version>/<role>", ...]}
+        self._charms: Dict[str, dict] = {}
+        if path.is_file():
+            try:
+                self._charms = json.loads(path.read_text())
+            except json.JSONDecodeError:
+                logging.warning(f"Ignoring corrupt run history at {path}")
+
+    @staticmethod
+    def _get_pair_id(spec: CharmTestSpec) -> str:
+        return f"{spec.interface}/{spec.version}/{spec.role}"
+
+    def has_failed(self, spec: CharmTestSpec) -> bool:
+        """Whether this charm/interface pair failed in the previous run."""
+        failed = self._charms.get(spec.charm_config.name, {}).get("failed", ())
+        return self._get_pair_id(spec) in failed
+
+    def get_priority(self, specs: List[CharmTestSpec]) -> Tuple[bool, float]:
+        """Sort key for a charm's specs: previously failing charms first, then slowest first.
+
+        Charms we know nothing about are assumed to be slow: they likely need to be set up
+        from scratch.
+        """
+        duration = self._charms.get(specs[0].charm_config.name, {}).get("duration")
+        return (
+            not any(map(self.has_failed, specs)),
+            -duration if duration is not None else -float("inf"),
+        )
+
+    def record(self, report: CharmReport):
+        """Update the history of a charm with the outcome of this run."""
+        entry = self._charms.setdefault(report.name, {})
+        # charms whose results all came from the result store did no work this time
+        if report.durations:
+            duration = sum(report.durations.values())
+            if (previous := entry.get("duration")) is not None:
+                duration = self._ALPHA * duration + (1 - self._ALPHA) * previous
+            entry["duration"] = round(duration, 3)
+        entry["failed"] = sorted(
+            self._get_pair_id(spec)
+            for spec, result in report.results.items()
+            if result.status != PASSED
+        )
+
+    def save(self):
+        """Write the history to disk."""
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self._path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(self._charms, indent=2, sort_keys=True))
+        tmp_path.replace(self._path)
+
+
+def _clone_charm_repo(
+    charm_config: "_CharmTestConfig",
+    clone_path: Path,
+    limits: PhaseLimits = PhaseLimits(),
+):
     """Clones a charm repository to a local path."""
     logging.info(
-        f"Cloning: {charm_config.name} from ({charm_config.url}@{charm_config.branch or 'main'})"
+        f"Cloning: {charm_config.url}@{charm_config.branch or 'main'} "
+        f"(for {charm_config.name})"
     )
     branch_option = ""
     if charm_config.branch:
@@ -59,13 +483,9 @@ def _clone_charm_repo(charm_config: "_CharmTestConfig", charm_path: Path):
             f"custom branch provided for {charm_config.name}; "
             f"this should only be done in staging"
         )
-    cmd = f"git clone --quiet --depth 1 {branch_option} {charm_config.url} {charm_path}"
+    cmd = f"git clone --quiet --depth 1 {branch_option} {charm_config.url} {clone_path}"
 
-    retcode = subprocess.call(
-        cmd,
-        shell=True,
-        stdout=subprocess.DEVNULL,
-    )
+    retcode = _run_limited(cmd, limits, stdout=subprocess.DEVNULL).returncode
     if retcode > 0:
         raise SetupError(
             f"Failed to clone repo {charm_config.url}@{charm_config.branch or 'main'} for {charm_config.name}; "
@@ -74,26 +494,147 @@ def _clone_charm_repo(charm_config: "_CharmTestConfig", charm_path: Path):
         )
 
 
-def _prepare_repo(
+def _get_clone_path(charm_config: "_CharmTestConfig", root: Path) -> Path:
+    """Path at which the repository hosting a charm is cloned.
+
+    Monorepos host several charms: the clone is shared by all charms with the same url and branch.
+    """
+    repo_name = charm_config.url.rstrip("/").rsplit("/", 1)[-1]
+    if repo_name.endswith(".git"):
+        repo_name = repo_name[: -len(".git")]
+    url_hash = hashlib.sha256(
+        f"{charm_config.url}@{charm_config.branch}".encode()
+    ).hexdigest()[:12]
+    return root / ".repos" / f"{repo_name}-{url_hash}"
+
+
+# one lock per clone, so that the charms sharing a repository fetch it only once
+_clone_locks: Dict[Path, threading.Lock] = {}
+# the clones that were cloned or fetched during this run
+_fresh_clones: Set[Path] = set()
+
+
+def _fetch_charm_repo(
     charm_config: "_CharmTestConfig",
-    interface: str,
-    version: int,
-    repo: str,
-    branch: str,
-    root: Path = Path("/tmp/charm-relation-interfaces-tests/"),
-) -> Tuple[Path, Path]:
-    """Clone the charm repository and create the venv if it hasn't been done already."""
-    logging.info(f"Preparing testing environment for: {charm_config.name}")
+    clone_path: Path,
+    limits: PhaseLimits = PhaseLimits(),
+):
+    """Update a clone kept from a previous run to the latest commit of its branch."""
+    ref = charm_config.branch or "HEAD"
+    logging.info(f"Fetching: {charm_config.url}@{ref} (for {charm_config.name})")
+    for cmd in (
+        f"git fetch --quiet --depth 1 origin {ref}",
+        "git checkout --quiet --detach FETCH_HEAD",
+    ):
+        retcode = _run_limited(
+            cmd, limits, cwd=clone_path, stdout=subprocess.DEVNULL
+        ).returncode
+        if retcode > 0:
+            raise SetupError(
+                f"Failed to fetch repo {charm_config.url}@{ref} for {charm_config.name}.\n"
+                f"\t command: {cmd!r}"
+            )
+
+
+def _checkout_charm_repo(
+    charm_config: "_CharmTestConfig",
+    repo_root_path: Path,
+    root: Path,
+    limits: PhaseLimits = PhaseLimits(),
+    fetch: bool = False,
+):
+    """Check out the charm repository at repo_root_path, as a worktree of a shared clone.
+
+    If fetch, a clone kept from a previous run is updated first.
+    """
+    clone_path = _get_clone_path(charm_config, root)
+    with _clone_locks.setdefault(clone_path, threading.Lock()):
+        if not clone_path.exists():
+            _clone_charm_repo(charm_config, clone_path, limits)
+            _fresh_clones.add(clone_path)
+        elif fetch and clone_path not in _fresh_clones:
+            _fetch_charm_repo(charm_config, clone_path, limits)
+            _fresh_clones.add(clone_path)
+        else:
+            logging.info(f"Reusing clone of {charm_config.url} at {clone_path}")
+
+        # each charm gets its own worktree: pre_run scripts, venvs and generated tests
+        # of charms living in the same repo must not step on each other's toes.
+        cmd = f"git worktree add --quiet --detach {repo_root_path} HEAD"
+        retcode = _run_limited(
+            cmd, limits, cwd=clone_path, stdout=subprocess.DEVNULL
+        ).returncode
+    if retcode > 0:
+        raise SetupError(
+            f"Failed to check out {clone_path} for {charm_config.name}.\n"
+            f"\t command: {cmd!r}"
+        )
+
+
+@functools.lru_cache(maxsize=None)
+def _ls_remote(url: str, ref: str) -> Optional[str]:
+    """Get the SHA of a ref in a remote repository."""
+    try:
+        output = subprocess.check_output(
+            ["git", "ls-remote", url, ref],
+            text=True,
+            stderr=subprocess.DEVNULL,
+        )
+    except subprocess.CalledProcessError:
+        logging.warning(f"Unable to resolve {url}@{ref}")
+        return None
+    if not output:
+        return None
+    return output.split()[0]
+
+
+def _get_charm_commit(charm_config: "_CharmTestConfig") -> Optional[str]:
+    """Get the SHA of the commit a charm repository would be cloned at, without cloning it."""
+    return _ls_remote(charm_config.url, charm_config.branch or "HEAD")
+
+
+def _get_checkout_commit(repo_root_path: Path) -> Optional[str]:
+    """Get the SHA of the commit a charm repository is checked out at."""
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"],
+            cwd=repo_root_path,
+            text=True,
+            stderr=subprocess.DEVNULL,
+        ).strip()
+    except (subprocess.CalledProcessError, OSError):
+        logging.warning(f"Unable to resolve the commit checked out at {repo_root_path}")
+        return None
+
+
+def _get_charm_id(charm_config: "_CharmTestConfig") -> str:
+    """Identify a charm setup: its name, and where and how it is checked out.
 
-    # path at which we'll clone the charm repo
-    repo_root_path = root / charm_config.name
+    The same charm can be registered from different repositories, branches or with
+    different test setups; each of those is set up and tested on its own.
+    """
+    setup = [charm_config.url, charm_config.branch, charm_config.test_setup]
+    setup_hash = hashlib.sha256(json.dumps(setup, sort_keys=True).encode()).hexdigest()
+    return f"{charm_config.name}-{setup_hash[:12]}"
+
+
+def _get_charm_paths(
+    charm_config: "_CharmTestConfig", root: Path = TESTS_ROOT
+) -> Tuple[Path, Path]:
+    """Get the paths at which the charm repository is checked out and the charm lives."""
+    # path at which we'll check out the charm repo
+    repo_root_path = root / _get_charm_id(charm_config)
 
     # multi-charm repos might have multiple charms in a single repo.
     if charm_config.test_setup and (
         charm_root_cfg := charm_config.test_setup.get("charm_root")
     ):
         charm_root_path = repo_root_path / charm_root_cfg
-        if not charm_root_path.resolve().is_relative_to(repo_root_path):
+        resolved_path = charm_root_path.resolve()
+        if (
+            resolved_path != repo_root_path
+            and repo_root_path not in resolved_path.parents
+        ):
             raise SetupError(
                 f"charm_root must be a relative path, not {charm_root_cfg!r}"
             )
@@ -103,11 +644,17 @@ def _prepare_repo(
     else:
         # usually, the charm is at the root of the repo.
         charm_root_path = repo_root_path
+    return repo_root_path, charm_root_path
 
-    if not repo_root_path.exists():
-        _clone_charm_repo(charm_config, repo_root_path)
-        _pre_run(charm_config, charm_root_path)
-        _setup_venv(charm_root_path)
+
+def _prepare_test(
+    charm_config: "_CharmTestConfig",
+    charm_root_path: Path,
+    interface_versions: Iterable[Tuple[str, int]],
+    repo: str,
+    branch: str,
+) -> Path:
+    """Generate the test file for a charm whose repository and venv are set up."""
     try:
         fixture_spec = _get_fixture(charm_config, charm_root_path)
     except FileNotFoundError as e:
@@ -116,22 +663,25 @@ def _prepare_repo(
         # NOTE: In the future we could probably run the tests without a fixture, assuming
         # that the charm needs no patching at all to work with scenario
         raise SetupError(f"fixture missing for charm {charm_config.name}")
-    test_path = _generate_test(
-        interface, fixture_spec.path.parent, fixture_spec.id, version, repo, branch
+    return _generate_test(
+        interface_versions, fixture_spec.path.parent, fixture_spec.id, repo, branch
     )
-    return charm_root_path, test_path
 
 
-def _clean(root: Path = Path("/tmp/charm-relation-interfaces-tests/")):
-    """Clean the directory used to store repos for the tests."""
-    if root.is_dir():
-        shutil.rmtree(root)
+def _clean(root: Path = TESTS_ROOT):
+    """Clean the directories used to store repos and venvs for the tests."""
+    for path in (root, VENV_CACHE_PATH):
+        if path.is_dir():
+            shutil.rmtree(path)
 
 
-_TEST_CONTENT = """
+_TEST_MODULE_HEADER = """
 # file generated by run_matrix.py
 from interface_tester import InterfaceTester
-def test_{interface}_interface({fixture_id}: InterfaceTester):
+"""
+
+_TEST_CONTENT = """
+def {test_name}({fixture_id}: InterfaceTester):
     {fixture_id}.configure(
         interface_name="{interface}",
         interface_version={version},
@@ -141,28 +691,38 @@ def test_{interface}_interface({fixture_id}: InterfaceTester):
     {fixture_id}.run()
 """
 
+# all the interface tests of a charm are generated in this file, and run in a single session.
+_TEST_FILENAME = "interface_test_matrix.py"
+
+
+def _get_test_name(interface: str, version: int) -> str:
+    """Name of the generated test function for an interface version."""
+    return f"test_{interface}_v{version}_interface"
+
 
 def _generate_test(
-    interface: str,
+    interface_versions: Iterable[Tuple[str, int]],
     test_path: Path,
     fixture_id: str,
-    version: int,
     repo: str,
     branch: str,
 ) -> Path:
-    """Generate a pytest file for a given charm and interface."""
-    logging.info(f"Generating test file for {interface} at {test_path}")
-    test_content = _TEST_CONTENT.format(
-        interface=interface,
-        fixture_id=fixture_id,
-        version=version,
-        repo=repo,
-        branch=branch,
-    )
-    test_filename = f"interface_test_{interface}.py"
-    with open(test_path / test_filename, "w") as file:
+    """Generate a pytest file testing a given charm against all these interfaces, in order."""
+    logging.info(f"Generating test file at {test_path}")
+    test_content = _TEST_MODULE_HEADER
+    # a charm can be tested as both provider and requirer of an interface: the test is the same
+    for interface, version in dict.fromkeys(interface_versions):
+        test_content += _TEST_CONTENT.format(
+            test_name=_get_test_name(interface, version),
+            interface=interface,
+            fixture_id=fixture_id,
+            version=version,
+            repo=repo,
+            branch=branch,
+        )
+    with open(test_path / _TEST_FILENAME, "w") as file:
         file.write(test_content)
-    return test_path / test_filename
+    return test_path / _TEST_FILENAME
 
 
 def _get_fixture(charm_config: "_CharmTestConfig", charm_path: Path) -> FixtureSpec:
@@ -176,22 +736,26 @@ def _get_fixture(charm_config: "_CharmTestConfig", charm_path: Path) -> FixtureS
     return FixtureSpec(fixture_path, fixture_id)
 
 
-def _pre_run(charm_config: "_CharmTestConfig", charm_path: Path):
+def _pre_run(
+    charm_config: "_CharmTestConfig",
+    charm_path: Path,
+    limits: PhaseLimits = DEFAULT_PHASE_LIMITS["pre_run"],
+):
     """Run whatever setup commands were configured in the custom test config."""
     if not charm_config.test_setup:
         return
-    timeout = 60  # seconds
     if pre_run_cfg := charm_config.test_setup.get("pre_run"):
         logging.info("Running custom pre_run script...")
         logging.info(pre_run_cfg)
         try:
-            output = subprocess.check_output(
+            output = _run_limited(
                 pre_run_cfg,
+                limits,
+                check=True,
                 cwd=charm_path,
-                shell=True,
-                timeout=timeout,
+                stdout=subprocess.PIPE,
                 text=True,
-            )
+            ).stdout
         except subprocess.CalledProcessError as e:
             logging.error(
                 "failed to run pre_run script from %s: %s. The script was:\n\t%r",
@@ -199,161 +763,654 @@ def _pre_run(charm_config: "_CharmTestConfig", charm_path: Path):
                 e.stderr,
                 pre_run_cfg,
             )
-        except subprocess.TimeoutExpired:
-            logging.error(
-                "pre_run script from %s timed out after %s. The script was:\n\t%r",
-                charm_path,
-                timeout,
-                pre_run_cfg,
-            )
         else:
             logging.debug("Custom pre_run script output: %s", output)
 
 
-def _setup_venv(charm_path: Path) -> None:
-    """Create the venv for a charm and return the path to its python."""
-    logging.info(f"Preparing venv for {charm_path}")
-
-    # Create the venv and install the requirements
+@functools.lru_cache(maxsize=None)
+def _get_venv_tool_versions() -> str:
+    """Get the versions of the python interpreter and pip MKVENV_CMD creates venvs with."""
+    interpreter = shlex.split(MKVENV_CMD)[0]
+    python_version = subprocess.check_output([interpreter, "--version"], text=True)
     try:
-        subprocess.check_call(
-            f"{MKVENV_CMD} ./.interface-venv",
-            shell=True,
-            stdout=subprocess.DEVNULL,
-            cwd=charm_path,
-        )
-        logging.info(f"Installing dependencies in venv for {charm_path}")
-
-        subprocess.check_call(
-            ".interface-venv/bin/python -m pip install setuptools pytest pytest-interface-tester",
-            shell=True,
-            cwd=charm_path,
-            stdout=subprocess.DEVNULL,
+        # "pip X.Y from <path> (python X.Y)"
+        pip_version = subprocess.check_output(
+            [interpreter, "-m", "pip", "--version"],
+            text=True,
             stderr=subprocess.DEVNULL,
-        )
-        subprocess.check_call(
-            ".interface-venv/bin/python -m pip install -r requirements.txt",
-            shell=True,
-            cwd=charm_path,
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL,
-        )
-        logging.info(f"Installed {(charm_path/'requirements.txt').read_text()}")
+        ).split()[1]
+    except (subprocess.CalledProcessError, IndexError):
+        pip_version = "unknown"
+    return f"{python_version.strip()}; pip {pip_version}"
+
+
+# requirements file options whose argument is a path, relative to the charm directory
+_LOCAL_REQUIREMENT_OPTIONS = (
+    "-e",
+    "--editable",
+    "-r",
+    "--requirement",
+    "-c",
+    "--constraint",
+)
+
+
+def _has_local_requirements(requirements_path: Path) -> bool:
+    """Whether a requirements file refers to local paths, e.g. `-e .` or `./lib/foo`.
+
+    What such a venv contains depends on more than the text of the file.
+    """
+    for line in requirements_path.read_text().splitlines():
+        line = line.split(" #", 1)[0].strip()
+        if not line or line.startswith("#"):
+            continue
+        if line.split(maxsplit=1)[0].split("=", 1)[0] in _LOCAL_REQUIREMENT_OPTIONS:
+            return True
+        if line.startswith((".", "/", "~")) or "file:" in line:
+            return True
+    return False
+
+
+def _get_venv_cache_key(requirements_path: Path) -> str:
+    """Hash everything that determines the contents of a charm's venv."""
+    digest = hashlib.sha256(requirements_path.read_bytes())
+    for part in (MKVENV_CMD, _get_venv_tool_versions(), INTERFACE_TESTER_VERSION):
+        digest.update(b"\0" + part.encode())
+    return digest.hexdigest()[:16]
+
+
+# one lock per venv cache key, so that charms with the same dependencies don't race to build it
+_venv_locks: Dict[str, threading.Lock] = {}
+
+
+def _build_venv(
+    venv_path: Path,
+    requirements_path: Path,
+    find_links: Optional[Path] = None,
+    limits: PhaseLimits = PhaseLimits(),
+) -> None:
+    """Create a venv at venv_path and install the test dependencies in it.
+
+    The requirements are installed from the directory of the requirements file, which
+    relative paths in it refer to. If find_links is given, install from that local
+    wheelhouse only.
+    """
+    if venv_path.exists():
+        logging.info(f"Removing incomplete venv at {venv_path}")
+        shutil.rmtree(venv_path)
+    venv_path.parent.mkdir(parents=True, exist_ok=True)
+
+    # Create the venv and install the requirements
+    _run_limited(
+        f"{MKVENV_CMD} {venv_path}",
+        limits,
+        check=True,
+        stdout=subprocess.DEVNULL,
+    )
+    logging.info(f"Installing dependencies in venv {venv_path}")
+
+    pip_install = f"{venv_path}/bin/python -m pip install"
+    if find_links:
+        pip_install += f" --no-index --find-links {find_links}"
+    _run_limited(
+        f"{pip_install} {_VENV_BASE_PACKAGES}",
+        limits,
+        check=True,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    _run_limited(
+        f"{pip_install} -r {requirements_path.name}",
+        limits,
+        check=True,
+        cwd=requirements_path.parent,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    logging.info(f"Installed {requirements_path.read_text()}")
+    (venv_path / _VENV_READY_MARKER).touch()
+
+
+def _setup_venv(
+    charm_path: Path,
+    find_links: Optional[Path] = None,
+    limits: PhaseLimits = PhaseLimits(),
+) -> None:
+    """Link the charm to a venv with its dependencies, creating the venv if needed.
+
+    Venvs are cached in VENV_CACHE_PATH by the hash of requirements.txt, of the python
+    and pip versions and of the tester version, so charms with the same dependencies
+    share one.
+    Requirements referring to local paths, such as `-e .`, install the charm's own
+    files: the charm then gets a venv of its own, which is not cached.
+    """
+    logging.info(f"Preparing venv for {charm_path}")
+    requirements_path = charm_path / "requirements.txt"
+    if not requirements_path.is_file():
+        raise SetupError(f"venv setup failed: {requirements_path} not found")
 
+    venv_link = charm_path / ".interface-venv"
+    if venv_link.is_symlink():
+        venv_link.unlink()
+    try:
+        if _has_local_requirements(requirements_path):
+            logging.info(
+                f"{requirements_path} refers to local paths: not caching the venv"
+            )
+            _build_venv(venv_link, requirements_path, find_links, limits)
+            return
+        cache_key = _get_venv_cache_key(requirements_path)
+        venv_path = VENV_CACHE_PATH / cache_key
+        with _venv_locks.setdefault(cache_key, threading.Lock()):
+            if (venv_path / _VENV_READY_MARKER).exists():
+                logging.info(f"Reusing cached venv {venv_path}")
+            else:
+                _build_venv(venv_path, requirements_path, find_links, limits)
     except subprocess.CalledProcessError as e:
         raise SetupError("venv setup failed") from e
 
-
-def _run_test_with_pytest(root: Path, test_path: Path):
-    """Run a test file with pytest."""
+    if venv_link.exists():
+        shutil.rmtree(venv_link)
+    venv_link.symlink_to(venv_path, target_is_directory=True)
+
+
+class Wheelhouse:
+    """Local directory of distributions the charm venvs are installed from, with no index.
+
+    Unless offline, it is populated once per run, from the requirements of all charms,
+    as soon as every charm has been checked out and has run its pre_run script. The
+    requirements are built into wheels, so that installing them needs neither the index
+    nor their build backends. Charms whose requirements failed to build are installed
+    from the index instead. Offline, it must have been populated beforehand.
+    """
+
+    def __init__(self, path: Path, offline: bool, charms: Iterable[str]):
+        self.path = path
+        self.offline = offline
+        # charms (by _get_charm_id) whose requirements.txt we are still waiting for
+        self._pending = set(charms)
+        # distinct requirements files, by content hash (by path if they refer to local paths)
+        self._requirements: Dict[str, Path] = {}
+        # the requirements that failed to build, by the same keys; None for the base packages
+        self._failed: Set[Optional[str]] = set()
+        self._all_arrived = asyncio.Event()
+        self._ready = asyncio.Event()
+        if offline:
+            self._ready.set()
+        if not self._pending:
+            self._all_arrived.set()
+
+    def arrive(self, charm: str, requirements_path: Optional[Path] = None):
+        """Register the requirements of a charm; no-op if it already arrived."""
+        if charm not in self._pending:
+            return
+        self._pending.remove(charm)
+        if requirements_path and requirements_path.is_file():
+            self._requirements.setdefault(
+                self._get_key(requirements_path), requirements_path
+            )
+        if not self._pending:
+            self._all_arrived.set()
+
+    @staticmethod
+    def _get_key(requirements_path: Path) -> str:
+        # files referring to local paths resolve differently for each charm
+        if _has_local_requirements(requirements_path):
+            return str(requirements_path)
+        return hashlib.sha256(requirements_path.read_bytes()).hexdigest()
+
+    async def wait_ready(self):
+        """Wait until the wheelhouse is populated."""
+        await self._ready.wait()
+
+    def get_find_links(self, requirements_path: Path) -> Optional[Path]:
+        """Where to install a charm's requirements from: the wheelhouse, or the index (None)."""
+        if self.offline or not requirements_path.is_file():
+            return self.path
+        if None in self._failed or self._get_key(requirements_path) in self._failed:
+            logging.warning(
+                f"{requirements_path} is not in the wheelhouse: installing from the index"
+            )
+            return None
+        return self.path
+
+    async def populate(self, semaphore: asyncio.Semaphore):
+        """Build the requirements of all charms, once they all arrived."""
+        if self.offline:
+            return
+        await self._all_arrived.wait()
+        try:
+            async with semaphore:
+                await _to_thread(self._build)
+        finally:
+            # whatever happened, don't keep the charms waiting
+            self._ready.set()
+
+    def _build(self):
+        self.path.mkdir(parents=True, exist_ok=True)
+        # use the interpreter the venvs are created with, to get matching distributions;
+        # sdists and VCS requirements are built, as their build backends won't be
+        # installable without the index.
+        pip_wheel = (
+            f"{shlex.split(MKVENV_CMD)[0]} -m pip wheel --quiet --wheel-dir {self.path}"
+        )
+        logging.info(
+            f"Populating wheelhouse {self.path} "
+            f"from {len(self._requirements)} distinct requirements files"
+        )
+        # one build per file: the pins of different charms may well conflict.
+        # From the directory of the file, which relative paths in it refer to.
+        for key, requirements, cwd in (
+            (None, _VENV_BASE_PACKAGES, None),
+            *(
+                (key, f"-r {path.name}", path.parent)
+                for key, path in self._requirements.items()
+            ),
+        ):
+            try:
+                subprocess.check_call(
+                    f"{pip_wheel} {requirements}",
+                    shell=True,
+                    cwd=cwd,
+                    stdout=subprocess.DEVNULL,
+                )
+            except (subprocess.CalledProcessError, OSError):
+                logging.error(f"Failed to build {requirements} into the wheelhouse")
+                self._failed.add(key)
+
+
+def _run_test_with_pytest(
+    root: Path,
+    test_path: Path,
+    report: Optional[CharmReport] = None,
+    limits: PhaseLimits = PhaseLimits(),
+) -> Dict[str, CharmTestResult]:
+    """Run a test file with pytest; return the result of each test function."""
     logging.info(f"Running tests for {root}")
-    try:
-        subprocess.check_call(
-            f"PYTHONPATH=src:lib .interface-venv/bin/python -m pytest {test_path}",
+    report_path = test_path.with_suffix(".xml")
+    report_path.unlink(missing_ok=True)
+    # capture the output so that it gets tagged with the charm name like the rest of the logs
+    with _timed(report, "pytest"):
+        proc = _run_limited(
+            f"PYTHONPATH=src:lib .interface-venv/bin/python -m pytest {test_path} "
+            f"--junitxml={report_path}",
+            limits,
             cwd=root,
-            shell=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+        )
+    if report:
+        report.exit_code = proc.returncode
+    for line in proc.stdout.splitlines():
+        logging.info(line)
+    if not report_path.is_file():
+        raise InterfaceTestError(
+            f"pytest exited with code {proc.returncode} without reporting any result"
         )
-    except subprocess.CalledProcessError as e:
-        raise InterfaceTestError from e
-
 
-def _test_charm(
+    # split the results of the session back out per test function
+    results: Dict[str, CharmTestResult] = {}
+    for testcase in ET.parse(report_path).iter("testcase"):
+        name = testcase.get("name")
+        result = results.setdefault(name, CharmTestResult(PASSED, duration=0))
+        result.duration += float(testcase.get("time", 0))
+        # a test can both pass and error out in teardown: any failure wins
+        for tag in ("failure", "error"):
+            if (failure := testcase.find(tag)) is not None:
+                result.status = FAILED
+                result.reason = failure.get("message") or tag
+    return results
+
+
+async def _test_charm(
     charm_config: "_CharmTestConfig",
-    interface: str,
-    version: int,
-    role: str,
+    specs: List[CharmTestSpec],
     repo: str,
     branch: str,
-) -> bool:
-    """Run interface tests for a charm."""
+    report: CharmReport,
+    semaphores: Dict[str, asyncio.Semaphore],
+    wheelhouse: Optional[Wheelhouse] = None,
+    phase_limits: Dict[str, PhaseLimits] = DEFAULT_PHASE_LIMITS,
+    fetch: bool = False,
+) -> Dict[CharmTestSpec, CharmTestResult]:
+    """Set up a charm and run its interface tests, in a single pytest session.
+
+    The blocking phases run in worker threads, each gated by the semaphore of the
+    class of resources it uses, so that other charms' phases can overlap with it.
+    The commit the charm is tested at is recorded in the report. If fetch, a clone
+    kept from a previous run is updated before checking the charm out.
+    """
     logging.info(f"Running tests for charm: {charm_config.name}")
+    interface_versions = [(spec.interface, int(spec.version[1:])) for spec in specs]
     try:
-        charm_path, test_path = _prepare_repo(
-            charm_config, interface, version, repo, branch
+        limits = _get_phase_limits(charm_config, phase_limits)
+        repo_root_path, charm_root_path = _get_charm_paths(charm_config)
+        if not repo_root_path.exists():
+            logging.info(f"Preparing testing environment for: {charm_config.name}")
+            try:
+                async with semaphores["network"]:
+                    with _timed(report, "clone"):
+                        await _to_thread(
+                            _checkout_charm_repo,
+                            charm_config,
+                            repo_root_path,
+                            TESTS_ROOT,
+                            limits["clone"],
+                            fetch,
+                        )
+                    with _timed(report, "pre_run"):
+                        await _to_thread(
+                            _pre_run, charm_config, charm_root_path, limits["pre_run"]
+                        )
+            finally:
+                if wheelhouse:
+                    wheelhouse.arrive(
+                        _get_charm_id(charm_config),
+                        charm_root_path / "requirements.txt",
+                    )
+            find_links = None
+            if wheelhouse:
+                await wheelhouse.wait_ready()
+                find_links = wheelhouse.get_find_links(
+                    charm_root_path / "requirements.txt"
+                )
+            async with semaphores["pip"]:
+                with _timed(report, "venv"):
+                    await _to_thread(
+                        _setup_venv, charm_root_path, find_links, limits["venv"]
+                    )
+        elif wheelhouse:
+            # already set up in a previous run: nothing to contribute to the wheelhouse
+            wheelhouse.arrive(_get_charm_id(charm_config))
+        test_path = _prepare_test(
+            charm_config, charm_root_path, interface_versions, repo, branch
         )
-    except SetupError:
+        report.commit = await _to_thread(_get_checkout_commit, repo_root_path)
+    except SetupError as e:
         logging.warning(
-            f"test setup failed for {charm_config.name} {interface} {role}",
+            f"test setup failed for {charm_config.name}",
             exc_info=True,
         )
-        return False
+        reason = f"{e}: {e.__cause__}" if e.__cause__ else str(e)
+        report.setup_error = reason
+        return {spec: CharmTestResult(SETUP_FAILED, reason) for spec in specs}
+    except ResourceLimitError as e:
+        logging.warning(f"test setup for {charm_config.name} killed: {e}")
+        report.setup_error = str(e)
+        return {spec: CharmTestResult(KILLED, str(e)) for spec in specs}
 
     try:
-        _run_test_with_pytest(charm_path, test_path)
-    except InterfaceTestError:
+        async with semaphores["pytest"]:
+            results = await _to_thread(
+                _run_test_with_pytest,
+                charm_root_path,
+                test_path,
+                report,
+                limits["pytest"],
+            )
+    except ResourceLimitError as e:
+        logging.warning(f"interface tests for {charm_config.name} killed: {e}")
+        return {spec: CharmTestResult(KILLED, str(e)) for spec in specs}
+    except InterfaceTestError as e:
         logging.warning(
-            f"interface tests for {charm_config.name} {interface} {role} failed",
+            f"interface tests for {charm_config.name} failed",
             exc_info=True,
         )
-        return False
-    return True
+        return {spec: CharmTestResult(FAILED, str(e)) for spec in specs}
+
+    out = {}
+    for spec, (interface, version) in zip(specs, interface_versions):
+        test_name = _get_test_name(interface, version)
+        if test_name not in results:
+            logging.warning(f"no result for {test_name}: pytest did not collect it")
+            out[spec] = CharmTestResult(FAILED, f"{test_name} was not collected")
+        else:
+            out[spec] = results[test_name]
+    return out
+
+
+async def _test_charm_group(
+    specs: List[CharmTestSpec],
+    repo: str,
+    branch: str,
+    semaphores: Dict[str, asyncio.Semaphore],
+    result_store: Optional[ResultStore] = None,
+    wheelhouse: Optional[Wheelhouse] = None,
+    phase_limits: Dict[str, PhaseLimits] = DEFAULT_PHASE_LIMITS,
+) -> CharmReport:
+    """Run all tests for a single charm."""
+    # the specs of a group share their url, branch and test_setup (see _get_charm_id),
+    # hence the checkout, the venv and the tester fixture
+    charm_config = specs[0].charm_config
+    report = CharmReport(charm_config.name)
+    # each group runs in its own task, so this only tags the logs of this charm
+    _current_charm.set(charm_config.name)
+    try:
+        return await _test_charm_specs(
+            specs,
+            repo,
+            branch,
+            report,
+            semaphores,
+            result_store,
+            wheelhouse,
+            phase_limits,
+        )
+    finally:
+        # don't keep the other charms waiting for the wheelhouse if we never reached it
+        if wheelhouse:
+            wheelhouse.arrive(_get_charm_id(charm_config))
+
+
+async def _test_charm_specs(
+    specs: List[CharmTestSpec],
+    repo: str,
+    branch: str,
+    report: CharmReport,
+    semaphores: Dict[str, asyncio.Semaphore],
+    result_store: Optional[ResultStore] = None,
+    wheelhouse: Optional[Wheelhouse] = None,
+    phase_limits: Dict[str, PhaseLimits] = DEFAULT_PHASE_LIMITS,
+) -> CharmReport:
+    """Run the specs of a charm, reusing the cached results where possible."""
+    charm_config = specs[0].charm_config
+
+    results: Dict[CharmTestSpec, CharmTestResult] = {}
+    charm_commit = None
+    if result_store:
+        async with semaphores["network"]:
+            charm_commit = await _to_thread(_get_charm_commit, charm_config)
+    if charm_commit:
+        for spec in specs:
+            if not (key := result_store.get_key(spec, charm_commit)):
+                continue
+            if status := result_store.get(key):
+                results[spec] = CharmTestResult(status, cached=True)
+                logging.info(
+                    f"Result ({spec.interface} {spec.version} {spec.role}): "
+                    f"{status} (cached)"
+                )
+
+    if to_run := [spec for spec in specs if spec not in results]:
+        for spec, result in (
+            await _test_charm(
+                charm_config,
+                to_run,
+                repo,
+                branch,
+                report,
+                semaphores,
+                wheelhouse,
+                phase_limits,
+                # an incremental run must test the commit it looked the verdicts up for
+                fetch=result_store is not None,
+            )
+        ).items():
+            results[spec] = result
+            logging.info(
+                f"Result ({spec.interface} {spec.version} {spec.role}): "
+                f"{result.status}"
+            )
+            # setup failures and killed jobs may well be transient: retry them.
+            # The verdict is stored for the commit that was tested, which is not
+            # necessarily the one that was looked up.
+            if (
+                result_store
+                and report.commit
+                and result.status in (PASSED, FAILED)
+                and (key := result_store.get_key(spec, report.commit))
+            ):
+                result_store.put(key, result.status)
+    report.results = {spec: results[spec] for spec in specs}
+    return report
+
+
+async def _run_pipeline(
+    specs_per_charm: Dict[str, List[CharmTestSpec]],
+    repo: str,
+    branch: str,
+    limits: ConcurrencyLimits,
+    result_store: Optional[ResultStore] = None,
+    wheelhouse_path: Optional[Path] = None,
+    offline: bool = False,
+    phase_limits: Dict[str, PhaseLimits] = DEFAULT_PHASE_LIMITS,
+) -> List[CharmReport]:
+    """Test all charms concurrently, within the concurrency limits of each resource class."""
+    semaphores = {
+        resource: asyncio.Semaphore(limit)
+        for resource, limit in dataclasses.asdict(limits).items()
+    }
+    wheelhouse = None
+    tasks = []
+    if wheelhouse_path:
+        wheelhouse = Wheelhouse(wheelhouse_path, offline, specs_per_charm)
+        tasks.append(wheelhouse.populate(semaphores["network"]))
+    # enough threads for every phase that is allowed to run at once
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=sum(dataclasses.asdict(limits).values()))
+    )
+    tasks.extend(
+        _test_charm_group(
+            specs,
+            repo,
+            branch,
+            semaphores,
+            result_store,
+            wheelhouse,
+            phase_limits,
+        )
+        for specs in specs_per_charm.values()
+    )
+    results = await asyncio.gather(*tasks)
+    return [result for result in results if isinstance(result, CharmReport)]
 
 
 def _test_charms(
-    charm_configs: Iterable["_CharmTestConfig"],
-    interface: str,
-    version: int,
-    role: str,
+    specs: Iterable[CharmTestSpec],
     repo: str,
     branch: str,
-) -> "_ResultsPerCharm":
-    """Test all charms against this interface and role."""
-    logging.info(f"Running tests for {interface}")
-    out = {}
-    for charm_config in charm_configs:
-        success = _test_charm(charm_config, interface, version, role, repo, branch)
-        out[charm_config.name] = success
-        logging.info(f"Result: {'PASSED' if success else 'FAILED'}")
-    return out
+    limits: ConcurrencyLimits = ConcurrencyLimits(),
+    result_store: Optional[ResultStore] = None,
+    wheelhouse: Optional[Path] = None,
+    offline: bool = False,
+    history: Optional[RunHistory] = None,
+    phase_limits: Dict[str, PhaseLimits] = DEFAULT_PHASE_LIMITS,
+) -> List[CharmReport]:
+    """Run the tests for all charms.
+
+    The phases of different charms overlap: a charm can be cloned while another one's
+    venv is being installed and a third one is being tested.
+    All tests for a given charm run in the same pytest session, as they share the same
+    cloned repository and venv.
+    If a wheelhouse is given, the venvs are installed from it without reaching the package
+    index; unless offline, it is populated first from the requirements of all charms.
+    If a history is given, the charms and their tests are scheduled based on it.
+    Phases exceeding their limits are killed, and their tests reported as KILLED.
+    """
+    specs_per_charm: Dict[str, List[CharmTestSpec]] = {}
+    for spec in specs:
+        specs_per_charm.setdefault(_get_charm_id(spec.charm_config), []).append(spec)
+
+    if history:
+        # the semaphores wake up their waiters in order, so the charms start in this order
+        specs_per_charm = {
+            charm: sorted(charm_specs, key=lambda spec: not history.has_failed(spec))
+            for charm, charm_specs in sorted(
+                specs_per_charm.items(), key=lambda item: history.get_priority(item[1])
+            )
+        }
+
+    logging.info(f"Running tests for {len(specs_per_charm)} charms with {limits}")
+    return asyncio.run(
+        _run_pipeline(
+            specs_per_charm,
+            repo,
+            branch,
+            limits,
+            result_store,
+            wheelhouse,
+            offline,
+            phase_limits,
+        )
+    )
 
 
-def _test_roles(
+def _plan_roles(
     tests_per_role: Dict["_Role", "_RoleTestSpec"],
     interface: str,
-    version: int,
-    repo: str,
-    branch: str,
-) -> "_ResultsPerRole":
-    """Run the tests for each role of this interface."""
-    results_per_role: _ResultsPerRole = {}
+    version: str,
+) -> List[CharmTestSpec]:
+    """Determine which charms need to be tested for each role of this interface."""
+    specs = []
     role: "_Role"
     for role in ["provider", "requirer"]:
-        logging.info(f"Running tests for role: {role}")
         interface_tests = tests_per_role[role]["tests"]
         charm_configs = tests_per_role[role]["charms"]
 
         if not interface_tests:
             logging.info(f"No tests specified for {interface}/{role}; skipping...")
-            results_per_role[role] = {}
         elif not charm_configs:
             logging.info(f"No charms registered for {interface}/{role}; skipping...")
-            results_per_role[role] = {}
         else:
             logging.info(
-                f"Running {len(interface_tests)} {interface} interface tests on: "
+                f"Scheduling {len(interface_tests)} {interface} interface tests on: "
                 f"{[charm.name for charm in charm_configs]}..."
             )
-            results_per_role[role] = _test_charms(
-                charm_configs, interface, version, role, repo, branch
+            specs.extend(
+                CharmTestSpec(interface, version, role, charm_config)
+                for charm_config in charm_configs
             )
-    return results_per_role
+    return specs
 
 
-def _test_interface_version(
-    tests_per_version, interface: str, repo: str, branch: str
-) -> "_ResultsPerVersion":
-    """Run the tests for each version of this interface."""
-    logging.info(f"Running tests for interface: {interface}")
-    results_per_version: _ResultsPerVersion = {}
+def _plan_interface_version(tests_per_version, interface: str) -> List[CharmTestSpec]:
+    """Determine which charms need to be tested for each version of this interface."""
+    specs = []
     for version, tests_per_role in tests_per_version.items():
-        logging.info(f"Running tests for version: {version}")
+        specs.extend(_plan_roles(tests_per_role, interface, version))
+    return specs
 
-        version_int = int(version[1:])
-        results_per_version[version] = _test_roles(
-            tests_per_role, interface, version_int, repo, branch
-        )
 
-    return results_per_version
+def _gather_results(
+    collected, specs: Iterable[CharmTestSpec], reports: Iterable[CharmReport]
+) -> "_ResultsPerInterface":
+    """Arrange the results of the individual charm tests per interface, version and role."""
+    results = {
+        spec: result.status == PASSED
+        for report in reports
+        for spec, result in report.results.items()
+    }
+    test_results: _ResultsPerInterface = {
+        interface: {
+            version: {"provider": {}, "requirer": {}} for version in tests_per_version
+        }
+        for interface, tests_per_version in collected.items()
+    }
+    for spec in specs:
+        results_per_charm = test_results[spec.interface][spec.version][spec.role]
+        results_per_charm[spec.charm_config.name] = results[spec]
+    return test_results
 
 
 def run_interface_tests(
@@ -362,21 +1419,68 @@ def run_interface_tests(
     branch: str,
     include: str = "*",
     keep_cache: bool = False,
+    jobs: int = 1,
+    incremental: bool = False,
+    json_report: Optional[Path] = None,
+    junit_report: Optional[Path] = None,
+    limits: Optional[ConcurrencyLimits] = None,
+    wheelhouse: Optional[Path] = None,
+    offline: bool = False,
+    phase_limits: Optional[Dict[str, PhaseLimits]] = None,
 ) -> "_ResultsPerInterface":
-    """Run the tests for the specified interfaces, defaulting to all."""
+    """Run the tests for the specified interfaces, defaulting to all.
+
+    Optionally, also write a detailed report of the run in JSON and/or JUnit XML format.
+    Unless given explicit concurrency limits, up to ``jobs`` phases of each resource class
+    run at the same time.
+    With a wheelhouse, venvs are installed from it only; offline, it is not populated.
+    The phase limits default to DEFAULT_PHASE_LIMITS; charms can override them in their
+    test_setup.
+    """
     failed = False
     if not keep_cache:
         _clean()
-    test_results = {}
-    collected = collect_tests(path=path, include=include)
-    for interface, version_to_roles in collected.items():
-        results_per_version = _test_interface_version(
-            version_to_roles, interface, repo, branch
+    # load each schema.py once, however many times the collector asks for it
+    with schema_registry.installed(), interface_yaml.installed():
+        collected = collect_tests(path=path, include=include)
+    specs = [
+        spec
+        for interface, tests_per_version in collected.items()
+        for spec in _plan_interface_version(tests_per_version, interface)
+    ]
+    result_store = None
+    if incremental:
+        result_store = ResultStore(
+            RESULTS_CACHE_PATH, path / "interfaces", repo, branch
         )
-        test_results[interface] = results_per_version
-
-        # Running in GitHub actions with the maintainer set on the test.
-        if os.getenv("GITHUB_ACTIONS"):
+    limits = limits or ConcurrencyLimits(network=jobs, pip=jobs, pytest=jobs)
+    history = RunHistory(HISTORY_PATH)
+    reports = _test_charms(
+        specs,
+        repo,
+        branch,
+        limits,
+        result_store,
+        wheelhouse,
+        offline,
+        history,
+        {**DEFAULT_PHASE_LIMITS, **(phase_limits or {})},
+    )
+    test_results = _gather_results(collected, specs, reports)
+    for report in reports:
+        history.record(report)
+    history.save()
+    if result_store:
+        result_store.save()
+    if json_report:
+        write_json_report(reports, json_report)
+    if junit_report:
+        write_junit_report(reports, junit_report)
+
+    # Running in GitHub actions with the maintainer set on the test.
+    if os.getenv("GITHUB_ACTIONS"):
+        for interface, version_to_roles in collected.items():
+            results_per_version = test_results[interface]
             for version, tests_per_role in version_to_roles.items():
                 maintainer = tests_per_role.get("maintainer")
                 if maintainer and test_failed(results_per_version[version]):
@@ -473,6 +1577,70 @@ def flatten_test_result(version_result: "_ResultsPerRole"):
     return result
 
 
+def write_json_report(reports: Iterable[CharmReport], path: Path):
+    """Write the per-charm results and timings of a run to a JSON file."""
+    charms = []
+    for report in reports:
+        charms.append(
+            {
+                "name": report.name,
+                "durations": {k: round(v, 3) for k, v in report.durations.items()},
+                "exit_code": report.exit_code,
+                "commit": report.commit,
+                "setup_error": report.setup_error,
+                "results": [
+                    {
+                        "interface": spec.interface,
+                        "version": spec.version,
+                        "role": spec.role,
+                        **dataclasses.asdict(result),
+                    }
+                    for spec, result in report.results.items()
+                ],
+            }
+        )
+    path.write_text(json.dumps({"charms": charms}, indent=2))
+
+
+def write_junit_report(reports: Iterable[CharmReport], path: Path):
+    """Write the results of a run to a JUnit XML file, with one test case per charm/interface pair.
+
+    Setup failures and killed jobs are reported as errors, test failures as failures.
+    """
+    testsuites = ET.Element("testsuites")
+    for report in reports:
+        testsuite = ET.SubElement(
+            testsuites,
+            "testsuite",
+            name=report.name,
+            tests=str(len(report.results)),
+            time=f"{sum(report.durations.values()):.3f}",
+        )
+        properties = ET.SubElement(testsuite, "properties")
+        for phase, duration in report.durations.items():
+            ET.SubElement(
+                properties,
+                "property",
+                name=f"duration.{phase}",
+                value=f"{duration:.3f}",
+            )
+        for spec, result in report.results.items():
+            testcase = ET.SubElement(
+                testsuite,
+                "testcase",
+                classname=f"{spec.interface}.{spec.version}.{spec.role}",
+                name=report.name,
+                time=f"{result.duration or 0:.3f}",
+            )
+            if result.status in (SETUP_FAILED, KILLED):
+                ET.SubElement(
+                    testcase, "error", type=result.status, message=result.reason or ""
+                )
+            elif result.status != PASSED:
+                ET.SubElement(testcase, "failure", message=result.reason or "")
+    ET.ElementTree(testsuites).write(path, encoding="utf-8", xml_declaration=True)
+
+
 def pprint_interface_test_results(test_results: dict):
     """Pretty print the results of interface tests."""
     print("+++ Results +++")
@@ -491,7 +1659,7 @@ if __name__ == "__main__":
     parser.add_argument(
         "--keep-cache",
         default=False,
-        help="Keep the charm cache intact before running the tests. "
+        help="Keep the charm and venv caches intact before running the tests. "
         "This will save some time when running the tests again "
         "(assuming the charms haven't changed).",
     )
@@ -505,10 +1673,95 @@ if __name__ == "__main__":
         default="main",
         help="The branch of the repo where to find the tests, defaults to main.",
     )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of clones, venv installs and pytest sessions to run in parallel, "
+        "unless overridden by the options below; defaults to 1.",
+    )
+    for resource, description in (
+        ("network", "clones and pre_run scripts"),
+        ("pip", "venv installs"),
+        ("pytest", "pytest sessions"),
+    ):
+        parser.add_argument(
+            f"--{resource}-jobs",
+            type=int,
+            help=f"Number of {description} to run in parallel; defaults to --jobs.",
+        )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Reuse the results of previous runs for the charm/interface pairs "
+        "where neither the charm nor the interface changed since.",
+    )
+    parser.add_argument(
+        "--json-report",
+        type=Path,
+        help="Path to write a JSON report of the run to, "
+        "with per-charm results, failure reasons and timings.",
+    )
+    parser.add_argument(
+        "--junit-report",
+        type=Path,
+        help="Path to write a JUnit XML report of the run to.",
+    )
+    parser.add_argument(
+        "--wheelhouse",
+        type=Path,
+        help="Directory of distributions to install the charm venvs from, "
+        "without reaching the package index. It is populated first from the "
+        "requirements of all charms, unless --offline is given.",
+    )
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        help="Install the charm venvs only from a pre-populated --wheelhouse.",
+    )
+    parser.add_argument(
+        "--timeout",
+        action="append",
+        default=[],
+        metavar="PHASE=SECONDS",
+        help=f"Wall-clock limit for a phase, one of {', '.join(PHASES)}. "
+        "Can be given once per phase; charms can override it in their test_setup.",
+    )
+    parser.add_argument(
+        "--memory-limit",
+        action="append",
+        default=[],
+        metavar="PHASE=MIB",
+        help="Limit on the resident memory of the processes of a phase. "
+        "Can be given once per phase; charms can override it in their test_setup.",
+    )
     args = parser.parse_args()
+    if args.offline and not args.wheelhouse:
+        parser.error("--offline requires --wheelhouse")
+
+    try:
+        phase_limits = _parse_phase_limits(args.timeout, args.memory_limit)
+    except ValueError as e:
+        parser.error(str(e))
 
     result, failed = run_interface_tests(
-        Path("."), args.repo, args.branch, args.include, args.keep_cache
+        Path("."),
+        args.repo,
+        args.branch,
+        args.include,
+        args.keep_cache,
+        args.jobs,
+        args.incremental,
+        args.json_report,
+        args.junit_report,
+        ConcurrencyLimits(
+            network=args.network_jobs or args.jobs,
+            pip=args.pip_jobs or args.jobs,
+            pytest=args.pytest_jobs or args.jobs,
+        ),
+        args.wheelhouse,
+        args.offline,
+        phase_limits,
     )
     pprint_interface_test_results(result)
     exit(1) if failed else exit(0)
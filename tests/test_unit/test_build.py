@@ -1,12 +1,25 @@
+import hashlib
 import json
 import logging
+import os
+import shutil
+import subprocess
+import sys
 from pathlib import Path
 from textwrap import dedent
+from unittest.mock import patch
 
 import pydantic
 import pytest
 
-from docs.build import build_schemas_from_source, dump_json_schema
+from docs.build import (
+    BuildManifest,
+    build_bundle,
+    build_schemas,
+    build_schemas_from_source,
+    canonical_json_schema,
+    dump_json_schema,
+)
 
 
 def test_dump_json_schema(tmp_path):
@@ -184,3 +197,266 @@ def test_build_schemas_broken_source(tmp_path, source, caplog):
         f"Found object called RequirerSchema in {schema_path}; "
         f"expecting a DataBagSchema subclass, not "
     ) in caplog.text
+
+
+def test_dump_json_schema_unchanged(tmp_path):
+    pth = Path(tmp_path) / "myrole"
+
+    class MySchema(pydantic.BaseModel):
+        foo: int = 1
+
+    dump_json_schema(MySchema, pth)
+    output = pth.with_suffix(".json")
+    mtime = output.stat().st_mtime_ns
+
+    # same schema: the file is not rewritten
+    dump_json_schema(MySchema, pth)
+    assert output.stat().st_mtime_ns == mtime
+
+
+def test_build_schemas_from_source_incremental(tmp_path):
+    pth = Path(tmp_path)
+    schema_path = pth / "foo" / "v42" / "schema.py"
+    schema_path.parent.mkdir(exist_ok=True, parents=True)
+    schema_path.write_text(
+        dedent(
+            """import pydantic
+class RequirerSchema(pydantic.BaseModel):
+    foo: int = 1"""
+        )
+    )
+    manifest_path = pth / "manifest.json"
+    output = pth / "outputs" / "foo" / "v42" / "requirer.json"
+
+    manifest = BuildManifest(manifest_path)
+    build_schemas_from_source(schema_path, pth / "outputs", manifest)
+    manifest.save()
+    assert output.exists()
+
+    # nothing changed: the schema is not even loaded
+    manifest = BuildManifest(manifest_path)
+    with patch("utils.schema_registry._get_schemas") as get_schemas:
+        build_schemas_from_source(schema_path, pth / "outputs", manifest)
+    get_schemas.assert_not_called()
+
+    # the output was tampered with: it gets rebuilt
+    expected = output.read_text()
+    output.write_text("{}")
+    build_schemas_from_source(schema_path, pth / "outputs", manifest)
+    assert output.read_text() == expected
+
+    # the source changed: it gets rebuilt
+    schema_path.write_text(schema_path.read_text().replace("= 1", "= 2"))
+    build_schemas_from_source(schema_path, pth / "outputs", manifest)
+    assert json.loads(output.read_text())["properties"]["foo"]["default"] == 2
+
+
+def test_build_manifest_invalidated_by_build_script(tmp_path):
+    pth = Path(tmp_path)
+    schema_path = pth / "foo" / "v42" / "schema.py"
+    schema_path.parent.mkdir(exist_ok=True, parents=True)
+    schema_path.write_text("# schema")
+    manifest = BuildManifest(pth / "manifest.json")
+    manifest.record(schema_path, schema_path.read_text(), {})
+    manifest.save()
+    assert BuildManifest(pth / "manifest.json").is_up_to_date(
+        schema_path, schema_path.read_text()
+    )
+
+    # built by a version of build.py that serialized the schemas differently
+    saved = json.loads((pth / "manifest.json").read_text())
+    saved["toolchain"]["build.py"] = hashlib.sha256(b"previous").hexdigest()
+    (pth / "manifest.json").write_text(json.dumps(saved))
+    assert not BuildManifest(pth / "manifest.json").is_up_to_date(
+        schema_path, schema_path.read_text()
+    )
+
+
+def test_build_schemas_collects_errors(tmp_path):
+    pth = Path(tmp_path)
+    good = pth / "foo" / "v42" / "schema.py"
+    bad = pth / "bar" / "v1" / "schema.py"
+    for schema_path in (good, bad):
+        schema_path.parent.mkdir(exist_ok=True, parents=True)
+    good.write_text(
+        dedent(
+            """import pydantic
+class RequirerSchema(pydantic.BaseModel):
+    foo: int = 1"""
+        )
+    )
+    bad.write_text("from typing import conlist")
+    manifest = BuildManifest(pth / "manifest.json")
+
+    errors = build_schemas([good, bad], pth / "outputs", manifest, jobs=2)
+
+    assert (pth / "outputs" / "foo" / "v42" / "requirer.json").exists()
+    assert len(errors) == 1
+    assert f"Failed to load module {bad}" in errors[0]
+    # the broken source is retried by the next build, the good one is not
+    assert manifest.is_up_to_date(good, good.read_text())
+    assert not manifest.is_up_to_date(bad, bad.read_text())
+
+
+def test_build_bundle(tmp_path):
+    pth = Path(tmp_path)
+    shared = {"properties": {"x": {"type": "string"}}, "type": "object"}
+    schemas = {
+        "foo/v0/provider": {
+            "$defs": {"Shared": shared, "Data": {"type": "string"}},
+            "properties": {
+                "a": {"$ref": "#/$defs/Shared"},
+                "b": {"$ref": "#/$defs/Data"},
+            },
+        },
+        "foo/v0/requirer": {
+            # pydantic v1 style
+            "definitions": {"Shared": shared, "Data": {"type": "integer"}},
+            "properties": {
+                "a": {"$ref": "#/definitions/Shared"},
+                "b": {"$ref": "#/definitions/Data"},
+            },
+        },
+    }
+    for key, schema in schemas.items():
+        path = (pth / "schemas" / key).with_suffix(".json")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(schema))
+
+    bundle_path = pth / "bundle.json"
+    bundle = build_bundle(pth / "schemas", bundle_path)
+
+    assert json.loads(bundle_path.read_text()) == bundle
+    defs = bundle["$defs"]
+    # identical definitions are shared, different ones with the same name are not
+    assert defs["Shared"] == shared
+    assert len(defs) == 3
+    provider = bundle["schemas"]["foo/v0/provider"]
+    requirer = bundle["schemas"]["foo/v0/requirer"]
+    assert provider["properties"]["a"] == requirer["properties"]["a"]
+    assert defs[provider["properties"]["b"]["$ref"].split("/")[-1]] == {
+        "type": "string"
+    }
+    assert defs[requirer["properties"]["b"]["$ref"].split("/")[-1]] == {
+        "type": "integer"
+    }
+    assert "definitions" not in requirer
+
+    content = {key: value for key, value in bundle.items() if key != "sha256"}
+    serialized = json.dumps(content, separators=(",", ":"), sort_keys=True)
+    assert bundle["sha256"] == hashlib.sha256(serialized.encode()).hexdigest()
+
+
+def test_canonical_json_schema():
+    v1_schema = {
+        "title": "RequirerSchema",
+        "description": "\n    Foo.\n\n    Bar.\n    ",
+        "properties": {
+            "app": {"$ref": "#/definitions/AppData"},
+            "description": {"type": "string", "default": "  kept as is "},
+        },
+        "definitions": {"AppData": {"type": "object", "title": "AppData"}},
+    }
+    serialized = canonical_json_schema(v1_schema)
+
+    assert json.loads(serialized) == {
+        "$defs": {"AppData": {"title": "AppData", "type": "object"}},
+        "description": "Foo.\n\nBar.",
+        "properties": {
+            "app": {"$ref": "#/$defs/AppData"},
+            "description": {"default": "  kept as is ", "type": "string"},
+        },
+        "title": "RequirerSchema",
+    }
+    # whatever the order the keys came in
+    reordered = dict(reversed(list(v1_schema.items())))
+    assert canonical_json_schema(reordered) == serialized
+
+
+def test_check(tmp_path):
+    pth = Path(tmp_path)
+    schema_path = pth / "foo" / "v42" / "schema.py"
+    schema_path.parent.mkdir(exist_ok=True, parents=True)
+    schema_path.write_text(
+        dedent(
+            """import pydantic
+class RequirerSchema(pydantic.BaseModel):
+    foo: int = 1"""
+        )
+    )
+    output = pth / "outputs" / "foo" / "v42" / "requirer.json"
+
+    would_change = []
+    build_schemas([schema_path], pth / "outputs", jobs=1, would_change=would_change)
+    assert would_change == [output]
+    assert not output.exists()
+
+    build_schemas([schema_path], pth / "outputs", jobs=1)
+    would_change = []
+    build_schemas([schema_path], pth / "outputs", jobs=1, would_change=would_change)
+    assert would_change == []
+
+
+def test_build_bundle_only_versioned_schemas(tmp_path):
+    pth = Path(tmp_path)
+    for key in ("foo/v0/provider", "interfaces/foo/provider", "foo/vnext/provider"):
+        path = (pth / "schemas" / key).with_suffix(".json")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps({"type": "object"}))
+
+    bundle = build_bundle(pth / "schemas", pth / "bundle.json")
+    assert list(bundle["schemas"]) == ["foo/v0/provider"]
+
+
+@pytest.fixture
+def docs_tree(tmp_path):
+    """A copy of the build script and the schema registry, with a single interface."""
+    root = Path(__file__).parents[2]
+    for path in ("docs/build.py", "utils/schema_registry.py"):
+        (tmp_path / path).parent.mkdir(parents=True, exist_ok=True)
+        shutil.copy(root / path, tmp_path / path)
+    schema_path = tmp_path / "interfaces" / "foo" / "v0" / "schema.py"
+    schema_path.parent.mkdir(parents=True)
+    schema_path.write_text(
+        dedent(
+            """import pydantic
+class RequirerSchema(pydantic.BaseModel):
+    foo: int = 1"""
+        )
+    )
+    (tmp_path / "docs" / "json_schemas").mkdir()
+    return tmp_path
+
+
+def _run_build_script(root: Path, *args: str) -> subprocess.CompletedProcess:
+    # as tox and the docs run it, from the root, though not necessarily on the PYTHONPATH
+    env = {k: v for k, v in os.environ.items() if k != "PYTHONPATH"}
+    return subprocess.run(
+        [sys.executable, "docs/build.py", "--jobs", "2", *args],
+        cwd=root,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+
+
+def test_build_script(docs_tree):
+    proc = _run_build_script(docs_tree)
+    assert proc.returncode == 0, proc.stderr
+    output = docs_tree / "docs" / "json_schemas" / "foo" / "v0" / "requirer.json"
+    assert json.loads(output.read_text())["properties"]["foo"]["default"] == 1
+
+    proc = _run_build_script(docs_tree, "--check")
+    assert proc.returncode == 0, proc.stderr
+
+
+@pytest.mark.parametrize("args", ((), ("--check",)))
+def test_build_script_fails_on_build_errors(docs_tree, args):
+    _run_build_script(docs_tree)
+    broken = docs_tree / "interfaces" / "bar" / "v0" / "schema.py"
+    broken.parent.mkdir(parents=True)
+    broken.write_text("from typing import conlist")
+
+    proc = _run_build_script(docs_tree, *args)
+    assert proc.returncode == 1
+    assert f"Failed to load module {broken}" in proc.stderr
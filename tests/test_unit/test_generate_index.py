@@ -0,0 +1,138 @@
+import hashlib
+import importlib
+import json
+import sys
+from pathlib import Path
+
+import pytest
+import yaml
+
+# the utils scripts import their siblings as top-level modules
+sys.path.insert(0, str(Path(__file__).parents[2] / "utils"))
+generate_index = importlib.import_module("generate_index")
+interface_yaml = importlib.import_module("interface_yaml")
+
+
+def _charm(name):
+    return {"name": name, "url": f"https://github.com/canonical/{name}-operator"}
+
+
+INTERFACES = {
+    ("foo", "v0"): {
+        "name": "foo",
+        "version": 0,
+        "status": "published",
+        "providers": [_charm("foo-k8s")],
+        "requirers": [_charm("bar-k8s")],
+        "maintainer": "team-a",
+    },
+    ("foo", "v1"): {
+        "name": "foo",
+        "version": 1,
+        "status": "draft",
+        "providers": [_charm("foo-k8s")],
+        "requirers": [],
+        "maintainer": "team-b",
+    },
+    ("bar", "v0"): {
+        "name": "bar",
+        "version": 0,
+        "status": "retired",
+        "providers": [],
+        "requirers": [],
+        "maintainer": "",
+    },
+}
+
+
+@pytest.fixture
+def tree(tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        generate_index, "reader", interface_yaml.InterfaceYamlReader(None)
+    )
+    for (interface, version), raw_interface in INTERFACES.items():
+        version_dir = tmp_path / "interfaces" / interface / version
+        (version_dir / "interface_tests").mkdir(parents=True)
+        (version_dir / "interface.yaml").write_text(yaml.safe_dump(raw_interface))
+    # the template is left out
+    template_dir = tmp_path / "interfaces" / "__template__" / "v0"
+    template_dir.mkdir(parents=True)
+    (template_dir / "interface.yaml").write_text(
+        yaml.safe_dump({**INTERFACES["foo", "v0"], "name": "__template__"})
+    )
+
+    foo = tmp_path / "interfaces" / "foo" / "v0"
+    (foo / "schema.py").write_text("")
+    (foo / "interface_tests" / "test_provider.py").write_text("")
+    # a schema built for a single role
+    schemas = tmp_path / "docs" / "json_schemas" / "foo" / "v0"
+    schemas.mkdir(parents=True)
+    (schemas / "provider.json").write_text(json.dumps({"title": "ProviderSchema"}))
+    return tmp_path
+
+
+def _get_catalogue(tree):
+    return generate_index.get_catalogue(
+        str(tree / "interfaces"), str(tree / "docs" / "json_schemas")
+    )
+
+
+def test_get_catalogue(tree):
+    catalogue = _get_catalogue(tree)
+    interfaces = catalogue["interfaces"]
+    assert list(interfaces) == ["bar/v0", "foo/v0", "foo/v1"]
+
+    provider_json = tree / "docs" / "json_schemas" / "foo" / "v0" / "provider.json"
+    assert interfaces["foo/v0"] == {
+        "name": "foo",
+        "version": 0,
+        "status": "published",
+        "maintainer": "team-a",
+        "has_schema": True,
+        "providers": [_charm("foo-k8s")],
+        "requirers": [_charm("bar-k8s")],
+        "has_tests": {"provider": True, "requirer": False},
+        "schema_sha256": {
+            "provider": hashlib.sha256(provider_json.read_bytes()).hexdigest(),
+            "requirer": None,
+        },
+    }
+    assert interfaces["foo/v1"]["has_schema"] is False
+    assert interfaces["foo/v1"]["has_tests"] == {"provider": False, "requirer": False}
+    assert interfaces["foo/v1"]["schema_sha256"] == {"provider": None, "requirer": None}
+
+    assert catalogue["by_charm"] == {
+        "bar-k8s": {"provider": [], "requirer": ["foo/v0"]},
+        "foo-k8s": {"provider": ["foo/v0", "foo/v1"], "requirer": []},
+    }
+    # interfaces without a maintainer are left out
+    assert catalogue["by_maintainer"] == {"team-a": ["foo/v0"], "team-b": ["foo/v1"]}
+
+
+def test_get_catalogue_schema_changed(tree):
+    provider_json = tree / "docs" / "json_schemas" / "foo" / "v0" / "provider.json"
+    before = _get_catalogue(tree)["interfaces"]["foo/v0"]["schema_sha256"]
+
+    provider_json.write_text(json.dumps({"title": "OtherProviderSchema"}))
+    after = _get_catalogue(tree)["interfaces"]["foo/v0"]["schema_sha256"]
+    assert after["provider"] != before["provider"]
+    assert after["requirer"] == before["requirer"] is None
+
+
+def test_get_catalogue_loaded(tree):
+    loaded = list(generate_index._load_interfaces(str(tree / "interfaces")))
+    assert [(interface, version) for interface, version, _ in loaded] == [
+        ("bar", "v0"),
+        ("foo", "v0"),
+        ("foo", "v1"),
+    ]
+    catalogue = generate_index.get_catalogue(
+        str(tree / "interfaces"), str(tree / "docs" / "json_schemas"), loaded
+    )
+    assert catalogue == _get_catalogue(tree)
+    # nothing is read from disk for the interfaces given
+    assert generate_index.get_catalogue(str(tree / "interfaces"), loaded=[]) == {
+        "interfaces": {},
+        "by_charm": {},
+        "by_maintainer": {},
+    }
@@ -0,0 +1,264 @@
+from unittest.mock import DEFAULT, patch
+
+import pytest
+from ops.charm import CharmBase
+from ops.model import ModelError
+from ops.testing import Harness
+
+from lib.charms.interfaces.v2 import ingress
+
+REQUIRER_APP_DATA = {"model": '"m"', "name": '"remote"', "port": "80"}
+REQUIRER_UNIT_DATA = {"host": '"remote-0.host"'}
+
+
+class ProviderCharm(CharmBase):
+    def __init__(self, framework):
+        super().__init__(framework)
+        self.ingress = ingress.IngressPerAppProvider(self)
+
+
+@pytest.fixture
+def provider():
+    harness = Harness(
+        ProviderCharm,
+        meta='{"name": "p", "provides": {"ingress": {"interface": "ingress"}}}',
+    )
+    harness.set_leader(True)
+    harness.begin()
+    yield harness
+    harness.cleanup()
+
+
+def _add_requirer(harness, app="remote", app_data=REQUIRER_APP_DATA):
+    relation_id = harness.add_relation("ingress", app)
+    harness.add_relation_unit(relation_id, f"{app}/0")
+    harness.update_relation_data(relation_id, app, app_data)
+    harness.update_relation_data(relation_id, f"{app}/0", REQUIRER_UNIT_DATA)
+    return harness.model.get_relation("ingress", relation_id)
+
+
+def test_provider_validates_requirer_data_once(provider):
+    relation = _add_requirer(provider, app_data={"port": "80"})
+    with patch.object(
+        ingress.IngressRequirerAppData,
+        "load",
+        wraps=ingress.IngressRequirerAppData.load,
+    ) as load:
+        # relation-changed: is_ready and get_data share a single validation
+        provider.update_relation_data(relation.id, "remote", REQUIRER_APP_DATA)
+        data = provider.charm.ingress.get_data(relation)
+        assert provider.charm.ingress.get_data(relation) is data
+    load.assert_called_once()
+
+
+def test_provider_validates_again_on_change(provider):
+    relation = _add_requirer(provider)
+    before = provider.charm.ingress.get_data(relation)
+    provider.update_relation_data(relation.id, "remote", {"port": "81"})
+
+    after = provider.charm.ingress.get_data(relation)
+    assert after is not before
+    assert after.app.port == 81
+
+
+def test_provider_does_not_memoize_invalid_data(provider):
+    relation = _add_requirer(provider, app_data={"port": "80"})
+    assert not provider.charm.ingress.is_ready(relation)
+
+    provider.update_relation_data(relation.id, "remote", REQUIRER_APP_DATA)
+    assert provider.charm.ingress.is_ready(relation)
+
+
+def test_proxied_endpoints_memoized(provider):
+    relation = _add_requirer(provider)
+    provider.charm.ingress.publish_url(relation, "http://foo.bar/remote")
+    with patch.object(
+        ingress.IngressProviderAppData,
+        "load",
+        wraps=ingress.IngressProviderAppData.load,
+    ) as load:
+        for _ in range(2):
+            assert provider.charm.ingress.proxied_endpoints == {
+                "remote": {"url": "http://foo.bar/remote"}
+            }
+    load.assert_called_once()
+
+    provider.charm.ingress.publish_url(relation, "http://foo.bar/other")
+    assert provider.charm.ingress.proxied_endpoints == {
+        "remote": {"url": "http://foo.bar/other"}
+    }
+
+
+def test_load_validates_decoded_values():
+    data = ingress.IngressRequirerAppData.load(
+        {**REQUIRER_APP_DATA, "strip-prefix": "true", "ingress-address": "10.0.0.1"}
+    )
+    assert (data.model, data.name, data.port) == ("m", "remote", 80)
+    assert data.strip_prefix is True
+
+
+@pytest.mark.parametrize(
+    "databag",
+    (
+        {**REQUIRER_APP_DATA, "port": "eighty"},
+        {**REQUIRER_APP_DATA, "port": '"eighty"'},
+        {"model": '"m"', "name": '"remote"'},
+    ),
+)
+def test_load_invalid(databag):
+    with pytest.raises(ingress.DataValidationError):
+        ingress.IngressRequirerAppData.load(databag)
+
+
+def test_load_model_field():
+    data = ingress.IngressProviderAppData.load(
+        {"ingress": '{"url": "http://foo.bar/remote"}'}
+    )
+    assert str(data.ingress.url) == "http://foo.bar/remote"
+
+
+@pytest.fixture
+def relation_sets(provider):
+    update_relation_data = provider._backend.update_relation_data
+    with patch.object(
+        provider._backend, "update_relation_data", wraps=update_relation_data
+    ) as relation_set:
+        yield relation_set
+
+
+def test_dump_writes_changed_keys_only():
+    databag = {**REQUIRER_APP_DATA, "ingress-address": "10.0.0.1", "stale": "1"}
+    suppressed_writes = ingress.DatabagModel.suppressed_writes
+    ingress.IngressRequirerAppData(model="m", name="remote", port=81).dump(databag)
+
+    assert databag == {**REQUIRER_APP_DATA, "port": "81", "ingress-address": "10.0.0.1"}
+    assert ingress.DatabagModel.suppressed_writes == suppressed_writes + 2
+
+
+def test_dump_no_clear_keeps_other_keys():
+    databag = {"stale": "1"}
+    ingress.IngressRequirerAppData(model="m", name="remote", port=80).dump(
+        databag, clear=False
+    )
+    assert databag == {**REQUIRER_APP_DATA, "stale": "1"}
+
+
+def test_publish_url_unchanged_not_written(provider, relation_sets):
+    relation = _add_requirer(provider)
+    relation_sets.reset_mock()
+    provider.charm.ingress.publish_url(relation, "http://foo.bar/remote")
+    assert relation_sets.call_count == 1
+
+    provider.charm.ingress.publish_url(relation, "http://foo.bar/remote")
+    assert relation_sets.call_count == 1
+    assert provider.get_relation_data(relation.id, "p") == {
+        "ingress": '{"url": "http://foo.bar/remote"}'
+    }
+
+
+def test_publish_urls(provider, relation_sets):
+    valid, invalid, broken = (_add_requirer(provider, app) for app in "abc")
+
+    def relation_set(relation_id, *_, **__):
+        if relation_id == broken.id:
+            raise ModelError("relation-set failed")
+        return DEFAULT
+
+    relation_sets.side_effect = relation_set
+    urls = {valid: "http://foo.bar/a", invalid: "not a url", broken: "http://foo.bar/c"}
+    errors = provider.charm.ingress.publish_urls(urls)
+
+    assert set(errors) == {invalid, broken}
+    assert isinstance(errors[invalid], ingress.DataValidationError)
+    assert isinstance(errors[broken], ModelError)
+    assert provider.charm.ingress.proxied_endpoints == {
+        "a": {"url": "http://foo.bar/a"}
+    }
+
+    relation_sets.reset_mock()
+    provider.charm.ingress.publish_urls({valid: "http://foo.bar/a"})
+    relation_sets.assert_not_called()
+
+
+def _requirer(resolution_ttl=None):
+    class RequirerCharm(CharmBase):
+        def __init__(self, framework):
+            super().__init__(framework)
+            self.ingress = ingress.IngressPerAppRequirer(
+                self, port=80, resolution_ttl=resolution_ttl
+            )
+
+    harness = Harness(
+        RequirerCharm,
+        meta='{"name": "r", "requires": {"ingress": {"interface": "ingress"}}}',
+    )
+    harness.set_model_name("m")
+    harness.set_leader(True)
+    harness.add_network("10.0.0.10")
+    return harness
+
+
+def _next_dispatch(requirer):
+    # a new dispatch instantiates the charm anew: drop what this one resolved
+    requirer._fqdn = None
+    requirer._bind_addresses = {}
+    requirer._load_resolved()
+
+
+@pytest.mark.parametrize("resolution_ttl", (None, 60))
+def test_requirer_resolves_once_per_dispatch(resolution_ttl):
+    harness = _requirer(resolution_ttl)
+    with patch.object(
+        ingress.socket, "getfqdn", return_value="r-0.host"
+    ) as getfqdn, patch.object(
+        harness.model, "get_binding", wraps=harness.model.get_binding
+    ) as get_binding:
+        harness.begin()
+        relation_ids = [harness.add_relation("ingress", app) for app in "ab"]
+        for _ in range(3):
+            harness.charm.on.upgrade_charm.emit()
+
+    getfqdn.assert_called_once()
+    assert get_binding.call_count == len(relation_ids)
+    for relation_id in relation_ids:
+        assert harness.get_relation_data(relation_id, "r/0") == {
+            "host": '"r-0.host"',
+            "ip": '"10.0.0.10"',
+        }
+    harness.cleanup()
+
+
+def test_requirer_reuses_fqdn_until_expired():
+    harness = _requirer(resolution_ttl=60)
+    with patch.object(ingress.socket, "getfqdn", return_value="r-0.host") as getfqdn:
+        harness.begin()
+        harness.add_relation("ingress", "a")
+        requirer = harness.charm.ingress
+        assert requirer._stored.resolved["fqdn"] == "r-0.host"
+
+        _next_dispatch(requirer)
+        harness.charm.on.upgrade_charm.emit()
+        getfqdn.assert_called_once()
+
+        requirer._stored.resolved["at"] -= 61
+        _next_dispatch(requirer)
+        harness.charm.on.upgrade_charm.emit()
+        assert getfqdn.call_count == 2
+    harness.cleanup()
+
+
+def test_requirer_does_not_store_bind_addresses():
+    harness = _requirer(resolution_ttl=60)
+    harness.begin()
+    harness.add_relation("ingress", "a")
+    requirer = harness.charm.ingress
+    assert "bind_addresses" not in requirer._stored.resolved
+
+    # the address changes when the pod restarts: query it anew in every dispatch
+    _next_dispatch(requirer)
+    with patch.object(
+        harness.model, "get_binding", wraps=harness.model.get_binding
+    ) as get_binding:
+        harness.charm.on.upgrade_charm.emit()
+    get_binding.assert_called_once()
+    harness.cleanup()
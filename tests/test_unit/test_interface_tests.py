@@ -11,9 +11,18 @@ from ops.framework import Framework
 from ops.model import BlockedStatus
 from scenario import State
 
+from utils import schema_registry
+
 PROJECT_ROOT = Path(__file__).parent.parent.parent
 
 
+@pytest.fixture(autouse=True)
+def registry():
+    # load the schemas the way the other tools do
+    with schema_registry.installed() as registry:
+        yield registry
+
+
 class MyProvider(CharmBase):
     META = {"name": "local", "provides": {"ingress": {"interface": "ingress"}}}
 
@@ -0,0 +1,303 @@
+import importlib
+import json
+import subprocess
+import sys
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+import yaml
+
+# the utils scripts import their siblings as top-level modules
+sys.path.insert(0, str(Path(__file__).parents[2] / "utils"))
+validator = importlib.import_module("interface-validator")
+interface_yaml = importlib.import_module("interface_yaml")
+
+CHARM = {"name": "foo-k8s", "url": "https://github.com/canonical/foo-k8s-operator"}
+SCHEMA = """from interface_tester.schema_base import DataBagSchema
+
+
+class ProviderSchema(DataBagSchema):
+    pass
+
+
+class RequirerSchema(DataBagSchema):
+    pass
+"""
+
+
+def _interface(name="foo", version=0, status="published", providers=(), requirers=()):
+    return {
+        "name": name,
+        "version": version,
+        "status": status,
+        "providers": list(providers),
+        "requirers": list(requirers),
+        "maintainer": "bar",
+    }
+
+
+def _write_interface(raw_interface, schema=SCHEMA, tests=()):
+    """Write an interface to the tree in the current directory; return its file."""
+    version_dir = Path(
+        "interfaces", raw_interface["name"], f"v{raw_interface['version']}"
+    )
+    (version_dir / "interface_tests").mkdir(parents=True, exist_ok=True)
+    (version_dir / "interface.yaml").write_text(yaml.safe_dump(raw_interface))
+    if schema is not None:
+        (version_dir / "schema.py").write_text(schema)
+    for role in tests:
+        (version_dir / "interface_tests" / f"test_{role}.py").write_text("")
+    return f"./{version_dir / 'interface.yaml'}"
+
+
+def _write_index(*raw_interfaces):
+    index = [
+        {key: raw[key] for key in ("name", "version", "status")}
+        # as generate_index sorts them
+        for raw in sorted(raw_interfaces, key=lambda raw: (raw["name"], raw["version"]))
+    ]
+    Path("index.json").write_text(json.dumps(index))
+
+
+@pytest.fixture(autouse=True)
+def tree(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(validator, "reader", interface_yaml.InterfaceYamlReader(None))
+    Path("interfaces").mkdir()
+    _write_index()
+    return tmp_path
+
+
+def _messages(errors):
+    return [(error["file"], error["type"], error["message"]) for error in errors]
+
+
+def test_cross_references_valid():
+    raw = _interface(providers=[CHARM])
+    file = _write_interface(raw, tests=("provider",))
+    _write_index(raw)
+    assert (
+        validator.Validator(cross_references=True)._check_cross_references({file: raw})
+        == []
+    )
+
+
+def test_cross_references_dangling():
+    missing_schema = _interface("foo", providers=[CHARM])
+    missing_role = _interface("bar")
+    invalid_schema = _interface("baz")
+    missing_tests = _interface("qux", status="draft", requirers=[CHARM])
+    parsed = {
+        _write_interface(
+            missing_schema, schema=None, tests=("provider",)
+        ): missing_schema,
+        _write_interface(
+            missing_role, schema=SCHEMA.split("\n\n\nclass Req")[0]
+        ): missing_role,
+        _write_interface(
+            invalid_schema, schema="class ProviderSchema("
+        ): invalid_schema,
+        _write_interface(missing_tests, schema=None): missing_tests,
+    }
+    _write_index(*parsed.values())
+
+    errors = validator.Validator(cross_references=True)._check_cross_references(parsed)
+    files = list(parsed)
+    assert [(file, type) for file, type, _ in _messages(errors)] == [
+        (files[0], "schema.py"),
+        (files[1], "schema.py"),
+        (files[2], "schema.py"),
+        (files[3], "tests"),
+    ]
+    assert "has no ./interfaces/foo/v0/schema.py" in errors[0]["message"]
+    assert "does not define RequirerSchema" in errors[1]["message"]
+    assert "is invalid" in errors[2]["message"]
+    assert (
+        "no ./interfaces/qux/v0/interface_tests/test_requirer.py"
+        in errors[3]["message"]
+    )
+
+
+def test_cross_references_index_out_of_date():
+    raw = _interface()
+    file = _write_interface(raw)
+    _write_index(_interface("bar"))
+
+    errors = validator.Validator(cross_references=True)._check_cross_references(
+        {file: raw}
+    )
+    [(index_file, type, message)] = _messages(errors)
+    assert (index_file, type) == ("index.json", "index")
+    assert message == (
+        "out of date; run utils/generate_index.py. "
+        "Missing: [{'name': 'foo', 'version': 0, 'status': 'published'}]; "
+        "stale: [{'name': 'bar', 'version': 0, 'status': 'published'}]"
+    )
+
+    # the index is not checked against a subset of the interfaces
+    changed = validator.Validator(changed_since="HEAD", cross_references=True)
+    assert changed._check_cross_references({file: raw}) == []
+
+
+def _baseline(*errors):
+    Path("baseline.json").write_text(json.dumps({"errors": list(errors)}))
+    return validator.Validator(cross_references=True, baseline="baseline.json")
+
+
+def test_baseline_suppresses_known_errors(capsys):
+    raw = _interface(providers=[CHARM])
+    file = _write_interface(raw, schema=None)
+    _write_index(raw)
+    errors = validator.Validator(cross_references=True)._validate_all([file])
+    assert [error["type"] for error in errors] == ["schema.py", "tests"]
+
+    assert _baseline(*errors)._apply_baseline(errors) == []
+    assert "Ignoring 2 known errors" in capsys.readouterr().out
+    # and only those
+    assert _baseline(errors[0])._apply_baseline(errors) == [errors[1]]
+
+
+def test_baseline_stale_entries(capsys):
+    fixed = {
+        "file": "./interfaces/bar/v0/interface.yaml",
+        "type": "tests",
+        "message": "gone",
+    }
+    raw = _interface(providers=[CHARM])
+    file = _write_interface(raw, tests=("provider",))
+    _write_index(raw)
+    errors = validator.Validator(cross_references=True)._validate_all([file])
+    assert errors == []
+
+    assert _baseline(fixed)._apply_baseline(errors) == []
+    assert "1 errors recorded in baseline.json are fixed" in capsys.readouterr().out
+
+    # on a subset of the files, the other entries may well still apply
+    changed = validator.Validator(
+        changed_since="HEAD", cross_references=True, baseline="baseline.json"
+    )
+    changed._apply_baseline(errors)
+    assert "are fixed" not in capsys.readouterr().out
+
+
+def test_update_baseline_records_known_gaps_only():
+    raw = _interface(providers=[CHARM])
+    _write_interface(raw, schema=None)
+    # an index error is not a known gap, but a mistake
+    _write_index()
+
+    _baseline().update_baseline()
+    recorded = json.loads(Path("baseline.json").read_text())["errors"]
+    assert [error["type"] for error in recorded] == ["schema.py", "tests"]
+
+    # which are then not reported
+    errors = validator.Validator(cross_references=True)._validate_all(
+        validator.Validator()._get_files()
+    )
+    assert [error["type"] for error in errors] == ["schema.py", "tests", "index"]
+    assert _messages(_baseline(*recorded)._apply_baseline(errors)) == _messages(
+        errors[2:]
+    )
+
+
+def _git(*args):
+    subprocess.check_output(
+        ["git", "-c", "user.name=test", "-c", "user.email=test@example.com", *args]
+    )
+
+
+def test_changed_since():
+    files = [_write_interface(_interface(name)) for name in ("foo", "bar", "baz")]
+    _git("init", "--quiet")
+    _git("add", ".")
+    _git("commit", "--quiet", "-m", "interfaces")
+
+    modified, deleted, unchanged = files
+    Path(modified).write_text(Path(modified).read_text().replace("bar", "qux"))
+    Path(deleted).unlink()
+    added = _write_interface(_interface("quux"))
+    # not an interface.yaml
+    Path("interfaces", "baz", "v0", "schema.py").write_text("")
+
+    changed = validator.Validator(changed_since="HEAD")
+    assert changed._get_files() == sorted([modified, added])
+    assert validator.Validator()._get_files() == sorted([modified, unchanged, added])
+    # and none again once committed
+    _git("add", "--all")
+    _git("commit", "--quiet", "-m", "changes")
+    assert changed._get_files() == []
+
+
+def _write_invalid_interfaces(count):
+    files = [_write_interface(_interface(f"foo{i}"), schema=None) for i in range(count)]
+    for file in files:
+        # valid yaml, but the version does not match the folder structure
+        Path(file).write_text(
+            Path(file).read_text().replace("version: 0", "version: 1")
+        )
+    return files
+
+
+@pytest.mark.parametrize("jobs", (1, 2))
+def test_fail_fast(jobs):
+    files = _write_invalid_interfaces(3 * validator.VALIDATION_CHUNK_SIZE)
+
+    errors = validator.Validator(jobs=jobs)._validate_all(files)
+    assert [error["file"] for error in errors] == files
+    errors = validator.Validator(jobs=jobs, fail_fast=True)._validate_all(files)
+    assert [error["file"] for error in errors] == files[:1]
+
+
+def test_fail_fast_on_yaml_errors():
+    files = _write_invalid_interfaces(2)
+    Path(files[0]).write_text("name: [foo")
+
+    with patch.object(validator, "_validate", wraps=validator._validate) as validate:
+        errors = validator.Validator(fail_fast=True)._validate_all(files)
+    assert [(error["file"], error["type"]) for error in errors] == [(files[0], "yaml")]
+    validate.assert_not_called()
+
+
+def test_fail_fast_skips_cross_references():
+    files = _write_invalid_interfaces(1) + [
+        _write_interface(_interface(providers=[CHARM]), schema=None)
+    ]
+
+    errors = validator.Validator(cross_references=True)._validate_all(files)
+    assert [error["type"] for error in errors] == [
+        "path",
+        "schema.py",
+        "tests",
+        "index",
+    ]
+    errors = validator.Validator(fail_fast=True, cross_references=True)._validate_all(
+        files
+    )
+    assert [error["type"] for error in errors] == ["path"]
+
+
+def test_report():
+    valid = _write_interface(_interface())
+    [invalid] = _write_invalid_interfaces(1)
+
+    with pytest.raises(SystemExit) as exc_info:
+        validator.Validator().run(report="report.json")
+    assert invalid in str(exc_info.value)
+
+    report = json.loads(Path("report.json").read_text())
+    assert report["files"] == sorted([valid, invalid])
+    [error] = report["errors"]
+    assert (error["file"], error["type"]) == (invalid, "path")
+    assert error["message"] == "version (0) does not match folder structure"
+
+
+def test_report_valid(capsys):
+    valid = _write_interface(_interface())
+
+    validator.Validator().run(report="report.json")
+    assert "Validation completed!" in capsys.readouterr().out
+    assert json.loads(Path("report.json").read_text()) == {
+        "files": [valid],
+        "errors": [],
+    }
@@ -0,0 +1,63 @@
+from unittest.mock import patch
+
+import yaml
+from interface_tester import collector
+
+from utils.interface_yaml import InterfaceYamlReader, installed
+
+INTERFACE_YAML = """name: foo
+version: 0
+status: draft
+providers: []
+requirers: []
+maintainer: bar
+"""
+
+
+def test_read_cached_across_readers(tmp_path):
+    path = tmp_path / "interface.yaml"
+    path.write_text(INTERFACE_YAML)
+    cache_path = tmp_path / "cache.json"
+
+    reader = InterfaceYamlReader(cache_path)
+    assert reader.read(path)["maintainer"] == "bar"
+    reader.save()
+
+    # a later run does not parse it again
+    with patch("yaml.load") as load:
+        data = InterfaceYamlReader(cache_path).read(path)
+    load.assert_not_called()
+    assert data["maintainer"] == "bar"
+
+
+def test_read_changed(tmp_path):
+    path = tmp_path / "interface.yaml"
+    path.write_text(INTERFACE_YAML)
+    reader = InterfaceYamlReader(tmp_path / "cache.json")
+    reader.read(path)
+
+    path.write_text(INTERFACE_YAML.replace("bar", "bazqux"))
+    assert reader.read(path)["maintainer"] == "bazqux"
+
+
+def test_read_returns_copies(tmp_path):
+    path = tmp_path / "interface.yaml"
+    path.write_text(INTERFACE_YAML)
+    reader = InterfaceYamlReader(None)
+
+    reader.read(path)["providers"].append("qux")
+    assert reader.read(path)["providers"] == []
+
+
+def test_installed_parses_through_reader():
+    with installed() as reader:
+        with patch.object(reader, "loads", return_value={}) as loads:
+            collector.yaml.safe_load(INTERFACE_YAML)
+        loads.assert_called_once_with(INTERFACE_YAML)
+    assert collector.yaml is yaml
+
+
+def test_installed_leaves_unexpected_collector_alone():
+    with patch.object(collector, "yaml", None):
+        with installed():
+            assert collector.yaml is None
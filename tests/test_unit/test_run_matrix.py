@@ -0,0 +1,815 @@
+import asyncio
+import contextlib
+import json
+import subprocess
+import sys
+import threading
+import time
+import xml.etree.ElementTree as ET
+from pathlib import Path
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+from interface_tester.collector import _CharmTestConfig
+
+import run_matrix
+from run_matrix import (
+    DEFAULT_PHASE_LIMITS,
+    FAILED,
+    KILLED,
+    PASSED,
+    SETUP_FAILED,
+    CharmReport,
+    CharmTestResult,
+    CharmTestSpec,
+    ConcurrencyLimits,
+    InterfaceTestError,
+    PhaseLimits,
+    ResourceLimitError,
+    ResultStore,
+    RunHistory,
+    SetupError,
+    Wheelhouse,
+    _build_venv,
+    _checkout_charm_repo,
+    _clean,
+    _gather_results,
+    _get_charm_id,
+    _get_charm_paths,
+    _get_checkout_commit,
+    _get_phase_limits,
+    _get_venv_cache_key,
+    _has_local_requirements,
+    _parse_phase_limits,
+    _prepare_test,
+    _run_limited,
+    _run_pipeline,
+    _run_test_with_pytest,
+    _setup_venv,
+    _test_charm,
+    _test_charm_specs,
+    _test_charms,
+    write_json_report,
+    write_junit_report,
+)
+
+
+@pytest.mark.parametrize(
+    "requirements, local",
+    (
+        ("ops==2.0\npydantic>=2  # comment\n", False),
+        ("# -e .\nops\n", False),
+        ("-e .\n", True),
+        ("--editable=./lib/foo\n", True),
+        ("./lib/foo\n", True),
+        ("-r requirements-base.txt\nops\n", True),
+        ("foo @ file:///tmp/foo\n", True),
+    ),
+)
+def test_has_local_requirements(tmp_path, requirements, local):
+    requirements_path = tmp_path / "requirements.txt"
+    requirements_path.write_text(requirements)
+    assert _has_local_requirements(requirements_path) is local
+
+
+def test_build_venv_installs_from_charm_dir(tmp_path):
+    requirements_path = tmp_path / "charm" / "requirements.txt"
+    requirements_path.parent.mkdir()
+    requirements_path.write_text("-e .\n")
+    venv_path = tmp_path / "venv"
+    with patch("run_matrix._run_limited") as run_limited:
+        # pretend the venv got created
+        run_limited.side_effect = lambda *_, **__: venv_path.mkdir(exist_ok=True)
+        _build_venv(venv_path, requirements_path)
+
+    install_requirements = run_limited.call_args_list[-1]
+    assert install_requirements.args[0].endswith("-r requirements.txt")
+    assert install_requirements.kwargs["cwd"] == requirements_path.parent
+
+
+def _setup_venv_for(charm_path: Path, requirements: str, venv_cache: Path):
+    charm_path.mkdir()
+    (charm_path / "requirements.txt").write_text(requirements)
+    with patch("run_matrix._build_venv") as build_venv, patch.object(
+        run_matrix, "VENV_CACHE_PATH", venv_cache
+    ), patch("run_matrix._get_venv_tool_versions", return_value="Python 3; pip 24"):
+        # pretend the venv got built
+        build_venv.side_effect = lambda venv_path, *_: venv_path.mkdir(parents=True)
+        _setup_venv(charm_path)
+    return build_venv
+
+
+def test_setup_venv_shares_cached_venv(tmp_path):
+    build_venv = _setup_venv_for(tmp_path / "charm", "ops\n", tmp_path / "venvs")
+    venv_path = build_venv.call_args.args[0]
+    assert venv_path.parent == tmp_path / "venvs"
+    assert (tmp_path / "charm" / ".interface-venv").resolve() == venv_path
+
+
+def test_setup_venv_local_requirements_not_cached(tmp_path):
+    build_venv = _setup_venv_for(tmp_path / "charm", "-e .\n", tmp_path / "venvs")
+    venv_path = build_venv.call_args.args[0]
+    assert venv_path == tmp_path / "charm" / ".interface-venv"
+    assert not venv_path.is_symlink()
+    assert not (tmp_path / "venvs").exists()
+
+
+def test_clean_removes_venv_cache(tmp_path):
+    venv_cache = tmp_path / "venvs"
+    (venv_cache / "0123").mkdir(parents=True)
+    (tmp_path / "tests" / "charm").mkdir(parents=True)
+    with patch.object(run_matrix, "VENV_CACHE_PATH", venv_cache):
+        _clean(tmp_path / "tests")
+    assert not venv_cache.exists()
+    assert not (tmp_path / "tests").exists()
+
+
+def test_venv_cache_key_changes_with_tool_versions(tmp_path):
+    requirements_path = tmp_path / "requirements.txt"
+    requirements_path.write_text("ops\n")
+    keys = set()
+    for versions in ("Python 3.8; pip 23", "Python 3.8; pip 24", "Python 3.10; pip 24"):
+        with patch("run_matrix._get_venv_tool_versions", return_value=versions):
+            keys.add(_get_venv_cache_key(requirements_path))
+    assert len(keys) == 3
+
+
+def _spec(
+    name="charm",
+    interface="ingress",
+    version="v1",
+    role="provider",
+    url="url",
+    **config,
+):
+    charm_config = _CharmTestConfig(name=name, url=url, **config)
+    return CharmTestSpec(interface, version, role, charm_config)
+
+
+@pytest.fixture
+def interfaces_root(tmp_path):
+    root = tmp_path / "interfaces"
+    (root / "ingress" / "v1").mkdir(parents=True)
+    (root / "ingress" / "v1" / "schema.py").write_text("# schema")
+    return root
+
+
+def _result_store(tmp_path, interfaces_root, tests_commit="abc"):
+    with patch("run_matrix._ls_remote", return_value=tests_commit):
+        return ResultStore(tmp_path / "results.json", interfaces_root, "repo", "main")
+
+
+def test_result_store_roundtrip(tmp_path, interfaces_root):
+    store = _result_store(tmp_path, interfaces_root)
+    key = store.get_key(_spec(), "charm-commit")
+    store.put(key, PASSED)
+    store.save()
+
+    store = _result_store(tmp_path, interfaces_root)
+    assert store.get(store.get_key(_spec(), "charm-commit")) == PASSED
+    assert store.get(store.get_key(_spec(), "other-commit")) is None
+
+
+def test_result_store_key_changes_with_interface(tmp_path, interfaces_root):
+    store = _result_store(tmp_path, interfaces_root)
+    key = store.get_key(_spec(), "charm-commit")
+    (interfaces_root / "ingress" / "v1" / "schema.py").write_text("# changed")
+    assert (
+        _result_store(tmp_path, interfaces_root).get_key(_spec(), "charm-commit") != key
+    )
+
+
+def test_result_store_key_changes_with_tests_commit(tmp_path, interfaces_root):
+    key = _result_store(tmp_path, interfaces_root, "abc").get_key(_spec(), "c")
+    other_key = _result_store(tmp_path, interfaces_root, "def").get_key(_spec(), "c")
+    assert key != other_key
+
+
+def test_result_store_no_key_if_tests_commit_unknown(tmp_path, interfaces_root):
+    store = _result_store(tmp_path, interfaces_root, None)
+    assert store.get_key(_spec(), "charm-commit") is None
+
+
+def test_charm_paths_differ_per_repo_and_branch(tmp_path):
+    configs = [
+        _CharmTestConfig(name="tempo", url="repoA"),
+        _CharmTestConfig(name="tempo", url="repoB"),
+        _CharmTestConfig(name="tempo", url="repoA", branch="feat"),
+        _CharmTestConfig(name="tempo", url="repoA", test_setup={"charm_root": "sub"}),
+    ]
+    repo_root_paths = [_get_charm_paths(config, tmp_path)[0] for config in configs]
+    assert len(set(repo_root_paths)) == len(configs)
+    assert _get_charm_paths(configs[3], tmp_path)[1] == repo_root_paths[3] / "sub"
+
+
+def test_test_charms_groups_by_charm_setup():
+    specs = [
+        _spec(interface="foo", url="repoA"),
+        _spec(interface="bar", url="repoA"),
+        _spec(interface="foo", url="repoB"),
+    ]
+    run_pipeline = MagicMock()
+    with patch("run_matrix._run_pipeline", new=run_pipeline), patch("asyncio.run"):
+        _test_charms(specs, "repo", "main")
+    run_pipeline.assert_called_once()
+    specs_per_charm = run_pipeline.call_args.args[0]
+    assert list(specs_per_charm.values()) == [[specs[0], specs[1]], [specs[2]]]
+
+
+@pytest.mark.parametrize(
+    "test_setup, fixture_id",
+    (
+        (None, "interface_tester"),
+        (
+            {"location": "tests/alpha/conftest.py", "identifier": "alpha_tester"},
+            "alpha_tester",
+        ),
+    ),
+)
+def test_prepare_test_uses_charm_fixture(tmp_path, test_setup, fixture_id):
+    charm_config = _CharmTestConfig(name="charm", url="url", test_setup=test_setup)
+    location = (test_setup or {}).get("location", "tests/interface/conftest.py")
+    (tmp_path / location).parent.mkdir(parents=True)
+    (tmp_path / location).touch()
+
+    test_path = _prepare_test(
+        charm_config, tmp_path, [("ifb", 0), ("ifc", 1)], "repo", "main"
+    )
+    assert test_path.parent == (tmp_path / location).parent
+    content = test_path.read_text()
+    assert f"def test_ifb_v0_interface({fixture_id}: InterfaceTester):" in content
+    assert f"def test_ifc_v1_interface({fixture_id}: InterfaceTester):" in content
+
+
+def test_test_charms_groups_by_fixture():
+    specs = [
+        _spec(interface="cluster", test_setup={"identifier": "cluster_tester"}),
+        _spec(interface="tracing", test_setup={"identifier": "tracing_tester"}),
+    ]
+    run_pipeline = MagicMock()
+    with patch("run_matrix._run_pipeline", new=run_pipeline), patch("asyncio.run"):
+        _test_charms(specs, "repo", "main")
+    specs_per_charm = run_pipeline.call_args.args[0]
+    assert list(specs_per_charm.values()) == [[specs[0]], [specs[1]]]
+
+
+def test_get_phase_limits_overrides_defaults():
+    charm_config = _CharmTestConfig(
+        name="charm",
+        url="url",
+        test_setup={"limits": {"pytest": {"timeout": 10}, "venv": None}},
+    )
+    defaults = {"pytest": PhaseLimits(memory=100), "pre_run": PhaseLimits(timeout=60)}
+    limits = _get_phase_limits(charm_config, defaults)
+    assert limits["pytest"] == PhaseLimits(timeout=10, memory=100)
+    assert limits["pre_run"] == PhaseLimits(timeout=60)
+    assert limits["venv"] == limits["clone"] == PhaseLimits()
+
+
+def test_get_phase_limits_converts_values():
+    charm_config = _CharmTestConfig(
+        name="charm",
+        url="url",
+        test_setup={"limits": {"pytest": {"timeout": "1e3", "memory": "512"}}},
+    )
+    limits = _get_phase_limits(charm_config, DEFAULT_PHASE_LIMITS)
+    assert limits["pytest"] == PhaseLimits(timeout=1000.0, memory=512)
+    assert isinstance(limits["pytest"].timeout, float)
+
+
+@pytest.mark.parametrize(
+    "limits",
+    (
+        {"pytest": {"cpu": 1}},
+        {"pytest": 10},
+        ["pytest"],
+        {"pytest": {"timeout": "ten"}},
+        {"pytest": {"timeout": 0}},
+        {"venv": {"memory": -512}},
+        {"venv": {"memory": "1.5"}},
+    ),
+)
+def test_get_phase_limits_invalid(limits):
+    charm_config = _CharmTestConfig(
+        name="charm", url="url", test_setup={"limits": limits}
+    )
+    with pytest.raises(SetupError):
+        _get_phase_limits(charm_config, DEFAULT_PHASE_LIMITS)
+
+
+def test_test_charm_invalid_limits_fails_setup():
+    spec = _spec(test_setup={"limits": {"pytest": {"cpu": 1}}})
+    report = CharmReport("charm")
+    results = asyncio.run(
+        _test_charm(spec.charm_config, [spec], "repo", "main", report, {})
+    )
+    assert results[spec].status == SETUP_FAILED
+    assert "invalid limits" in report.setup_error
+
+
+def _report(name="charm", durations=None, **statuses):
+    report = CharmReport(name, durations=durations or {})
+    report.results = {
+        _spec(name, interface=interface): CharmTestResult(status)
+        for interface, status in statuses.items()
+    }
+    return report
+
+
+def test_run_history_roundtrip(tmp_path):
+    history = RunHistory(tmp_path / "history.json")
+    history.record(
+        _report("slow", {"clone": 10, "pytest": 30}, ingress=PASSED, tracing=FAILED)
+    )
+    history.save()
+
+    history = RunHistory(tmp_path / "history.json")
+    assert history.has_failed(_spec("slow", interface="tracing"))
+    assert not history.has_failed(_spec("slow", interface="ingress"))
+    assert history.get_priority([_spec("slow")]) == (True, -40)
+    assert history.get_priority([_spec("slow", interface="tracing")]) == (False, -40)
+
+
+def test_run_history_duration_moving_average(tmp_path):
+    history = RunHistory(tmp_path / "history.json")
+    history.record(_report(durations={"pytest": 10}, ingress=PASSED))
+    history.record(_report(durations={"pytest": 20}, ingress=PASSED))
+    assert history.get_priority([_spec()]) == (True, -15)
+
+    # all results came from the result store: no work was done this time
+    history.record(_report(ingress=FAILED))
+    assert history.get_priority([_spec()]) == (False, -15)
+
+
+def test_run_history_ignores_corrupt_file(tmp_path):
+    (tmp_path / "history.json").write_text("{")
+    history = RunHistory(tmp_path / "history.json")
+    assert history.get_priority([_spec()]) == (True, -float("inf"))
+
+
+def test_test_charms_scheduled_by_history(tmp_path):
+    history = RunHistory(tmp_path / "history.json")
+    history.record(_report("fast", {"pytest": 1}, ingress=PASSED))
+    history.record(_report("slow", {"pytest": 100}, ingress=PASSED))
+    history.record(_report("failing", {"pytest": 1}, ingress=PASSED, tracing=FAILED))
+    specs = [
+        _spec("fast"),
+        _spec("failing", interface="ingress"),
+        _spec("failing", interface="tracing"),
+        _spec("slow"),
+        _spec("new"),
+    ]
+
+    run_pipeline = MagicMock()
+    with patch("run_matrix._run_pipeline", new=run_pipeline), patch("asyncio.run"):
+        _test_charms(specs, "repo", "main", history=history)
+    specs_per_charm = run_pipeline.call_args.args[0]
+    assert [
+        charm_specs[0].charm_config.name for charm_specs in specs_per_charm.values()
+    ] == [
+        "failing",
+        "new",
+        "slow",
+        "fast",
+    ]
+    assert specs_per_charm[_get_charm_id(specs[1].charm_config)] == [specs[2], specs[1]]
+
+
+_PYTEST_JUNIT = """<?xml version="1.0" encoding="utf-8"?>
+<testsuites><testsuite name="pytest">
+<testcase classname="t" name="test_ingress_v1_interface" time="1.5" />
+<testcase classname="t" name="test_tracing_v2_interface" time="2.0">
+<failure message="assert False" />
+</testcase>
+<testcase classname="t" name="test_cluster_v0_interface" time="1.0" />
+<testcase classname="t" name="test_cluster_v0_interface" time="0.5">
+<error message="error in teardown" />
+</testcase>
+</testsuite></testsuites>
+"""
+
+
+def test_run_test_with_pytest_splits_results(tmp_path):
+    test_path = tmp_path / "interface_test_matrix.py"
+    report = CharmReport("charm")
+
+    def run_limited(*_, **__):
+        test_path.with_suffix(".xml").write_text(_PYTEST_JUNIT)
+        return subprocess.CompletedProcess("pytest", 1, "1 failed, 1 error", None)
+
+    with patch("run_matrix._run_limited", side_effect=run_limited):
+        results = _run_test_with_pytest(tmp_path, test_path, report)
+
+    assert report.exit_code == 1
+    assert "pytest" in report.durations
+    assert results == {
+        "test_ingress_v1_interface": CharmTestResult(PASSED, duration=1.5),
+        "test_tracing_v2_interface": CharmTestResult(
+            FAILED, "assert False", duration=2.0
+        ),
+        "test_cluster_v0_interface": CharmTestResult(
+            FAILED, "error in teardown", duration=1.5
+        ),
+    }
+
+
+def test_run_test_with_pytest_no_report(tmp_path):
+    test_path = tmp_path / "interface_test_matrix.py"
+    # a report of a previous session must not be picked up
+    test_path.with_suffix(".xml").write_text(_PYTEST_JUNIT)
+    proc = subprocess.CompletedProcess("pytest", 4, "usage error", None)
+    with patch("run_matrix._run_limited", return_value=proc), pytest.raises(
+        InterfaceTestError
+    ):
+        _run_test_with_pytest(tmp_path, test_path)
+
+
+def _reports():
+    report = CharmReport("charm", durations={"clone": 1.0, "pytest": 2.5}, exit_code=1)
+    report.results = {
+        _spec(interface="ingress"): CharmTestResult(PASSED, duration=1.0),
+        _spec(interface="tracing"): CharmTestResult(FAILED, "assert False"),
+        _spec(interface="cluster"): CharmTestResult(KILLED, "timed out after 10s"),
+    }
+    broken = CharmReport("broken", setup_error="clone failed")
+    broken.results = {
+        _spec("broken"): CharmTestResult(SETUP_FAILED, "clone failed"),
+    }
+    return [report, broken]
+
+
+def test_write_json_report(tmp_path):
+    write_json_report(_reports(), tmp_path / "report.json")
+    charms = json.loads((tmp_path / "report.json").read_text())["charms"]
+
+    assert [charm["name"] for charm in charms] == ["charm", "broken"]
+    assert charms[0]["durations"] == {"clone": 1.0, "pytest": 2.5}
+    assert charms[0]["exit_code"] == 1
+    assert charms[0]["results"][1] == {
+        "interface": "tracing",
+        "version": "v1",
+        "role": "provider",
+        "status": FAILED,
+        "reason": "assert False",
+        "duration": None,
+        "cached": False,
+    }
+    assert charms[1]["setup_error"] == "clone failed"
+
+
+def test_write_junit_report(tmp_path):
+    write_junit_report(_reports(), tmp_path / "report.xml")
+    testsuites = ET.parse(tmp_path / "report.xml").getroot()
+
+    testsuite = testsuites.find("testsuite[@name='charm']")
+    assert testsuite.get("tests") == "3"
+    assert testsuite.get("time") == "3.500"
+    assert (
+        testsuite.find("properties/property[@name='duration.pytest']").get("value")
+        == "2.500"
+    )
+    testcases = {
+        testcase.get("classname"): testcase for testcase in testsuite.iter("testcase")
+    }
+    assert not list(testcases["ingress.v1.provider"])
+    failure = testcases["tracing.v1.provider"].find("failure")
+    assert failure.get("message") == "assert False"
+    assert testcases["cluster.v1.provider"].find("error").get("type") == KILLED
+    broken = testsuites.find("testsuite[@name='broken']/testcase/error")
+    assert (broken.get("type"), broken.get("message")) == (SETUP_FAILED, "clone failed")
+
+
+def test_gather_results():
+    collected = {"ingress": {"v1": {}, "v2": {}}, "tracing": {"v1": {}}}
+    specs = [
+        _spec("a"),
+        _spec("b", role="requirer"),
+        _spec("a", interface="tracing"),
+    ]
+    reports = [_report("a", ingress=PASSED, tracing=FAILED), _report("b")]
+    reports[1].results = {specs[1]: CharmTestResult(SETUP_FAILED)}
+
+    assert _gather_results(collected, specs, reports) == {
+        "ingress": {
+            "v1": {"provider": {"a": True}, "requirer": {"b": False}},
+            "v2": {"provider": {}, "requirer": {}},
+        },
+        "tracing": {"v1": {"provider": {"a": False}, "requirer": {}}},
+    }
+
+
+def _test_charm_specs_with(
+    result_store, specs, results, remote_commit="charm-commit", tested_commit=None
+):
+    async def run_tests(charm_config, specs, repo, branch, report, *_, **__):
+        report.commit = tested_commit or remote_commit
+        return results
+
+    async def run_specs():
+        # before python 3.10, asyncio primitives bind to the loop they are created in
+        semaphores = {"network": asyncio.Semaphore()}
+        report = CharmReport("charm")
+        return await _test_charm_specs(
+            specs, "repo", "main", report, semaphores, result_store
+        )
+
+    test_charm = AsyncMock(side_effect=run_tests)
+    with patch("run_matrix._get_charm_commit", return_value=remote_commit), patch(
+        "run_matrix._test_charm", new=test_charm
+    ):
+        report = asyncio.run(run_specs())
+    return report, test_charm
+
+
+def test_test_charm_specs_reuses_cached_results(tmp_path, interfaces_root):
+    store = _result_store(tmp_path, interfaces_root)
+    specs = [_spec(role="provider"), _spec(role="requirer"), _spec(version="v2")]
+    report, _ = _test_charm_specs_with(
+        store,
+        specs,
+        {
+            specs[0]: CharmTestResult(PASSED),
+            specs[1]: CharmTestResult(FAILED),
+            specs[2]: CharmTestResult(KILLED),
+        },
+    )
+    assert [result.cached for result in report.results.values()] == [False] * 3
+
+    report, test_charm = _test_charm_specs_with(
+        store, specs, {specs[2]: CharmTestResult(PASSED)}
+    )
+    # killed jobs may well be transient: they run again
+    assert test_charm.call_args.args[1] == [specs[2]]
+    assert report.results == {
+        specs[0]: CharmTestResult(PASSED, cached=True),
+        specs[1]: CharmTestResult(FAILED, cached=True),
+        specs[2]: CharmTestResult(PASSED),
+    }
+
+
+def test_test_charm_specs_runs_all_if_tests_commit_unknown(tmp_path, interfaces_root):
+    store = _result_store(tmp_path, interfaces_root, None)
+    specs = [_spec()]
+    _test_charm_specs_with(store, specs, {specs[0]: CharmTestResult(PASSED)})
+    _, test_charm = _test_charm_specs_with(
+        store, specs, {specs[0]: CharmTestResult(PASSED)}
+    )
+    assert test_charm.call_args.args[1] == specs
+
+
+def test_run_limited_returns_output():
+    proc = _run_limited("echo hello", PhaseLimits(timeout=10), stdout=subprocess.PIPE)
+    assert (proc.returncode, proc.stdout) == (0, b"hello\n")
+
+
+def test_run_limited_check():
+    with pytest.raises(subprocess.CalledProcessError):
+        _run_limited("exit 3", PhaseLimits(), check=True)
+
+
+def test_run_limited_timeout():
+    start = time.monotonic()
+    with pytest.raises(ResourceLimitError, match="timed out after 0.2s"):
+        # the children are killed along with the shell
+        _run_limited("sleep 10 & sleep 10", PhaseLimits(timeout=0.2))
+    assert time.monotonic() - start < 5
+
+
+def test_run_limited_memory():
+    with pytest.raises(ResourceLimitError, match="exceeded the memory limit of 50MiB"):
+        _run_limited(
+            f"{sys.executable} -c 'import time; x = bytearray(200 * 2**20); time.sleep(10)'",
+            PhaseLimits(timeout=10, memory=50),
+        )
+
+
+def test_parse_phase_limits():
+    limits = _parse_phase_limits(
+        ["pytest=60", "pytest=120"], ["pytest=512", "venv=1024"]
+    )
+    assert limits == {
+        "pytest": PhaseLimits(timeout=120, memory=512),
+        "venv": PhaseLimits(memory=1024),
+    }
+
+
+def test_parse_phase_limits_over_defaults():
+    limits = _parse_phase_limits([], ["pre_run=256"])
+    assert limits["pre_run"] == PhaseLimits(
+        timeout=DEFAULT_PHASE_LIMITS["pre_run"].timeout, memory=256
+    )
+
+
+@pytest.mark.parametrize(
+    "timeouts, memory_limits",
+    ((["pytest"], []), (["unknown=10"], []), (["pytest=-1"], []), ([], ["venv=1.5"])),
+)
+def test_parse_phase_limits_invalid(timeouts, memory_limits):
+    with pytest.raises(ValueError, match="invalid limit"):
+        _parse_phase_limits(timeouts, memory_limits)
+
+
+def _run_pipeline_with(tmp_path, specs, limits):
+    """Run the pipeline with all blocking phases stubbed, tracking the pytest sessions."""
+    sessions = {"running": 0, "max": 0}
+    lock = threading.Lock()
+
+    def run_test_with_pytest(charm_root_path, *_):
+        with lock:
+            sessions["running"] += 1
+            sessions["max"] = max(sessions["max"], sessions["running"])
+        time.sleep(0.1)
+        with lock:
+            sessions["running"] -= 1
+        return {"test_ingress_v1_interface": CharmTestResult(PASSED)}
+
+    def get_charm_paths(charm_config):
+        return [tmp_path / _get_charm_id(charm_config)] * 2
+
+    specs_per_charm = {}
+    for spec in specs:
+        specs_per_charm.setdefault(_get_charm_id(spec.charm_config), []).append(spec)
+    with contextlib.ExitStack() as stack:
+        for phase in (
+            "_checkout_charm_repo",
+            "_pre_run",
+            "_setup_venv",
+            "_prepare_test",
+        ):
+            stack.enter_context(patch(f"run_matrix.{phase}"))
+        stack.enter_context(
+            patch("run_matrix._get_charm_paths", side_effect=get_charm_paths)
+        )
+        stack.enter_context(
+            patch("run_matrix._run_test_with_pytest", side_effect=run_test_with_pytest)
+        )
+        reports = asyncio.run(_run_pipeline(specs_per_charm, "repo", "main", limits))
+    return reports, sessions["max"]
+
+
+@pytest.mark.parametrize("pytest_jobs", (1, 3))
+def test_run_pipeline_within_concurrency_limits(tmp_path, pytest_jobs):
+    specs = [_spec(name) for name in ("a", "b", "c")]
+    reports, max_sessions = _run_pipeline_with(
+        tmp_path, specs, ConcurrencyLimits(pytest=pytest_jobs)
+    )
+    assert max_sessions == pytest_jobs
+    assert [report.name for report in reports] == ["a", "b", "c"]
+    assert all(
+        report.results[spec].status == PASSED for report, spec in zip(reports, specs)
+    )
+
+
+def test_run_pipeline_reports_uncollected_tests(tmp_path):
+    specs = [_spec(), _spec(interface="tracing")]
+    [report], _ = _run_pipeline_with(tmp_path, specs, ConcurrencyLimits())
+    assert report.results[specs[0]].status == PASSED
+    assert report.results[specs[1]] == CharmTestResult(
+        FAILED, "test_tracing_v1_interface was not collected"
+    )
+
+
+def test_test_charm_specs_stores_verdict_of_tested_commit(tmp_path, interfaces_root):
+    store = _result_store(tmp_path, interfaces_root)
+    specs = [_spec()]
+    _, test_charm = _test_charm_specs_with(
+        store,
+        specs,
+        {specs[0]: CharmTestResult(PASSED)},
+        remote_commit="new",
+        tested_commit="old",
+    )
+    assert test_charm.call_args.kwargs["fetch"]
+    assert store.get(store.get_key(specs[0], "old")) == PASSED
+    assert store.get(store.get_key(specs[0], "new")) is None
+
+
+def _git(*args, cwd):
+    return subprocess.check_output(["git", *args], cwd=cwd, text=True).strip()
+
+
+def _commit(origin, message):
+    (origin / "charm.py").write_text(message)
+    _git("add", ".", cwd=origin)
+    _git(
+        "-c",
+        "user.name=test",
+        "-c",
+        "user.email=test@example.com",
+        "commit",
+        "--quiet",
+        "-m",
+        message,
+        cwd=origin,
+    )
+    return _git("rev-parse", "HEAD", cwd=origin)
+
+
+@pytest.mark.parametrize("fetch", (False, True))
+def test_checkout_charm_repo_fetches_kept_clone(tmp_path, fetch):
+    origin = tmp_path / "origin"
+    origin.mkdir()
+    _git("init", "--quiet", cwd=origin)
+    first = _commit(origin, "first")
+    charm_config = _CharmTestConfig(name="charm", url=f"file://{origin}")
+    root = tmp_path / "tests"
+
+    with patch.object(run_matrix, "_fresh_clones", set()):
+        _checkout_charm_repo(charm_config, root / "first", root)
+    assert _get_checkout_commit(root / "first") == first
+
+    # the next run, with the clone kept
+    second = _commit(origin, "second")
+    with patch.object(run_matrix, "_fresh_clones", set()):
+        _checkout_charm_repo(charm_config, root / "second", root, fetch=fetch)
+        _checkout_charm_repo(charm_config, root / "third", root, fetch=fetch)
+    expected = second if fetch else first
+    assert _get_checkout_commit(root / "second") == expected
+    assert _get_checkout_commit(root / "third") == expected
+
+
+def _requirements(tmp_path, charm, requirements="ops\n"):
+    requirements_path = tmp_path / charm / "requirements.txt"
+    requirements_path.parent.mkdir()
+    requirements_path.write_text(requirements)
+    return requirements_path
+
+
+def test_wheelhouse_built_once_all_charms_arrived(tmp_path):
+    paths = [_requirements(tmp_path, charm) for charm in "abc"]
+    paths[2].write_text("pydantic\n")
+
+    async def run():
+        wheelhouse = Wheelhouse(tmp_path / "wheels", False, ["a", "b", "c"])
+        populate = asyncio.ensure_future(wheelhouse.populate(asyncio.Semaphore()))
+        for charm, path in zip("abc", paths):
+            await asyncio.sleep(0)
+            assert not check_call.called
+            wheelhouse.arrive(charm, path)
+            # arriving again, e.g. when giving up on a charm, changes nothing
+            wheelhouse.arrive(charm)
+        await wheelhouse.wait_ready()
+        await populate
+        return wheelhouse
+
+    with patch("subprocess.check_call") as check_call:
+        wheelhouse = asyncio.run(run())
+
+    # the base packages, then each distinct requirements file from its directory
+    commands = [call.args[0] for call in check_call.call_args_list]
+    assert len(commands) == 3
+    assert all(" -m pip wheel --quiet --wheel-dir " in cmd for cmd in commands)
+    assert commands[1].endswith("-r requirements.txt")
+    assert [call.kwargs["cwd"] for call in check_call.call_args_list[1:]] == [
+        paths[0].parent,
+        paths[2].parent,
+    ]
+    assert wheelhouse.get_find_links(paths[1]) == tmp_path / "wheels"
+
+
+@pytest.mark.parametrize("failing", ("base", "b"))
+def test_wheelhouse_falls_back_to_index(tmp_path, failing):
+    paths = {charm: _requirements(tmp_path, charm, f"{charm}\n") for charm in "ab"}
+
+    def check_call(cmd, cwd, **_):
+        if (cwd or tmp_path / "base") == tmp_path / failing:
+            raise subprocess.CalledProcessError(1, cmd)
+
+    async def run():
+        wheelhouse = Wheelhouse(tmp_path / "wheels", False, ["a", "b"])
+        for charm, path in paths.items():
+            wheelhouse.arrive(charm, path)
+        await wheelhouse.populate(asyncio.Semaphore())
+        return wheelhouse
+
+    with patch("subprocess.check_call", side_effect=check_call):
+        wheelhouse = asyncio.run(run())
+    assert wheelhouse.get_find_links(paths["b"]) is None
+    expected = None if failing == "base" else tmp_path / "wheels"
+    assert wheelhouse.get_find_links(paths["a"]) == expected
+
+
+def test_wheelhouse_ready_even_if_build_crashes(tmp_path):
+    async def run():
+        wheelhouse = Wheelhouse(tmp_path / "wheels", False, [])
+        with pytest.raises(RuntimeError):
+            await wheelhouse.populate(asyncio.Semaphore())
+        await asyncio.wait_for(wheelhouse.wait_ready(), 1)
+
+    with patch.object(Wheelhouse, "_build", side_effect=RuntimeError):
+        asyncio.run(run())
+
+
+def test_wheelhouse_offline(tmp_path):
+    path = _requirements(tmp_path, "a")
+
+    async def run():
+        wheelhouse = Wheelhouse(tmp_path / "wheels", True, ["a"])
+        await wheelhouse.populate(asyncio.Semaphore())
+        await asyncio.wait_for(wheelhouse.wait_ready(), 1)
+        return wheelhouse
+
+    with patch("subprocess.check_call") as check_call:
+        wheelhouse = asyncio.run(run())
+    check_call.assert_not_called()
+    assert wheelhouse.get_find_links(path) == tmp_path / "wheels"
@@ -0,0 +1,68 @@
+import os
+from textwrap import dedent
+from unittest.mock import patch
+
+from interface_tester import collector
+
+from utils.schema_registry import SchemaRegistry, installed
+
+SCHEMA = dedent(
+    """import pydantic
+class RequirerSchema(pydantic.BaseModel):
+    foo: int = 1"""
+)
+
+
+def _write_schema(root, source=SCHEMA):
+    schema_path = root / "foo" / "v42" / "schema.py"
+    schema_path.parent.mkdir(exist_ok=True, parents=True)
+    schema_path.write_text(source)
+    return schema_path
+
+
+def test_get(tmp_path):
+    _write_schema(tmp_path)
+    registry = SchemaRegistry(tmp_path)
+
+    assert registry.get("foo", 42, "requirer").__name__ == "RequirerSchema"
+    assert registry.get("foo", 42, "provider") is None
+    assert registry.get("bar", 1, "requirer") is None
+
+
+def test_load_once(tmp_path):
+    schema_path = _write_schema(tmp_path)
+    registry = SchemaRegistry(tmp_path)
+
+    schemas = registry.load(schema_path)
+    with patch("utils.schema_registry._get_schemas") as get_schemas:
+        assert registry.get("foo", 42, "requirer") is schemas["requirer"]
+    get_schemas.assert_not_called()
+
+
+def test_reload_on_change(tmp_path):
+    schema_path = _write_schema(tmp_path)
+    registry = SchemaRegistry(tmp_path)
+    before = registry.get("foo", 42, "requirer")
+
+    _write_schema(tmp_path, SCHEMA.replace("= 1", "= 2"))
+    stat = schema_path.stat()
+    os.utime(schema_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+
+    after = registry.get("foo", 42, "requirer")
+    assert after is not before
+    assert after.model_fields["foo"].default == 2
+
+
+def test_installed_restores_collector(tmp_path):
+    original = collector.get_schemas
+    registry = SchemaRegistry(tmp_path)
+    with installed(registry):
+        assert collector.get_schemas == registry.load
+    assert collector.get_schemas is original
+
+
+def test_installed_leaves_unexpected_collector_alone(tmp_path):
+    original = collector.get_schemas
+    with patch("utils.schema_registry._collector_uses_get_schemas", return_value=False):
+        with installed(SchemaRegistry(tmp_path)):
+            assert collector.get_schemas is original
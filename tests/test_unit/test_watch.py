@@ -0,0 +1,132 @@
+import importlib
+import json
+import logging
+import os
+import sys
+from pathlib import Path
+from textwrap import dedent
+
+import pytest
+
+# the utils scripts import their siblings as top-level modules
+sys.path.insert(0, str(Path(__file__).parents[2] / "utils"))
+watch = importlib.import_module("watch")
+interface_yaml = importlib.import_module("interface_yaml")
+
+SCHEMA = dedent(
+    """\
+    from interface_tester.schema_base import DataBagSchema
+    from pydantic import BaseModel
+
+
+    class ProviderAppData(BaseModel):
+        foo: int = 1
+
+
+    class ProviderSchema(DataBagSchema):
+        app: ProviderAppData
+    """
+)
+INTERFACE_YAML = """name: foo
+version: 0
+status: draft
+providers: []
+requirers: []
+maintainer: bar
+"""
+
+
+def _touch(path: Path):
+    # so that the change is seen even within the resolution of the mtime
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+
+
+@pytest.fixture
+def watcher(tmp_path, monkeypatch):
+    interface_root = tmp_path / "interfaces" / "foo" / "v0"
+    interface_root.mkdir(parents=True)
+    (interface_root / "schema.py").write_text(SCHEMA)
+    (interface_root / "interface.yaml").write_text(INTERFACE_YAML)
+    (tmp_path / "docs" / "json_schemas").mkdir(parents=True)
+    monkeypatch.setattr(watch, "reader", interface_yaml.InterfaceYamlReader(None))
+    return watch.Watcher(tmp_path / "interfaces", tmp_path)
+
+
+def _provider_schema(watcher):
+    path = watcher.schemas_root / "foo" / "v0" / "provider.json"
+    return json.loads(path.read_text())
+
+
+def _catalogue(watcher):
+    return json.loads((watcher.output_root / "catalogue.json").read_text())
+
+
+def test_poll_builds_everything_first(watcher):
+    schema_path = watcher.root / "foo" / "v0" / "schema.py"
+    yaml_path = watcher.root / "foo" / "v0" / "interface.yaml"
+    assert sorted(watcher.poll()) == [yaml_path, schema_path]
+
+    assert "app" in _provider_schema(watcher)["properties"]
+    assert (
+        "foo/v0/provider"
+        in json.loads((watcher.schemas_root / "bundle.json").read_text())["schemas"]
+    )
+    assert _catalogue(watcher)["interfaces"]["foo/v0"]["maintainer"] == "bar"
+    assert watcher.poll() == []
+
+
+def test_poll_detects_changes(watcher):
+    yaml_path = watcher.root / "foo" / "v0" / "interface.yaml"
+    watcher.poll()
+
+    yaml_path.write_text(INTERFACE_YAML.replace("bar", "baz"))
+    _touch(yaml_path)
+    assert watcher.poll() == [yaml_path]
+    assert _catalogue(watcher)["interfaces"]["foo/v0"]["maintainer"] == "baz"
+
+    yaml_path.unlink()
+    assert watcher.poll() == [yaml_path]
+    assert "foo/v0" not in _catalogue(watcher)["interfaces"]
+
+
+def test_poll_survives_invalid_schema(watcher, caplog):
+    schema_path = watcher.root / "foo" / "v0" / "schema.py"
+    watcher.poll()
+
+    # a field that has no json schema
+    schema_path.write_text(
+        SCHEMA.replace(
+            "from pydantic", "from typing import Callable\nfrom pydantic"
+        ).replace("foo: int = 1", "foo: Callable")
+    )
+    _touch(schema_path)
+    with caplog.at_level(logging.ERROR):
+        assert watcher.poll() == [schema_path]
+    assert str(schema_path) in caplog.text
+
+    # the last good build is kept until the schema is fixed
+    assert "app" in _provider_schema(watcher)["properties"]
+    schema_path.write_text(SCHEMA.replace("foo: int = 1", "foo: str = 'a'"))
+    _touch(schema_path)
+    assert watcher.poll() == [schema_path]
+    app_data = _provider_schema(watcher)["$defs"]["ProviderAppData"]
+    assert app_data["properties"]["foo"]["type"] == "string"
+
+
+@pytest.mark.parametrize("contents", ("", "name: [foo", "- foo"))
+def test_poll_survives_invalid_interface_yaml(watcher, caplog, contents):
+    yaml_path = watcher.root / "foo" / "v0" / "interface.yaml"
+    watcher.poll()
+
+    yaml_path.write_text(contents)
+    _touch(yaml_path)
+    with caplog.at_level(logging.ERROR):
+        assert watcher.poll() == [yaml_path]
+    assert str(yaml_path) in caplog.text
+    assert "foo/v0" not in _catalogue(watcher)["interfaces"]
+
+    yaml_path.write_text(INTERFACE_YAML)
+    _touch(yaml_path)
+    assert watcher.poll() == [yaml_path]
+    assert _catalogue(watcher)["interfaces"]["foo/v0"]["maintainer"] == "bar"
@@ -1,10 +1,14 @@
+import hashlib
 import os
-import yaml
 import json
 
+from interface_yaml import reader
 
-def get_interfaces(base_dir="interfaces"):
-    interfaces = []
+ROLES = ("provider", "requirer")
+
+
+def _load_interfaces(base_dir="interfaces"):
+    """Yield the interface and version directory names, and the parsed interface.yaml."""
     for interface in sorted(os.listdir(base_dir)):
         if interface.startswith("__"):
             continue
@@ -17,22 +21,94 @@ def get_interfaces(base_dir="interfaces"):
                 continue
             interface_yaml_path = os.path.join(version_path, "interface.yaml")
             if os.path.exists(interface_yaml_path):
-                with open(interface_yaml_path, "r") as f:
-                    interface_yaml = yaml.safe_load(f)
-                interface_details = {
-                    "name": interface_yaml.get("name", interface),
-                    "version": interface_yaml.get("version", version[1:]),
-                }
-                status = interface_yaml.get("status")
-                interface_details["status"] = status
-                if interface_details.get("status") in ["published", "draft"]:
-                    interfaces.append(interface_details)
+                interface_yaml = reader.read(interface_yaml_path)
+                yield interface, version, interface_yaml
+
+
+def get_interfaces(base_dir="interfaces", loaded=None):
+    interfaces = []
+    for interface, version, interface_yaml in (
+        loaded if loaded is not None else _load_interfaces(base_dir)
+    ):
+        interface_details = {
+            "name": interface_yaml.get("name", interface),
+            "version": interface_yaml.get("version", version[1:]),
+        }
+        status = interface_yaml.get("status")
+        interface_details["status"] = status
+        if interface_details.get("status") in ["published", "draft"]:
+            interfaces.append(interface_details)
 
     interfaces.sort(key=lambda x: (x["name"], x["version"]))
     return interfaces
 
 
+def _hash_file(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def get_catalogue(
+    base_dir="interfaces", schemas_dir="docs/json_schemas", loaded=None
+):
+    """Build the catalogue of all interfaces, with reverse lookups by charm and maintainer.
+
+    Interfaces are keyed by "<interface>/v<version>". The schema hashes are those of
+    the json schemas built in schemas_dir.
+    """
+    interfaces = {}
+    by_charm = {}
+    by_maintainer = {}
+    for interface, version, interface_yaml in (
+        loaded if loaded is not None else _load_interfaces(base_dir)
+    ):
+        key = f"{interface}/{version}"
+        version_path = os.path.join(base_dir, interface, version)
+        maintainer = interface_yaml.get("maintainer")
+        details = {
+            "name": interface_yaml.get("name", interface),
+            "version": interface_yaml.get("version", version[1:]),
+            "status": interface_yaml.get("status"),
+            "maintainer": maintainer,
+            "has_schema": os.path.exists(os.path.join(version_path, "schema.py")),
+        }
+        for role in ROLES:
+            charms = interface_yaml.get(f"{role}s") or []
+            details[f"{role}s"] = [
+                {"name": charm["name"], "url": charm.get("url")} for charm in charms
+            ]
+            for charm in charms:
+                lookup = by_charm.setdefault(charm["name"], {r: [] for r in ROLES})
+                lookup[role].append(key)
+        details["has_tests"] = {
+            role: os.path.exists(
+                os.path.join(version_path, "interface_tests", f"test_{role}.py")
+            )
+            for role in ROLES
+        }
+        details["schema_sha256"] = {
+            role: _hash_file(os.path.join(schemas_dir, interface, version, f"{role}.json"))
+            for role in ROLES
+        }
+        interfaces[key] = details
+        if maintainer:
+            by_maintainer.setdefault(maintainer, []).append(key)
+
+    return {
+        "interfaces": interfaces,
+        "by_charm": dict(sorted(by_charm.items())),
+        "by_maintainer": dict(sorted(by_maintainer.items())),
+    }
+
+
 if __name__ == "__main__":
-    interfaces = get_interfaces("interfaces")
+    # parsed once, for both
+    loaded = list(_load_interfaces("interfaces"))
+    interfaces = get_interfaces("interfaces", loaded)
     with open("index.json", "w") as f:
         json.dump(interfaces, f, indent=2)
+    catalogue = get_catalogue("interfaces", "docs/json_schemas", loaded)
+    with open("catalogue.json", "w") as f:
+        json.dump(catalogue, f, indent=2)
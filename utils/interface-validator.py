@@ -2,13 +2,21 @@
 # See LICENSE file for licensing details.
 
 """Schema validator for `interface.yaml` files."""
+import argparse
+import ast
 import yaml
 import glob
-import re 
+import json
+import os
+import re
+import subprocess
 
+from concurrent.futures import ProcessPoolExecutor
 from enum import Enum
-from typing import List, Optional
-from pydantic import AnyHttpUrl, BaseModel, ValidationError, ConfigDict
+from typing import Dict, List, Optional
+from generate_index import get_interfaces
+from interface_yaml import reader
+from pydantic import AnyHttpUrl, BaseModel, ValidationError, ConfigDict, confloat, conint
 
 class text:
    BOLD = '\033[1m'
@@ -22,6 +30,21 @@ class StatusEnum(str, Enum):
     PUBLISHED = "published"
     RETIRED = "retired"
 
+class PhaseLimits(BaseModel):
+    model_config = ConfigDict(extra='forbid')
+
+    # strict: a quoted number is rejected rather than passed on as a string
+    timeout: Optional[confloat(strict=True, gt=0)] = None  # seconds
+    memory: Optional[conint(strict=True, gt=0)] = None  # MiB
+
+class TestLimits(BaseModel):
+    model_config = ConfigDict(extra='forbid')
+
+    clone: Optional[PhaseLimits] = None
+    pre_run: Optional[PhaseLimits] = None
+    venv: Optional[PhaseLimits] = None
+    pytest: Optional[PhaseLimits] = None
+
 class TestSetup(BaseModel):
     model_config = ConfigDict(extra='forbid')
 
@@ -29,6 +52,7 @@ class TestSetup(BaseModel):
     identifier: Optional[str] = None
     charm_root: Optional[str] = None
     pre_run: Optional[str] = None
+    limits: Optional[TestLimits] = None
 
 class CharmEntry(BaseModel):
     model_config = ConfigDict(extra='forbid')
@@ -53,18 +77,82 @@ class MatchError(Exception):
     """Error raised when the location of an interface.yaml spec file is inconsistent with its contents."""
 
 
+# <name>/v<version>/interface.yaml
+PATH_REGEX = re.compile(r"\/([a-zA-Z0-9-_]+)\/v(\d+)\/interface\.yaml$")
+
+
+def _validate(file: str, raw_interface: dict) -> Optional[dict]:
+    """Validate a parsed interface.yaml; return the error found, if any."""
+    try:
+        model = InterfaceModel(**raw_interface)
+        Validator._validate_against_path(file, model)
+    except MatchError as e:
+        return {"file": file, "type": "path", "message": str(e)}
+    except ValidationError as e:
+        return {
+            "file": file,
+            "type": "schema",
+            "message": str(e),
+            "details": json.loads(e.json(include_url=False)),
+        }
+    return None
+
+
+# how many files a worker process validates at once
+VALIDATION_CHUNK_SIZE = 8
+
+
+def _validate_chunk(items: List[tuple]) -> List[Optional[dict]]:
+    """Validate a chunk of (file, parsed interface.yaml) pairs in a worker process."""
+    return [_validate(file, raw_interface) for file, raw_interface in items]
+
+
+# the types of cross-reference errors that can be recorded in a baseline: gaps in the
+# tree that are known, and are being filled one by one
+BASELINE_ERROR_TYPES = ("schema.py", "tests")
+
+
+def _error_id(error: dict) -> tuple:
+    return error["file"], error["type"], error["message"]
+
+
 class Validator:
+    def __init__(self, changed_since: Optional[str] = None, jobs: int = 1, fail_fast: bool = False,
+                 cross_references: bool = False, baseline: Optional[str] = None):
+        self.changed_since = changed_since
+        self.jobs = jobs
+        self.fail_fast = fail_fast
+        self.cross_references = cross_references
+        self.baseline = baseline
+
     def _read_yaml(self, file_path: str) -> dict:
-        with open(file_path, 'r') as stream:
-            config = yaml.safe_load(stream)
-        return config
+        return reader.read(file_path)
 
 
     def _get_files(self):
-        return glob.glob('./interfaces/**/interface.yaml', recursive=True)
-    
-    def _validate_against_path(self, file, model):
-        result = re.search(r"\/([a-zA-Z0-9-_]+)\/v(\d)+\/interface\.yaml$", file)
+        if self.changed_since:
+            return self._get_changed_files(self.changed_since)
+        return sorted(glob.glob('./interfaces/**/interface.yaml', recursive=True))
+
+    @staticmethod
+    def _get_changed_files(ref: str) -> List[str]:
+        """Get the interface.yaml files changed since a git ref, or not yet tracked."""
+        changed = subprocess.check_output(
+            ["git", "diff", "--name-only", "--diff-filter=d", ref, "--", "interfaces"],
+            text=True,
+        ).splitlines()
+        untracked = subprocess.check_output(
+            ["git", "ls-files", "--others", "--exclude-standard", "--", "interfaces"],
+            text=True,
+        ).splitlines()
+        return sorted(
+            f"./{file}" for file in set(changed + untracked)
+            if file.endswith("/interface.yaml")
+        )
+
+    @staticmethod
+    def _validate_against_path(file, model):
+        result = PATH_REGEX.search(file)
         if not result:
             raise MatchError("invalid folder structure. should be <name>/v<version>/interface.yaml")
         if model.name != result.group(1):
@@ -72,29 +160,184 @@ class Validator:
         if model.version != int(result.group(2)):
             raise MatchError(f"version ({result.group(2)}) does not match folder structure")
 
-    """Runs the validation against all interface definitions."""
-    def run(self):
-        files = self._get_files()
-        print(f"Scanning {len(files)} interface definitions...")
-        
+    def _validate_all(self, files: List[str]) -> List[dict]:
         errors = []
+        parsed = {}
         for file in files:
-            try: 
-                raw_interface = self._read_yaml(file)
-                model = InterfaceModel(**raw_interface)
-                self._validate_against_path(file, model)
+            try:
+                parsed[file] = self._read_yaml(file)
             except yaml.error.YAMLError as e:
-                errors.append(f"{text.BOLD + text.CYAN + file + text.END}:\n{str(e)}")
-            except MatchError as e:
-                errors.append(f"{text.BOLD + text.CYAN + file + text.END}:\n{str(e)}")
-            except ValidationError as e:
-                errors.append(f"{text.BOLD + text.CYAN + file + text.END}:\n{str(e)}")
+                errors.append({"file": file, "type": "yaml", "message": str(e)})
+                if self.fail_fast:
+                    return errors
+
+        futures = []
+        if self.jobs > 1:
+            pool = ProcessPoolExecutor(self.jobs)
+            items = list(parsed.items())
+            futures = [
+                pool.submit(_validate_chunk, items[i : i + VALIDATION_CHUNK_SIZE])
+                for i in range(0, len(items), VALIDATION_CHUNK_SIZE)
+            ]
+            results = (error for future in futures for error in future.result())
+        else:
+            pool = None
+            results = map(_validate, parsed, parsed.values())
+        try:
+            for error in results:
+                if error:
+                    errors.append(error)
+                    if self.fail_fast:
+                        break
+        finally:
+            if pool:
+                # the chunks that did not start yet are not needed anymore; like
+                # shutdown(cancel_futures=True), which requires python 3.9
+                for future in futures:
+                    future.cancel()
+                pool.shutdown()
+
+        if self.cross_references and not (self.fail_fast and errors):
+            invalid = {error["file"] for error in errors}
+            valid = {file: raw for file, raw in parsed.items() if file not in invalid}
+            errors.extend(self._check_cross_references(valid))
+        return errors
+
+    @staticmethod
+    def _get_defined_names(schema_path: str) -> set:
+        """Get the names defined at the top level of a python file, without running it."""
+        with open(schema_path) as f:
+            tree = ast.parse(f.read(), schema_path)
+        names = set()
+        for node in tree.body:
+            if isinstance(node, ast.ClassDef):
+                names.add(node.name)
+            elif isinstance(node, ast.Assign):
+                names.update(target.id for target in node.targets if isinstance(target, ast.Name))
+        return names
+
+    def _check_cross_references(self, parsed: Dict[str, dict]) -> List[dict]:
+        """Check the interface.yaml files against the rest of the tree, in a single pass.
+
+        - published interfaces have a schema.py defining the schemas of both roles
+        - roles with charms registered have interface tests
+        - on full runs, index.json is up to date with the interface.yaml files
+        """
+        errors = []
+        for file, raw_interface in parsed.items():
+            version_dir = os.path.dirname(file)
+            schema_path = os.path.join(version_dir, "schema.py")
+            if raw_interface.get("status") == StatusEnum.PUBLISHED:
+                if not os.path.exists(schema_path):
+                    errors.append({"file": file, "type": "schema.py",
+                                   "message": f"published interface has no {schema_path}"})
+                else:
+                    try:
+                        names = self._get_defined_names(schema_path)
+                    except SyntaxError as e:
+                        names = set()
+                        errors.append({"file": file, "type": "schema.py",
+                                       "message": f"{schema_path} is invalid: {e}"})
+                    for name in ("ProviderSchema", "RequirerSchema"):
+                        if names and name not in names:
+                            errors.append({"file": file, "type": "schema.py",
+                                           "message": f"{schema_path} does not define {name}"})
+            for role in ("provider", "requirer"):
+                tests_path = os.path.join(version_dir, "interface_tests", f"test_{role}.py")
+                if raw_interface.get(f"{role}s") and not os.path.exists(tests_path):
+                    errors.append({"file": file, "type": "tests",
+                                   "message": f"{role}s are registered, but there is no {tests_path}"})
+
+        if not self.changed_since:
+            errors.extend(self._check_index(parsed))
+        return errors
+
+    @staticmethod
+    def _check_index(parsed: Dict[str, dict], index_path: str = "index.json") -> List[dict]:
+        loaded = [
+            (*file.split("/")[-3:-1], raw) for file, raw in sorted(parsed.items())
+            # as generate_index does
+            if not file.split("/")[-3].startswith("__")
+        ]
+        expected = get_interfaces(loaded=loaded)
+        with open(index_path) as f:
+            index = json.load(f)
+        if index == expected:
+            return []
+        missing = [i for i in expected if i not in index]
+        stale = [i for i in index if i not in expected]
+        return [{"file": index_path, "type": "index",
+                 "message": f"out of date; run utils/generate_index.py. "
+                            f"Missing: {missing}; stale: {stale}"}]
+
+    def _apply_baseline(self, errors: List[dict]) -> List[dict]:
+        """Leave out the errors recorded in the baseline."""
+        with open(self.baseline) as f:
+            known = {_error_id(error) for error in json.load(f)["errors"]}
+        new = [error for error in errors if _error_id(error) not in known]
+        ignored = len(errors) - len(new)
+        if ignored:
+            print(f"Ignoring {ignored} known errors recorded in {self.baseline}.")
+        if not self.changed_since:
+            fixed = len(known - {_error_id(error) for error in errors})
+            if fixed:
+                print(f"{fixed} errors recorded in {self.baseline} are fixed: "
+                      f"remove them with --update-baseline.")
+        return new
+
+    def update_baseline(self):
+        """Record the current cross-reference errors as the known ones."""
+        errors = self._validate_all(self._get_files())
+        known = sorted(
+            (error for error in errors if error["type"] in BASELINE_ERROR_TYPES),
+            key=_error_id,
+        )
+        with open(self.baseline, 'w') as f:
+            json.dump({"errors": known}, f, indent=2)
+            f.write("\n")
+        print(f"Recorded {len(known)} known errors in {self.baseline}.")
+
+    """Runs the validation against all interface definitions."""
+    def run(self, report: Optional[str] = None):
+        files = self._get_files()
+        print(f"Scanning {len(files)} interface definitions...")
+
+        errors = self._validate_all(files)
+        if self.baseline:
+            errors = self._apply_baseline(errors)
+        if report:
+            with open(report, 'w') as f:
+                json.dump({"files": files, "errors": errors}, f, indent=2)
 
-        
         if errors:
-            exit("\nValidation completed with errors:\n\n" + '\n---\n'.join(errors) + "\n")
+            messages = [f"{text.BOLD + text.CYAN + e['file'] + text.END}:\n{e['message']}" for e in errors]
+            exit("\nValidation completed with errors:\n\n" + '\n---\n'.join(messages) + "\n")
         else:
             print("Validation completed!")
 
 if __name__ == "__main__":
-    Validator().run()
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--changed-since", metavar="GIT_REF",
+                        help="Only validate the interface.yaml files changed since this git ref.")
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="Number of processes to validate the files with.")
+    parser.add_argument("--fail-fast", action="store_true",
+                        help="Stop at the first invalid file.")
+    parser.add_argument("--report", metavar="PATH",
+                        help="Write a JSON report of the files validated and the errors found.")
+    parser.add_argument("--cross-references", action="store_true",
+                        help="Also check the interface.yaml files against their schema.py, "
+                             "their interface tests and index.json.")
+    parser.add_argument("--baseline", metavar="PATH",
+                        help="JSON file of known cross-reference errors, which are not reported.")
+    parser.add_argument("--update-baseline", action="store_true",
+                        help="Record the current cross-reference errors in the --baseline file.")
+    args = parser.parse_args()
+    if args.update_baseline and not (args.baseline and args.cross_references):
+        parser.error("--update-baseline requires --baseline and --cross-references")
+    validator = Validator(args.changed_since, args.jobs, args.fail_fast, args.cross_references,
+                          args.baseline)
+    if args.update_baseline:
+        validator.update_baseline()
+    else:
+        validator.run(args.report)
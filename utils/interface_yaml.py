@@ -0,0 +1,163 @@
+# Copyright 2024 Canonical
+# See LICENSE file for licensing details.
+
+"""Shared reader of `interface.yaml` files.
+
+Parses with the libyaml-based loader when available, and caches the parsed files on
+disk, keyed by path, mtime and size, so that only the files that changed since the
+last run of any tool get parsed again.
+
+Usage:
+    >>> from interface_yaml import reader
+    >>> reader.read("interfaces/ingress/v1/interface.yaml")["maintainer"]
+    'observability'
+"""
+import atexit
+import contextlib
+import copy
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional, Union
+
+import yaml
+
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:  # pyyaml built without libyaml
+    from yaml import SafeLoader
+
+logger = logging.getLogger(__name__)
+
+CACHE_PATH = Path(
+    os.getenv(
+        "INTERFACE_YAML_CACHE_PATH", "/tmp/charm-relation-interfaces-yaml-cache.json"
+    )
+)
+# bump whenever the format of the cache changes
+_CACHE_VERSION = 1
+
+
+def _hash(text: str) -> str:
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+class InterfaceYamlReader:
+    """Reads yaml files, caching the parsed contents on disk."""
+
+    def __init__(self, cache_path: Optional[Path] = CACHE_PATH):
+        self.cache_path = cache_path
+        self._entries: Optional[Dict[str, dict]] = None
+        # the parsed contents, by hash of the text
+        self._parsed: Dict[str, Any] = {}
+        self._dirty = False
+
+    def _get_entries(self) -> Dict[str, dict]:
+        if self._entries is None:
+            self._entries = {}
+            if self.cache_path and self.cache_path.exists():
+                try:
+                    cache = json.loads(self.cache_path.read_text())
+                except json.JSONDecodeError:
+                    cache = {}
+                if cache.get("version") == _CACHE_VERSION:
+                    self._entries = cache["entries"]
+            for entry in self._entries.values():
+                self._parsed[entry["sha256"]] = entry["data"]
+        return self._entries
+
+    def read(self, path: Union[str, Path]) -> Any:
+        """Get the parsed contents of a yaml file."""
+        path = Path(path).absolute()
+        stat = path.stat()
+        entries = self._get_entries()
+        entry = entries.get(str(path))
+        if entry and (entry["mtime_ns"], entry["size"]) == (
+            stat.st_mtime_ns,
+            stat.st_size,
+        ):
+            return copy.deepcopy(entry["data"])
+
+        text = path.read_text()
+        data = self.loads(text)
+        try:
+            json.dumps(data)
+        except TypeError:
+            # e.g. dates: they would not survive the round trip through the cache
+            return data
+        entries[str(path)] = {
+            "mtime_ns": stat.st_mtime_ns,
+            "size": stat.st_size,
+            "sha256": _hash(text),
+            "data": data,
+        }
+        self._dirty = True
+        return copy.deepcopy(data)
+
+    def loads(self, text: str) -> Any:
+        """Parse yaml; texts that were parsed before, here or by a previous run, are not."""
+        self._get_entries()
+        digest = _hash(text)
+        if digest not in self._parsed:
+            self._parsed[digest] = yaml.load(text, Loader=SafeLoader)
+        return copy.deepcopy(self._parsed[digest])
+
+    def save(self):
+        """Write the cache to disk, if anything new was parsed."""
+        if not (self._dirty and self.cache_path):
+            return
+        cache = {"version": _CACHE_VERSION, "entries": self._entries}
+        # atomically, as several tools may run at the same time
+        tmp_path = self.cache_path.with_suffix(f".{os.getpid()}.tmp")
+        tmp_path.write_text(json.dumps(cache))
+        tmp_path.replace(self.cache_path)
+        self._dirty = False
+
+
+reader = InterfaceYamlReader()
+atexit.register(reader.save)
+
+
+class _CollectorYaml:
+    """Stands in for the yaml module in interface_tester.collector."""
+
+    def __getattr__(self, name):
+        return getattr(yaml, name)
+
+    @staticmethod
+    def safe_load(stream):
+        if isinstance(stream, str):
+            return reader.loads(stream)
+        return yaml.load(stream, Loader=SafeLoader)
+
+
+@contextlib.contextmanager
+def installed() -> Iterator[InterfaceYamlReader]:
+    """Make interface_tester.collector parse interface.yaml files through the reader.
+
+    Only within the block. The collector parses the text of the files rather than
+    reading them by path, so what it gets from the cache is keyed by the hash of the
+    text instead. If the collector no longer parses them with its `yaml` global, it
+    is left alone.
+    """
+    from interface_tester import collector
+
+    gather = getattr(collector, "_gather_charms_for_version", None)
+    if (
+        getattr(collector, "yaml", None) is not yaml
+        or gather is None
+        or "yaml" not in gather.__code__.co_names
+    ):
+        logger.warning(
+            "interface_tester.collector no longer uses the yaml module: "
+            "not parsing the interface.yaml files through the reader"
+        )
+        yield reader
+        return
+    collector.yaml = _CollectorYaml()
+    try:
+        yield reader
+    finally:
+        collector.yaml = yaml
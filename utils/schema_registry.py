@@ -0,0 +1,108 @@
+# Copyright 2024 Canonical
+# See LICENSE file for licensing details.
+
+"""Process-wide registry of the databag schemas defined in `interfaces/*/v*/schema.py`.
+
+Loading a schema.py file means executing it, which (re)builds all of its pydantic
+models. The registry does that once per file for the lifetime of the process, and
+again only if the file changes.
+
+Usage:
+    >>> from utils.schema_registry import registry
+    >>> registry.get("ingress", 1, "provider")
+    <class 'schema.ProviderSchema'>
+
+Within `installed()`, `interface_tester.collector` loads its schemas through the
+registry, for the tools (such as `collect_tests`) that go through the collector.
+"""
+
+import contextlib
+import logging
+import threading
+from pathlib import Path
+from typing import Dict, Iterator, Literal, Optional, Tuple, Type
+
+from interface_tester import collector
+from interface_tester.schema_base import DataBagSchema
+
+logger = logging.getLogger(__name__)
+
+INTERFACES_ROOT = Path(__file__).parent.parent / "interfaces"
+
+Role = Literal["provider", "requirer"]
+_Schemas = Dict[Role, Type[DataBagSchema]]
+
+# the collector's own, even while installed() replaces it
+_get_schemas = collector.get_schemas
+
+
+class SchemaRegistry:
+    """Loads each schema.py file once; memoizes its schemas by path and mtime."""
+
+    def __init__(self, root: Path = INTERFACES_ROOT):
+        self.root = root
+        self._schemas: Dict[Path, Tuple[Tuple[int, int], _Schemas]] = {}
+        # load_schema_module imports every file as the same `schema` module
+        self._lock = threading.Lock()
+
+    def load(self, schema_path: Path) -> _Schemas:
+        """Get the schemas defined in a schema.py file, by role."""
+        schema_path = Path(schema_path).absolute()
+        try:
+            stat = schema_path.stat()
+        except FileNotFoundError:
+            logger.warning(f"File does not exist: {schema_path}")
+            return {}
+        # the size too, in case the file was rewritten within the mtime resolution
+        version = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            cached = self._schemas.get(schema_path)
+            if cached and cached[0] == version:
+                return cached[1]
+            schemas = _get_schemas(schema_path)
+            self._schemas[schema_path] = (version, schemas)
+        return schemas
+
+    def get(
+        self, interface: str, version: int, role: Role
+    ) -> Optional[Type[DataBagSchema]]:
+        """Get the schema of a role of an interface version, if it defines one."""
+        return self.load(self.root / interface / f"v{version}" / "schema.py").get(role)
+
+    def clear(self):
+        """Forget all loaded schemas."""
+        with self._lock:
+            self._schemas.clear()
+
+
+registry = SchemaRegistry()
+
+
+def _collector_uses_get_schemas() -> bool:
+    """Whether the collector still looks up get_schemas as a global of its module."""
+    gather = getattr(collector, "gather_test_spec_for_version", None)
+    return gather is not None and "get_schemas" in gather.__code__.co_names
+
+
+@contextlib.contextmanager
+def installed(
+    schema_registry: SchemaRegistry = registry,
+) -> Iterator[SchemaRegistry]:
+    """Make interface_tester.collector load the schemas through a registry.
+
+    Only within the block. If the collector no longer loads them the way we expect,
+    it is left alone: it then loads each schema.py file every time it needs it.
+    """
+    if not _collector_uses_get_schemas():
+        logger.warning(
+            "interface_tester.collector no longer calls get_schemas: "
+            "not loading the schemas through the registry"
+        )
+        yield schema_registry
+        return
+    original = collector.get_schemas
+    collector.get_schemas = schema_registry.load
+    try:
+        yield schema_registry
+    finally:
+        collector.get_schemas = original
@@ -0,0 +1,169 @@
+# Copyright 2024 Canonical
+# See LICENSE file for licensing details.
+
+"""Watch the interfaces and keep the files generated from them up to date.
+
+Runs what docs/build.py, utils/generate_index.py and utils/interface-validator.py do
+on every change, but only for the interfaces that changed: the schemas and the parsed
+interface.yaml files of the others are kept in memory.
+
+Usage: PYTHONPATH=. python utils/watch.py
+"""
+import argparse
+import importlib
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from generate_index import get_catalogue, get_interfaces
+from interface_yaml import reader
+from yaml import YAMLError
+
+from docs.build import (
+    JSON_SCHEMAS_ROOT,
+    MANIFEST_PATH,
+    BuildManifest,
+    build_bundle,
+    build_schemas_from_source,
+)
+
+validator = importlib.import_module("interface-validator")
+
+logger = logging.getLogger("watch")
+
+ROOT = Path(__file__).parent.parent
+INTERFACES_ROOT = ROOT / "interfaces"
+# seconds between two scans of the interfaces for changes
+POLL_INTERVAL = 0.3
+
+_WATCHED = ("*/v*/schema.py", "*/v*/interface.yaml", "*/v*/interface_tests/test_*.py")
+
+
+def _scan(root: Path = INTERFACES_ROOT) -> Dict[Path, Tuple[int, int]]:
+    """Get the mtime and size of all the watched files."""
+    scan = {}
+    for pattern in _WATCHED:
+        for path in root.glob(pattern):
+            if "__template__" in path.parts:
+                continue
+            stat = path.stat()
+            scan[path] = (stat.st_mtime_ns, stat.st_size)
+    return scan
+
+
+class Watcher:
+    """Rebuilds what depends on the files that changed since the last scan.
+
+    The files are edited while being watched, so they may well be invalid for a while:
+    errors are logged, and the watcher carries on.
+    """
+
+    def __init__(self, root: Path = INTERFACES_ROOT, output_root: Path = ROOT):
+        self.root = root
+        # where the json schemas, the index and the catalogue are written
+        self.output_root = output_root
+        self.schemas_root = output_root / JSON_SCHEMAS_ROOT.relative_to(ROOT)
+        self.manifest = BuildManifest(output_root / MANIFEST_PATH.relative_to(ROOT))
+        # the parsed interface.yaml files, by path
+        self.interfaces: Dict[Path, dict] = {}
+        self._scan: Dict[Path, Tuple[int, int]] = {}
+
+    def _on_schema_changed(self, path: Path):
+        build_schemas_from_source(path, self.schemas_root, self.manifest)
+
+    def _on_interface_yaml_changed(self, path: Path):
+        try:
+            raw_interface = reader.read(path)
+        except YAMLError as e:
+            logger.error(f"{path}: {e}")
+            self.interfaces.pop(path, None)
+            return
+        if not isinstance(raw_interface, dict):
+            logger.error(f"{path}: expected a mapping, got {raw_interface!r}")
+            self.interfaces.pop(path, None)
+            return
+        error = validator._validate(str(path), raw_interface)
+        if error:
+            logger.error(f"{path}: {error['message']}")
+        self.interfaces[path] = raw_interface
+
+    def _update_index(self):
+        loaded = [
+            (path.parent.parent.name, path.parent.name, raw)
+            for path, raw in sorted(self.interfaces.items())
+        ]
+        outputs = {
+            self.output_root / "index.json": get_interfaces(loaded=loaded),
+            self.output_root / "catalogue.json": get_catalogue(
+                str(self.root), str(self.schemas_root), loaded=loaded
+            ),
+        }
+        for path, content in outputs.items():
+            # as generate_index.py writes them
+            serialized = json.dumps(content, indent=2)
+            if not path.exists() or path.read_text() != serialized:
+                logger.info(f"updating {path}")
+                path.write_text(serialized)
+
+    def poll(self) -> List[Path]:
+        """Rebuild what depends on the files that changed; return those files."""
+        scan = _scan(self.root)
+        changed = [path for path, stat in scan.items() if self._scan.get(path) != stat]
+        deleted = [path for path in self._scan if path not in scan]
+        self._scan = scan
+        if not (changed or deleted):
+            return []
+
+        for path in deleted:
+            self.interfaces.pop(path, None)
+        for path in sorted(changed):
+            try:
+                if path.name == "schema.py":
+                    self._on_schema_changed(path)
+                elif path.name == "interface.yaml":
+                    self._on_interface_yaml_changed(path)
+            except Exception as e:
+                logger.error(f"{path}: {e!r}")
+                self.interfaces.pop(path, None)
+        try:
+            if any(path.name == "schema.py" for path in changed + deleted):
+                build_bundle(self.schemas_root, self.schemas_root / "bundle.json")
+            self.manifest.save()
+            reader.save()
+            self._update_index()
+        except Exception as e:
+            logger.error(f"failed to update the outputs: {e!r}")
+        return changed + deleted
+
+    def run(self, poll_interval: float = POLL_INTERVAL):
+        """Rebuild everything that is out of date, then keep watching for changes."""
+        logger.info(f"watching {self.root} (press Ctrl+C to stop)")
+        try:
+            while True:
+                start = time.monotonic()
+                changed = self.poll()
+                if changed:
+                    logger.info(
+                        f"{len(changed)} files changed; "
+                        f"updated in {time.monotonic() - start:.3f}s"
+                    )
+                time.sleep(poll_interval)
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=POLL_INTERVAL,
+        help="Seconds between two scans of the interfaces for changes.",
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    os.chdir(ROOT)
+    Watcher().run(args.interval)